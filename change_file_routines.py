@@ -0,0 +1,252 @@
+# Filename: change_file_routines.py
+# Python 3.7
+# Purpose: Apply an OSM change file (.osc) to the SQLite database without rebuilding it
+
+# An OSM change file lists the <node>, <way> and <relation> elements created, modified and deleted
+#   since the extract was made, inside <create>, <modify> and <delete> sections.
+# Created and modified elements are cleaned by the same "build_dictionary_element_tree"
+#   (in file "element_to_dictionary.py") and "fixer" (in file "fix_it.py") as the csv files, then
+#   written to the database tables in place of the old rows (upsert).
+# Deleted elements are removed from the tables.
+# The consolidated tables (built by "consolidated_tables" in file "database_routines.py") are refreshed
+#   for the changed ids only.
+# The whole change file is applied in one transaction, so an error leaves the database unchanged.
+# <relation> elements are skipped because the database has no relation tables.
+
+import os
+import sqlite3 as sql
+import sys
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+import cerberus
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import compressed_input
+import element_to_dictionary
+import event_log
+import fix_it
+import main_process
+import quarantine
+
+DATABASE_PATH = "data_wrangling_project.db"
+
+change_counts = defaultdict(int)
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def change_elements(osc_file):
+    """Parse the change file and yield (action, element tree) tuples for each <node> or <way>.
+
+    Arguments:
+    osc_file -- the OSM change file to process (.osc, .osc.gz, .osc.bz2 or .osc.xz)
+    """
+    osm_file = compressed_input.open_osm(osc_file)   # Plain or compressed file
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)          # <osmChange>
+    action = None
+    section = root
+
+    for event, element in context:
+        if event == 'start':
+            if element.tag in ('create', 'modify', 'delete'):
+                action = element.tag
+                section = element
+            continue
+
+        if element.tag in ('node', 'way'):
+            yield action, element
+            section.clear()          # remove the XML element from memory
+        elif element.tag == 'relation':
+            change_counts['relation skipped'] += 1
+            section.clear()
+        elif element.tag == action:
+            root.clear()
+
+    del context
+    osm_file.close()
+    return
+
+def delete_element(cur, tag, element_id):
+    """Deletes a node or a way and its child rows from the database tables and returns None.
+
+    Arguments:
+    cur -- database cursor
+    tag -- 'node' or 'way'
+    element_id -- the ID number of the element
+    """
+    if tag == 'node':
+        cur.execute("DELETE FROM nodes WHERE id = ?;", (element_id,))
+        cur.execute("DELETE FROM nodes_tags WHERE id = ?;", (element_id,))
+    else:
+        cur.execute("DELETE FROM ways WHERE id = ?;", (element_id,))
+        cur.execute("DELETE FROM ways_tags WHERE id = ?;", (element_id,))
+        cur.execute("DELETE FROM ways_nodes WHERE id = ?;", (element_id,))
+    return
+
+def upsert_element(cur, dict):
+    """Replaces the rows of a node or a way with the rows of the cleaned dictionary and returns None.
+
+    Missing attributes are written as empty strings, as in the csv files
+
+    Arguments:
+    cur -- database cursor
+    dict -- the dictionary returned by the function build_dictionary_element_tree
+    """
+    if 'node' in dict:
+        node = dict['node']
+        delete_element(cur, 'node', node['id'])
+        cur.execute("INSERT INTO nodes (id, lat, lon, user, uid, version, changeset, timestamp) \
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                    [node.get(field, '') for field in main_process.NODE_FIELDS])
+        cur.executemany("INSERT INTO nodes_tags (id, key, value, type) VALUES (?, ?, ?, ?);",
+                        [[tag[field] for field in main_process.NODE_TAGS_FIELDS] for tag in dict['node_tags']])
+    else:
+        way = dict['way']
+        delete_element(cur, 'way', way['id'])
+        cur.execute("INSERT INTO ways (id, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?);",
+                    [way.get(field, '') for field in main_process.WAY_FIELDS])
+        cur.executemany("INSERT INTO ways_tags (id, key, value, type) VALUES (?, ?, ?, ?);",
+                        [[tag[field] for field in main_process.WAY_TAGS_FIELDS] for tag in dict['way_tags']])
+        cur.executemany("INSERT INTO ways_nodes (id, node_id, position) VALUES (?, ?, ?);",
+                        [[nd[field] for field in main_process.WAY_NODES_FIELDS] for nd in dict['way_nodes']])
+    return
+
+def refresh_consolidated_tables(cur, changed_ids):
+    """Rebuilds the rows of the consolidated tables for the changed ids and returns None.
+
+    Node and way ids can be equal, so the rows of an id are rebuilt from both the node and the way tables
+
+    Arguments:
+    cur -- database cursor
+    changed_ids -- set of the ID numbers of the changed nodes and ways
+    """
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'union_all_tags';")
+    if not cur.fetchall():
+        return                       # consolidated_tables has not been run yet
+
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS changed_ids (id INTEGER PRIMARY KEY);")
+    cur.execute("DELETE FROM changed_ids;")
+    cur.executemany("INSERT INTO changed_ids (id) VALUES (?);", [(i,) for i in changed_ids])
+
+    cur.execute("DELETE FROM union_all_tags WHERE id IN (SELECT id FROM changed_ids);")
+    cur.execute("""INSERT INTO union_all_tags
+               SELECT id, key, value, type FROM nodes_tags WHERE id IN (SELECT id FROM changed_ids)
+               UNION ALL
+               SELECT id, key, value, type FROM ways_tags WHERE id IN (SELECT id FROM changed_ids)
+               ;""")
+
+    cur.execute("DELETE FROM nodes_union_ways WHERE id IN (SELECT id FROM changed_ids);")
+    cur.execute("""INSERT INTO nodes_union_ways
+               SELECT id, user, timestamp, lat, lon FROM nodes WHERE id IN (SELECT id FROM changed_ids)
+               UNION
+               SELECT id, user, timestamp, NULL as lat, NULL as lon FROM ways WHERE id IN (SELECT id FROM changed_ids)
+               ;""")
+
+    cur.execute("DROP TABLE changed_ids;")
+    return
+
+def print_change_counts():
+    """Prints a report of the changes applied and returns None."""
+    print ('\n---------------')
+    print ('CHANGES APPLIED\n')
+    for tag in ('node', 'way'):
+        for action in ('create', 'modify', 'delete'):
+            print ('    {} {}: {:,}'.format(tag.capitalize(), action, change_counts[tag + ' ' + action]))
+    print ('    Rejected by cleaning: {:,}'.format(change_counts['rejected']))
+    print ('    Relations skipped: {:,}'.format(change_counts['relation skipped']))
+    return
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def apply_change_file(osc_file, validate=False, stats=None):
+    """Cleans the created and modified elements of a change file, applies all the changes to the
+       database in one transaction, prints a report, and returns None.
+
+    Aborts execution if a problem occurs
+
+    Arguments:
+    osc_file -- the OSM change file to process (.osc, .osc.gz, .osc.bz2 or .osc.xz)
+    validate -- boolean switch to turn on or off validation
+    stats -- the Stats (in file "fix_it.py") to count in, fix_it.default_stats if None
+    """
+    if not os.path.exists(DATABASE_PATH):
+        print ("\nDatabase does not exist...\n")
+        sys.exit()
+
+    stats = fix_it.default_stats if stats is None else stats
+    response = fix_it.initialize(stats)
+
+    if not response:
+        print ('Fatal Error initializing dictionaries')
+        print ('\nTerminating execution...')
+        return None
+
+    event_log.start()
+    quarantine.start()
+    change_counts.clear()
+    changed_ids = set()
+    validator = cerberus.Validator()
+
+    con = sql.connect(DATABASE_PATH)
+    cur = con.cursor()
+
+    print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
+
+    try:
+        for action, element in change_elements(osc_file):
+            check = element_to_dictionary.check_id(element.attrib['id'])
+            if not check:
+                stats.element_id = element.attrib['id']
+                event_log.event(stats, 'warning', 'id', 'Change ID is Null or not a number: ', element.attrib['id'])
+                if quarantine.ENABLED:
+                    quarantine.write_row(stats, element.tag.title(), 'id', element.attrib['id'],
+                                         'Change ID is Null or not a number')
+                change_counts['rejected'] += 1
+                continue
+
+            element_id = int(element.attrib['id'])
+            changed_ids.add(element_id)
+            change_counts[element.tag + ' ' + action] += 1
+
+            if action == 'delete':
+                delete_element(cur, element.tag, element_id)
+                continue
+
+            dict = element_to_dictionary.build_dictionary_element_tree(element, stats=stats)
+            if not dict:              # Same as a rebuild: the element is not in the database
+                change_counts['rejected'] += 1
+                delete_element(cur, element.tag, element_id)
+                continue
+
+            if validate is True:
+                main_process.validate_dictionary(dict, validator)
+            upsert_element(cur, dict)
+
+        refresh_consolidated_tables(cur, changed_ids)
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+        con.close()
+
+    print_change_counts()
+    fix_it.print_detailed_fixes(stats)
+    event_log.finish(stats)
+    quarantine.finish(stats)
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    apply_change_file(sys.argv[1])
@@ -0,0 +1,150 @@
+# Filename: city_index.py
+# Python 3.7
+# Notes:
+#    This is a module of fix_it.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Map a misspelled city name to the nearest accepted city name
+
+# "fix_city" (in file "fix_it.py") fixes the known typos of typo_mapping, the letter case and the
+#   'NY' abbreviations; any other value outside ok_city and other_city is removed from the dataset.
+# A CityIndex holds the trigrams of the accepted names (e.g. 'hob', 'obo', 'bok' ... of 'Hoboken'),
+#   with the names of each trigram. The method nearest looks a value up in three steps:
+#   1. count the trigrams each accepted name shares with the value; one edit changes at most four
+#      trigrams (three, or four for two swapped letters), so the names sharing too few are skipped
+#   2. compute the edit distance of the names left, counting two swapped letters as one edit
+#   3. keep the closest name if it is the only one within the edit budget of the value
+#   The budget is one edit in five letters, at most MAX_DISTANCE, so a short name needs an exact
+#   match: 'Hobokn' => 'Hoboken', 'Jersey Cty' => 'Jersey City', but 'Newark' stays 'Newark'.
+# Values are compared in lower case with single spaces, and the result of each distinct value is
+#   cached (CACHE_SIZE values at most). Set MAX_DISTANCE to 0 to only fix the letter case.
+
+from collections import defaultdict
+
+MAX_DISTANCE = 2         # Edits allowed at most
+LETTERS_PER_EDIT = 5     # Letters of the value for each edit allowed
+CACHE_SIZE = 10000       # Distinct values kept
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def fold(name):
+    """Returns the name in lower case with single spaces, the form compared by the index.
+
+    Arguments:
+    name -- a city name
+    """
+    return ' '.join(name.lower().split())
+
+def trigrams(name):
+    """Returns the set of trigrams of a folded name, padded so the first and last letters count.
+
+    Arguments:
+    name -- a name returned by fold
+    """
+    padded = '  ' + name + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b, limit):
+    """Returns the edit distance of two strings, or limit + 1 if it is more than limit.
+
+    Insertions, deletions, substitutions and two swapped neighbouring letters count one edit each.
+
+    Arguments:
+    a -- first string
+    b -- second string
+    limit -- the largest distance of interest
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            cost = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if (before is not None and i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b
+                    and before[j - 2] + 1 < cost):
+                cost = before[j - 2] + 1               # Swapped letters e.g. 'Hobkoen'
+            current[j] = cost
+        if min(current) > limit:                       # The distance only grows from here
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+# ================================================== #
+#               Main Class                           #
+# ================================================== #
+
+class CityIndex(object):
+    """Trigram index of the accepted city names, with a cache of the lookups.
+
+    Arguments:
+    names -- the accepted city names, e.g. ok_city + other_city
+    """
+    def __init__(self, names):
+        self.names = {}                    # Folded name -> accepted name
+        self.postings = defaultdict(set)   # Trigram -> folded names
+        self.cache = {}                    # Value -> accepted name or None
+        for name in names:
+            folded = fold(name)
+            self.names[folded] = name
+            for gram in trigrams(folded):
+                self.postings[gram].add(folded)
+
+    def nearest(self, name):
+        """Returns the accepted name nearest to the value within its edit budget, or None.
+
+        Arguments:
+        name -- a city value
+        """
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+
+        folded = fold(name)
+        best = self.names.get(folded)                  # Differs in letter case or spaces only
+        if best is None:
+            budget = min(MAX_DISTANCE, len(folded) // LETTERS_PER_EDIT)
+            if budget:
+                best = self.search(folded, budget)
+
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[name] = best
+        return best
+
+    def search(self, folded, budget):
+        """Returns the only accepted name closest to a folded value within the budget, or None.
+
+        Arguments:
+        folded -- a value returned by fold
+        budget -- the edits allowed
+        """
+        grams = trigrams(folded)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] += 1
+
+        least = len(grams) - 4 * budget                # Trigrams kept by a name within the budget
+        best = None
+        best_distance = budget + 1
+        tie = False
+        for candidate, count in shared.items():
+            if count < least:
+                continue
+            distance = edit_distance(folded, candidate, budget)
+            if distance < best_distance:
+                best, best_distance, tie = candidate, distance, False
+            elif distance == best_distance:
+                tie = True
+
+        if best is None or tie:
+            return None
+        return self.names[best]
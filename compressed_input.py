@@ -0,0 +1,189 @@
+# Filename: compressed_input.py
+# Python 3.7
+# Notes:
+#    This is a module of main_process.py
+#    Not to be run independently
+# Purpose: Open plain or compressed OSM files for streaming
+
+# Every routine that parses the OSM file opens it with the function "open_osm".
+# Compressed extracts (.osm.bz2, .osm.gz, .osm.xz) are decompressed on the fly, so they never
+#   need to be written to disk uncompressed.
+# Multi-stream bz2 files (pbzip2 and most OSM downloads) are split into groups of whole streams
+#   that are decompressed on a pool of threads (bz2 releases the GIL while it decompresses),
+#   and the results are fed to the XML parser in file order.
+# A single-stream bz2 file has no byte-aligned split points and is decompressed serially.
+
+import bz2
+import gzip
+import lzma
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#==========================================#
+#     Define regular expression            #
+#==========================================#
+
+# A bz2 stream header followed by the magic number of its first block
+bz2_stream_re = re.compile(rb"BZh[1-9]1AY&SY")
+
+COMPRESSED_EXTENSIONS = ('.bz2', '.gz', '.xz')
+
+READ_SIZE = 1 << 20           # Compressed bytes read at a time
+CHUNK_SIZE = 4 << 20          # Compressed bytes decompressed by one thread
+MAX_STREAM_SIZE = 16 << 20    # No stream boundary within this size means a single stream file
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def is_compressed(osm_file):
+    """Returns True if the file name has a compressed file extension.
+
+    Arguments:
+    osm_file -- the Open Street Map file name
+    """
+    return isinstance(osm_file, str) and osm_file.lower().endswith(COMPRESSED_EXTENSIONS)
+
+def stream_chunks(compressed):
+    """Reads the bz2 file and yields (offset, data) tuples of whole bz2 streams.
+
+    Yields (offset, None) and stops if no stream boundary is found, so the rest of the file
+    starting at the offset has to be decompressed serially
+
+    Arguments:
+    compressed -- the bz2 file opened in binary mode
+    """
+    buffer = b''
+    offset = 0
+
+    while True:
+        block = compressed.read(READ_SIZE)
+        if not block:
+            break
+        buffer += block
+
+        m = bz2_stream_re.search(buffer, CHUNK_SIZE)
+        while m:
+            yield offset, buffer[:m.start()]
+            offset += m.start()
+            buffer = buffer[m.start():]
+            m = bz2_stream_re.search(buffer, CHUNK_SIZE)
+
+        if len(buffer) > MAX_STREAM_SIZE:
+            yield offset, None
+            return
+
+    if buffer:
+        yield offset, buffer
+    return
+
+def decompress_streams(data):
+    """Decompresses whole bz2 streams and returns the data, or None if the data is not whole streams.
+
+    Arguments:
+    data -- compressed bytes returned by the function stream_chunks
+    """
+    try:
+        return bz2.decompress(data)
+    except (OSError, ValueError, EOFError):
+        return None
+
+def parallel_bz2_blocks(path, workers=None):
+    """Yields the decompressed data of a bz2 file in file order.
+
+    Groups of streams are decompressed on a pool of threads, with at most two groups per thread
+    in flight so memory stays bounded
+
+    Arguments:
+    path -- the bz2 file name
+    workers -- number of decompression threads, defaults to the number of CPUs
+    """
+    workers = workers or os.cpu_count() or 1
+    serial_offset = None
+
+    with open(path, 'rb') as compressed, ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        chunks = stream_chunks(compressed)
+
+        while serial_offset is None:
+            for offset, data in chunks:
+                if data is None:
+                    pending.append((offset, None))
+                    break
+                pending.append((offset, executor.submit(decompress_streams, data)))
+                if len(pending) >= 2 * workers:
+                    break
+
+            if not pending:
+                break
+
+            offset, future = pending.popleft()
+            result = future.result() if future else None
+            if result is None:          # Single stream, or a false stream boundary
+                serial_offset = offset
+                break
+            yield result
+
+        for offset, future in pending:
+            if future:
+                future.cancel()
+
+        if serial_offset is not None:
+            compressed.seek(serial_offset)
+            with bz2.BZ2File(compressed) as stream:
+                block = stream.read(READ_SIZE)
+                while block:
+                    yield block
+                    block = stream.read(READ_SIZE)
+    return
+
+class BlockReader(object):
+    """Read only file object over a generator of data blocks."""
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.buffer = b''
+        self.position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.buffer[self.position:] + b''.join(self.blocks)
+            self.buffer = b''
+            self.position = 0
+            return data
+
+        while len(self.buffer) - self.position < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer = self.buffer[self.position:] + block
+            self.position = 0
+
+        data = self.buffer[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.blocks.close()
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def open_osm(osm_file, workers=None):
+    """Opens a plain or compressed OSM file for reading in binary mode and returns the file object.
+
+    Arguments:
+    osm_file -- the Open Street Map file name (.osm, .osm.bz2, .osm.gz or .osm.xz)
+    workers -- number of bz2 decompression threads, defaults to the number of CPUs
+    """
+    name = osm_file.lower()
+
+    if name.endswith('.bz2'):
+        return BlockReader(parallel_bz2_blocks(osm_file, workers))
+    if name.endswith('.gz'):
+        return gzip.open(osm_file, 'rb')
+    if name.endswith('.xz'):
+        return lzma.open(osm_file, 'rb')
+    return open(osm_file, 'rb')
@@ -0,0 +1,15 @@
+# Filename: conftest.py
+# Python 3.7
+# Purpose: pytest settings of the checks in the test_*.py files
+
+# The 'slow' checks write large synthetic files and run the readers in new processes.
+# 'python -m pytest' runs every check; 'python -m pytest -m "not slow"' leaves out the slow ones.
+
+def pytest_configure(config):
+    """Registers the 'slow' marker and returns None.
+
+    Arguments:
+    config -- the pytest Config object
+    """
+    config.addinivalue_line('markers', 'slow: checks that take a minute or more')
+    return
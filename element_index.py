@@ -0,0 +1,357 @@
+# Filename: element_index.py
+# Python 3.7
+# Purpose: Sidecar index of the byte offset of each <node> and <way> in the OSM file, for random access
+
+# Re-examining one disputed fix otherwise means stepping through the whole file with "get_element_tree"
+#   (in file "main_process.py").
+# "build_index" scans the bytes of the memory mapped file once and writes an SQLite sidecar file
+#   ('<osm file>.idx') with the byte offset and length of every <node> and <way>, keyed by id, and
+#   the ids of the elements that have each tag key. Comments and CDATA sections are skipped, so a
+#   commented out copy of an element is not indexed.
+# "process_xml_elements" builds the index alongside the main pass with index=True.
+# "find_element" reads back a single element, and "reclean_element" runs it through
+#   "build_dictionary_element_tree" (in file "element_to_dictionary.py") and returns the cleaned
+#   dictionary with the fixes made, without touching the dictionaries, the event log or the quarantine
+#   file of the current run.
+# The index records the size and modification time of the OSM file and is refused once the file changes.
+# Random access needs an uncompressed .osm file.
+#
+# 'python element_index.py file.osm' builds the index
+# 'python element_index.py file.osm node 42' prints the original and the cleaned element
+
+import io
+import mmap
+import os
+import pprint
+import re
+import sqlite3 as sql
+import sys
+import xml.etree.cElementTree as ET
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import compressed_input
+import element_to_dictionary
+import event_log
+import fix_it
+import pbf_reader
+import quarantine
+import records
+
+#====================================#
+#     Define regular expressions     #
+#====================================#
+
+# The start of a comment or CDATA section, or the start tag of a <node> or <way>: groups are the
+#   comment or CDATA start, tag name, attributes, '/' of an empty element
+start_re = re.compile(rb"(<!--|<!\[CDATA\[)|<(node|way)((?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*(/?)>")
+# In the body of an element with a comment or CDATA section: groups are the comment or CDATA start,
+#   the end tag name, the attributes of a child <tag>
+body_re = re.compile(rb"(<!--|<!\[CDATA\[)|</(node|way)\s*>|<tag((?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*/?>")
+attr_re = re.compile(rb"([^\s=]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+tag_re = re.compile(rb"<tag((?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*/?>")   # A child <tag>: group is the attributes
+
+INSERT_ROWS = 50000       # Rows inserted into the index at a time
+
+skip_ends = {b'<!--': b'-->', b'<![CDATA[': b']]>'}    # The end of a comment and of a CDATA section
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def index_path(osm_file):
+    """Returns the file name of the sidecar index of the OSM file.
+
+    Arguments:
+    osm_file -- the Open Street Map XML file
+    """
+    return osm_file + '.idx'
+
+def attribute(attrs, name):
+    """Returns the value of the named attribute as a string with the entity references replaced,
+       or None if the attribute is missing.
+
+    Arguments:
+    attrs -- the attributes of a start tag as bytes
+    name -- the attribute name as bytes
+    """
+    for attr_name, double, single in attr_re.findall(attrs):
+        if attr_name == name:
+            return text(double or single)
+    return None
+
+def text(value):
+    """Returns the bytes of an attribute value as a string with the entity references replaced.
+
+    Arguments:
+    value -- the attribute value as bytes
+    """
+    value = value.decode('utf-8')
+    if '&' in value:
+        value = records.entity_re.sub(records.entity, value)
+    return value
+
+def skip_end(mm, m):
+    """Returns the offset after the comment or CDATA section started by the match, or -1 if it is not closed.
+
+    Arguments:
+    mm -- the memory mapped file
+    m -- the match of the start of the comment or CDATA section
+    """
+    close = skip_ends[m.group()]
+    end = mm.find(close, m.end())
+    return end if end < 0 else end + len(close)
+
+def element_body(mm, start, tag):
+    """Returns the offset after the end tag of an element and the attributes of its child <tag>
+       elements, skipping the comments and CDATA sections, or (-1, None) if the element is not closed.
+
+    Arguments:
+    mm -- the memory mapped file
+    start -- the offset after the start tag
+    tag -- the element name as bytes
+    """
+    end = mm.find(b'</' + tag + b'>', start)
+    if end >= 0 and mm.find(b'<!', start, end) < 0:          # No comment or CDATA section in the body
+        return end + len(tag) + 3, tag_re.findall(mm, start, end)
+
+    tags = []
+    pos = start
+    while True:
+        m = body_re.search(mm, pos)
+        if not m:
+            return -1, None
+        skip, end_tag, tag_attrs = m.groups()
+        if skip:
+            pos = skip_end(mm, m)
+            if pos < 0:
+                return -1, None
+        elif end_tag == tag:
+            return m.end(), tags
+        else:
+            if tag_attrs is not None:
+                tags.append(tag_attrs)
+            pos = m.end()
+
+def scan_elements(osm_file):
+    """Memory map the XML file and yield (tag, id, offset, length, keys) for each <node> and <way>.
+
+    Markup inside comments and CDATA sections is skipped, as an XML parser skips it
+
+    Arguments:
+    osm_file -- the uncompressed Open Street Map XML file
+    """
+    with open(osm_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        while True:
+            m = start_re.search(mm, pos)
+            if not m:
+                break
+            skip, tag, attrs, empty = m.groups()
+            if skip:
+                pos = skip_end(mm, m)
+                if pos < 0:
+                    break            # Truncated file
+                continue
+
+            if empty:
+                end = m.end()
+                keys = []
+            else:
+                end, tags = element_body(mm, m.end(), tag)
+                if end < 0:
+                    break            # Truncated file
+                keys = [attribute(tag_attrs, b'k') for tag_attrs in tags]
+
+            element_id = attribute(attrs, b'id')
+            yield (tag.decode(), element_id or '', m.start(), end - m.start(),
+                   [key for key in keys if key is not None])
+            pos = end
+    return
+
+def open_index(osm_file):
+    """Returns a connection to the sidecar index of the OSM file, or None if there is no up to date index.
+
+    Arguments:
+    osm_file -- the Open Street Map XML file
+    """
+    path = index_path(osm_file)
+    if not os.path.exists(path):
+        print ('No index for the file: ', osm_file)
+        return None
+
+    con = sql.connect(path)
+    cur = con.cursor()
+    cur.execute("SELECT size, mtime FROM meta;")
+    size, mtime = cur.fetchone()
+    cur.close()
+
+    stat = os.stat(osm_file)
+    if size != stat.st_size or mtime != stat.st_mtime:
+        print ('The index is out of date, rebuild it with build_index: ', path)
+        con.close()
+        return None
+    return con
+
+# ================================================== #
+#               Index Functions                      #
+# ================================================== #
+
+def build_index(osm_file):
+    """Writes the sidecar index of the byte offsets of the <node> and <way> elements and returns
+       the number of elements indexed, or None if the file cannot be indexed.
+
+    Arguments:
+    osm_file -- the uncompressed Open Street Map XML file
+    """
+    if compressed_input.is_compressed(osm_file) or pbf_reader.is_pbf(osm_file):
+        print ('The index needs an uncompressed .osm file: ', osm_file)
+        return None
+
+    path = index_path(osm_file)
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    stat = os.stat(osm_file)
+
+    con = sql.connect(temp_path)
+    with con:
+        cur = con.cursor()
+        cur.execute("CREATE TABLE meta (size INTEGER, mtime REAL);")
+        cur.execute("INSERT INTO meta (size, mtime) VALUES (?, ?);", (stat.st_size, stat.st_mtime))
+        cur.execute("CREATE TABLE elements (   \
+                    type TEXT NOT NULL,        \
+                    id TEXT NOT NULL,          \
+                    offset INTEGER NOT NULL,   \
+                    length INTEGER NOT NULL    \
+                    );")
+        cur.execute("CREATE TABLE keys (       \
+                    key TEXT NOT NULL,         \
+                    type TEXT NOT NULL,        \
+                    id TEXT NOT NULL           \
+                    );")
+
+        count = 0
+        elements = []
+        keys = []
+        for tag, element_id, offset, length, element_keys in scan_elements(osm_file):
+            count += 1
+            elements.append((tag, element_id, offset, length))
+            keys.extend((key, tag, element_id) for key in element_keys)
+            if len(elements) + len(keys) >= INSERT_ROWS:
+                cur.executemany("INSERT INTO elements VALUES (?, ?, ?, ?);", elements)
+                cur.executemany("INSERT INTO keys VALUES (?, ?, ?);", keys)
+                elements = []
+                keys = []
+        cur.executemany("INSERT INTO elements VALUES (?, ?, ?, ?);", elements)
+        cur.executemany("INSERT INTO keys VALUES (?, ?, ?);", keys)
+
+        cur.execute("CREATE INDEX elements_id ON elements (type, id);")   # Built once after the inserts
+        cur.execute("CREATE INDEX keys_key ON keys (key);")
+        cur.close()
+    con.close()
+
+    os.replace(temp_path, path)
+    return count
+
+def find_offsets(osm_file, tag, element_id):
+    """Returns a list of (offset, length) byte ranges of the elements with the tag and id, or None if
+       there is no up to date index.
+
+    An id can appear more than once in a file with corrupt data
+
+    Arguments:
+    osm_file -- the Open Street Map XML file
+    tag -- 'node' or 'way'
+    element_id -- the id of the element
+    """
+    con = open_index(osm_file)
+    if con is None:
+        return None
+    cur = con.cursor()
+    cur.execute("SELECT offset, length FROM elements WHERE type = ? AND id = ? ORDER BY offset;",
+                (tag, str(element_id)))
+    ranges = cur.fetchall()
+    cur.close()
+    con.close()
+    return ranges
+
+def find_key(osm_file, key):
+    """Returns a list of (tag, id) of the elements that have a child <tag> with the key, or None if
+       there is no up to date index.
+
+    Arguments:
+    osm_file -- the Open Street Map XML file
+    key -- the tag key, e.g. 'addr:street'
+    """
+    con = open_index(osm_file)
+    if con is None:
+        return None
+    cur = con.cursor()
+    cur.execute("SELECT DISTINCT keys.type, keys.id FROM keys JOIN elements      \
+                 ON keys.type = elements.type AND keys.id = elements.id          \
+                 WHERE keys.key = ? ORDER BY elements.offset;", (key,))
+    elements = cur.fetchall()
+    cur.close()
+    con.close()
+    return elements
+
+def find_element(osm_file, tag, element_id):
+    """Returns the element tree of the first <node> or <way> with the id, or None if it is not found.
+
+    Arguments:
+    osm_file -- the Open Street Map XML file
+    tag -- 'node' or 'way'
+    element_id -- the id of the element
+    """
+    ranges = find_offsets(osm_file, tag, element_id)
+    if not ranges:
+        return None
+    offset, length = ranges[0]
+    with open(osm_file, 'rb') as f:
+        f.seek(offset)
+        return ET.fromstring(f.read(length))
+
+def reclean_element(osm_file, tag, element_id):
+    """Cleans one element again and returns its dictionary and a snapshot of the fix_it dictionaries
+       for that element alone, or None if it is not found.
+
+    The element is counted in its own Stats, and its events and eliminated values are written to buffers
+    of its own and dropped, so the dictionaries, the event log and the quarantine file of the current
+    run are untouched; the eliminated values are still counted in the 'quarantined' of the snapshot
+
+    Arguments:
+    osm_file -- the Open Street Map XML file
+    tag -- 'node' or 'way'
+    element_id -- the id of the element
+    """
+    element_tree = find_element(osm_file, tag, element_id)
+    if element_tree is None:
+        return None
+
+    stats = fix_it.Stats()
+    with event_log.redirect(io.BytesIO()), quarantine.redirect(io.BytesIO()):
+        dict = element_to_dictionary.build_dictionary_element_tree(element_tree, stats=stats)
+    return dict, stats.snapshot()
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        count = build_index(sys.argv[1])
+        if count is not None:
+            print ('Index of {:,} nodes and ways written to {}'.format(count, index_path(sys.argv[1])))
+    else:
+        osm_file, tag, element_id = sys.argv[1:4]
+        element_tree = find_element(osm_file, tag, element_id)
+        if element_tree is None:
+            print ('Not found: ', tag, element_id)
+        else:
+            print (ET.tostring(element_tree, encoding='unicode'))
+            dict, stats = reclean_element(osm_file, tag, element_id)
+            pprint.pprint(dict)
+            pprint.pprint({name: value for name, value in stats.items() if value})
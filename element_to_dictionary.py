@@ -10,11 +10,21 @@
 #   to the "fix_it" function (in file "fix_it.py") for correcting.
 # A Python dictionary is constructed and returned back to the "process_xml_elements" function
 #   (in file "main_process.py") for writing into the csv files.
+# "build_rows_element_tree" makes the same checks and corrections and returns the csv rows as
+#   tuples in csv column order, for "process_xml_elements(..., compact=True)".
+# With a "WayNodeColumns" batch, the way node rows are appended to three typed integer arrays
+#   instead, and written to the csv file in large blocks,
+#   for "process_xml_elements(..., columnar=True)".
 
 import pprint
 import re
 import xml.etree.cElementTree as ET
+from array import array
+from collections import defaultdict
+from itertools import repeat
 
+import event_log
+import quarantine
 import fix_it
 
 #========================================================#
@@ -22,11 +32,20 @@
 #========================================================#
 
 correct_chars_re = re.compile(r"^[a-zA-Z:\-_1-9]+$")
+plain_integer_re = re.compile(r"0|[1-9][0-9]{0,17}")     # Written back unchanged from a 64 bit integer
+plain_integers_re = re.compile(r"(?:0|[1-9][0-9]{0,17})(?:,(?:0|[1-9][0-9]{0,17}))*")   # Comma separated
 
 # Be sure the field order in the csv files matches the column order in the sql table schema
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 
+KEY_CACHE_SIZE = 50000     # Raw keys remembered; an extract has a few thousand distinct keys
+
+WAY_NODES_BATCH = 100000   # Way node rows held in the columns before they are written
+
+key_cache = {}                        # (raw key, 'Node' or 'Way' or 'scan') -> classification
+key_cache_stats = defaultdict(int)    # 'hits', 'misses', 'not cached' (cache full) and the 'keys cached' of worker processes
+
 # ==================================================== #
 #               Helper Function                        #
 # ==================================================== #
@@ -44,13 +63,207 @@ def check_id(id):
     else:
         return None
 
+def cache_key(entry_key, classify):
+    """Returns the cached classification of a key, or classifies it and caches the result while
+       the cache has room.
+    
+    Arguments:
+    entry_key -- tuple of (raw key, who is asking)
+    classify -- function returning the classification of the entry key
+    """
+    entry = key_cache.get(entry_key)
+    if entry is not None:
+        key_cache_stats['hits'] += 1
+        return entry
+    
+    key_cache_stats['misses'] += 1
+    entry = classify(*entry_key)
+    if len(key_cache) < KEY_CACHE_SIZE:
+        key_cache[entry_key] = entry
+    else:
+        key_cache_stats['not cached'] += 1
+    return entry
+
+def classify_tag_key(raw_key, node_or_way):
+    """Returns the (key, accepted, bad_keys entry, tag key, tag type) classification of a child <tag> key.
+    
+    The 'cityracks.' prefix is removed from node keys; tag type is None when the key has no ':' prefix
+    
+    Arguments:
+    raw_key -- the k attribute of the child <tag>
+    node_or_way -- 'Node' or 'Way', the parent element
+    """
+    key = raw_key
+    if node_or_way == 'Node' and 'cityracks.' in key:
+        key = key.replace('cityracks.','')
+    
+    accepted = correct_chars_re.search(key) is not None    # No match returns None
+    if ':' in key:
+        k = key.split(':',1)
+        return key, accepted, node_or_way.lower() + ' key: ' + key, k[1], k[0]
+    return key, accepted, node_or_way.lower() + ' key: ' + key, key, None
+
+def classify_scan_key(raw_key, scan):
+    """Returns True if a child <tag> key is corrupt as counted by the function count_element
+       (in file "xml_csv_validation_routines.py"): a problem character and no 'cityracks' prefix.
+    
+    Arguments:
+    raw_key -- the k attribute of the child <tag>
+    scan -- 'scan', the cache entry name
+    """
+    return not correct_chars_re.search(raw_key) and not ('cityracks' in raw_key)
+
+def key_is_corrupt(raw_key):
+    """Returns True if a child <tag> key is corrupt, from the key cache.
+    
+    Arguments:
+    raw_key -- the k attribute of the child <tag>
+    """
+    return cache_key((raw_key, 'scan'), classify_scan_key)
+
+def clear_key_cache(stats_only=False):
+    """Clears the key cache and its statistics, and returns None.
+    
+    Arguments:
+    stats_only -- keep the cached keys, e.g. in a worker process between batches
+    """
+    if not stats_only:
+        key_cache.clear()
+    key_cache_stats.clear()
+    return
+
+def key_cache_counts():
+    """Returns the statistics of the key cache as a dictionary, for the function merge_key_cache_counts
+       of the parent of a worker process."""
+    counts = dict(key_cache_stats)
+    counts['keys cached'] = max(len(key_cache), key_cache_stats.get('keys cached', 0))
+    return counts
+
+def merge_key_cache_counts(counts):
+    """Adds the statistics of the key cache of a worker process and returns None.
+    
+    Arguments:
+    counts -- a dictionary returned by the function key_cache_counts
+    """
+    for name, count in counts.items():
+        if name == 'keys cached':         # The largest cache of the processes
+            key_cache_stats[name] = max(key_cache_stats[name], count)
+        else:
+            key_cache_stats[name] += count
+    return
+
+def print_key_cache_stats():
+    """Prints the hit rate of the key cache and returns None.
+    
+    With worker processes, the keys cached are those of the largest cache of the processes
+    """
+    lookups = key_cache_stats['hits'] + key_cache_stats['misses']
+    print ('\nKey cache:')
+    print ('    Lookups: {:,}'.format(lookups))
+    print ('    Hits: {:,}   Hit rate: {:.1%}'.format(key_cache_stats['hits'],
+                                                   key_cache_stats['hits'] / lookups if lookups else 0))
+    print ('    Keys cached: {:,} of {:,}'.format(max(len(key_cache), key_cache_stats['keys cached']), KEY_CACHE_SIZE))
+    print ('    Keys not cached (cache full): {:,}'.format(key_cache_stats['not cached']))
+    return
+
+def clean_tag(child, node_or_way, default_tag_type='regular', stats=None):
+    """Checks the key of a child <tag>, sends the value to the function fixer for correction or
+       elimination, and returns a (key, value, type) tuple or None if the child tag is eliminated.
+    
+    Arguments:
+    child -- the child <tag> element
+    node_or_way -- 'Node' or 'Way', the parent element
+    default_tag_type -- the type of a key without a ':' prefix
+    stats -- the Stats of the run (in file "fix_it.py"), fix_it.default_stats if None
+    """
+    if stats is None:
+        stats = fix_it.default_stats
+    parent = node_or_way.lower()
+    key, accepted, infoKey, tag_key, tag_type = cache_key((child.attrib['k'], node_or_way), classify_tag_key)
+    
+    if key != child.attrib['k']:             # 'cityracks.' prefix removed
+        child.attrib['k'] = key
+    
+    if not accepted:
+        if parent == 'node':
+            event_log.event(stats, 'warning', 'key', 'Node key -- Problem character!   ', 'key =  ', key,
+                            '   value =  ', child.attrib['v'])
+        else:
+            event_log.event(stats, 'warning', 'key', 'Way key -- Problem char!   ', 'key =  ', key,
+                            '   value =  ', child.attrib['v'])
+        stats.counts[parent + ' child key eliminated'] += 1
+        fix_it.tally(stats, 'bad_keys', infoKey)
+        if quarantine.ENABLED:
+            quarantine.write_row(stats, node_or_way, key, child.attrib['v'], 'Key -- Problem character')
+        return None      # eliminate the problematic child tag
+    
+    # Fix value
+    fixed = fix_it.fixer(child, node_or_way, stats)    # Correct or eliminate the child <tag> value
+                                                # Function fix_it returns None if there is a data problem
+    if fixed == '$skip':
+        stats.counts[parent + ' tag skipped'] += 1
+        return None
+    
+    if not fixed:
+        stats.counts[parent + ' child value eliminated'] += 1
+        return None                 # Eliminate this child tag
+    
+    stats.counts[parent + ' tag count'] += 1     # count the child tags not eliminated
+    return tag_key, fixed, default_tag_type if tag_type is None else tag_type
+
+def clean_nd(child, stats=None):
+    """Checks the reference of a child <nd> and returns it, or None if it is corrupt.
+    
+    Arguments:
+    child -- the child <nd> element
+    stats -- the Stats of the run (in file "fix_it.py"), fix_it.default_stats if None
+    """
+    if stats is None:
+        stats = fix_it.default_stats
+    check = check_id(child.attrib['ref'])
+    
+    if not check:
+        event_log.event(stats, 'warning', 'reference', 'Way Node reference is Null or not a number: ',
+                        child.attrib['ref'])
+        fix_it.tally(stats, 'way_node_reference_bad', child.attrib['ref'])
+        if quarantine.ENABLED:
+            quarantine.write_row(stats, 'Way', 'nd', child.attrib['ref'], 'Way Node reference is Null or not a number')
+        return None
+    
+    stats.counts['way node tag count'] += 1     # count the child tags not eliminated
+    return child.attrib['ref']
+
+def check_element_id(element, stats=None):
+    """Checks the ID of a <node> or <way> and returns a boolean, counting a corrupt ID.
+    
+    Arguments:
+    element -- the current element tree in the XML file iteration
+    stats -- the Stats of the run (in file "fix_it.py"), fix_it.default_stats if None
+    """
+    if stats is None:
+        stats = fix_it.default_stats
+    stats.element_id = element.attrib['id']     # The element of the values written to the quarantine
+    
+    if check_id(element.attrib['id']):
+        return True
+    
+    if element.tag == 'node':
+        event_log.event(stats, 'warning', 'id', 'Node ID is Null or not a number: ', element.attrib['id'])
+        fix_it.tally(stats, 'node_id_bad', element.attrib['id'])
+    else:
+        event_log.event(stats, 'warning', 'id', 'Way ID is Null or not a number: ', element.attrib['id'])
+        fix_it.tally(stats, 'way_id_bad', element.attrib['id'])
+    if quarantine.ENABLED:
+        quarantine.write_row(stats, element.tag.title(), 'id', element.attrib['id'], 'ID is Null or not a number')
+    return False
+
 # ================================================================= #
 #       Function to build a dictionary from the element tree        #
 # ================================================================= #
 
 
 def build_dictionary_element_tree(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                                  default_tag_type='regular'):
+                                  default_tag_type='regular', stats=None):
     """Function takes an iterparse Element object (element tree) as an input and returns a dictionary.
     
     Checks ID, key and reference
@@ -62,22 +275,22 @@ def build_dictionary_element_tree(element, node_attr_fields=NODE_FIELDS, way_att
     node_attr_fields -- list of attributes for <node> tag
     way_attr_fields -- list of attributes for <way> tag
     default_tag_type -- set to 'regular'
+    stats -- the Stats of the run (in file "fix_it.py"), fix_it.default_stats if None
     """
+    if stats is None:
+        stats = fix_it.default_stats
+    
     node_attribs = {}
     way_attribs = {}
     way_nodes = []
     tags = []           # Handle secondary tags the same way for both node and way elements
     
     if element == None:
-        print ('Element is Null')
+        event_log.event(stats, 'error', 'element', 'Element is Null')
         return None
     
     if element.tag == 'node':
-        check = check_id(element.attrib['id'])
-        
-        if not check:
-            print ('Node ID is Null or not a number: ', element.attrib['id'])
-            fix_it.node_id_bad[element.attrib['id']] += 1
+        if not check_element_id(element, stats):
             return None
         
         for attr in element.attrib:
@@ -85,53 +298,14 @@ def build_dictionary_element_tree(element, node_attr_fields=NODE_FIELDS, way_att
                 node_attribs[attr] = element.attrib[attr]
         
         for child in element:
-            temp = { }
-            
-            if 'cityracks.' in child.attrib['k']:
-                child.attrib['k'] = child.attrib['k'].replace('cityracks.','')
-                   
-            m = correct_chars_re.search(child.attrib['k'])    # No match returns None
-
-            if not m:    
-                print ('Node key -- Problem character!   ', 'key =  ', child.attrib['k'], '   value =  ', child.attrib['v'])
-                fix_it.counts['node child key eliminated'] += 1
-                infoKey = 'node key: ' + child.attrib['k']
-                fix_it.bad_keys[infoKey] += 1
-                continue      # eliminate the problematic child tag
-            
-            # Fix value
-            fixed = fix_it.fixer(child, 'Node')       # Correct or eliminate the child <tag> value
-                                                # Function fix_it returns None if there is a data problem
-            if fixed == '$skip':
-                fix_it.counts['node tag skipped'] += 1
-                continue
-            
-            if not fixed:
-                fix_it.counts['node child value eliminated'] += 1
-                continue                 # Eliminate this child tag
-            else:
-                temp['id'] = element.attrib['id']     # Save the fixed child tag for writing into csv file
-                temp['value'] = fixed
-            
-            if ':' in child.attrib['k']:
-                k = child.attrib['k'].split(':',1)
-                temp['type'] = k[0]
-                temp['key'] = k[1]
-            else:
-                temp['key'] = child.attrib['k']
-                temp['type'] = default_tag_type
-            
-            fix_it.counts['node tag count'] += 1     # count the child tags not eliminated
-            tags.append(temp)
+            tag = clean_tag(child, 'Node', default_tag_type, stats)
+            if tag:                  # Save the fixed child tag for writing into csv file
+                tags.append({'id': element.attrib['id'], 'key': tag[0], 'value': tag[1], 'type': tag[2]})
         
         return {'node': node_attribs, 'node_tags': tags}
     
     elif element.tag == 'way':
-        check = check_id(element.attrib['id'])
-        
-        if not check:
-            print ('Way ID is Null or not a number: ', element.attrib['id'])
-            fix_it.way_id_bad[element.attrib['id']] += 1
+        if not check_element_id(element, stats):
             return None
         
         for attr in element.attrib:  
@@ -140,60 +314,143 @@ def build_dictionary_element_tree(element, node_attr_fields=NODE_FIELDS, way_att
         
         position = 0
         for child in element:
-            temp = { }
-            
             if child.tag == 'tag':
-                m = correct_chars_re.search(child.attrib['k'])    # No match returns None
-                
-                if not m:
-                    print ('Way key -- Problem char!   ', 'key =  ', child.attrib['k'], '   value =  ', child.attrib['v'])
-                    fix_it.counts['way child key eliminated'] += 1
-                    infoKey = 'way key: ' + child.attrib['k']
-                    fix_it.bad_keys[infoKey] += 1
-                    continue     # eliminate the problematic child tag
-                
-                # Fix value
-                fixed = fix_it.fixer(child, 'Way')        # Correct or eliminate the child <tag> value
-                                             # Function fix_it returns None if there is a data problem
-                if fixed == '$skip':
-                    fix_it.counts['way tag skipped'] += 1
-                    continue
-                
-                if not fixed:
-                    fix_it.counts['way child value eliminated'] += 1
-                    continue                 # Eliminate this child tag
-                else:
-                    temp['id'] = element.attrib['id']     # Save the fixed child tag for writing into csv file
-                    temp['value'] = fixed
-
-                if ':' in child.attrib['k']:
-                    k = child.attrib['k'].split(':',1)
-                    temp['type'] = k[0]
-                    temp['key'] = k[1]
-                else:
-                    temp['key'] = child.attrib['k']
-                    temp['type'] = default_tag_type
-                
-                fix_it.counts['way tag count'] += 1     # count the child tags not eliminated
-                tags.append(temp)
+                tag = clean_tag(child, 'Way', default_tag_type, stats)
+                if tag:              # Save the fixed child tag for writing into csv file
+                    tags.append({'id': element.attrib['id'], 'key': tag[0], 'value': tag[1], 'type': tag[2]})
             
             elif child.tag == 'nd':
-                check = check_id(child.attrib['ref'])
-                
-                if not check:
-                    print ('Way Node reference is Null or not a number: ', child.attrib['ref'])
-                    fix_it.way_node_reference_bad[child.attrib['ref']] += 1
-                    continue
-                
-                temp['id'] = element.attrib['id']
-                temp['node_id'] = child.attrib['ref']
-                temp['position'] = position
-                position += 1
-                fix_it.counts['way node tag count'] += 1     # count the child tags not eliminated
-                way_nodes.append(temp)
+                ref = clean_nd(child, stats)
+                if ref:
+                    way_nodes.append({'id': element.attrib['id'], 'node_id': ref, 'position': position})
+                    position += 1
         
-        #print ('way_attribs:\n', way_attribs)
-        #print ('way_nodes:\n', way_nodes)
-        #print ('way_tags:\n', tags)
-        #print ('---------------\n')
         return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+
+# ============================================================== #
+#       Function to build compact rows from the element tree     #
+# ============================================================== #
+
+def build_rows_element_tree(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                            default_tag_type='regular', way_node_columns=None, stats=None):
+    """Same checks and corrections as the function build_dictionary_element_tree, but returns the
+       csv rows as tuples in csv column order instead of a dictionary per row.
+    
+    Returns a dictionary with the same keys as build_dictionary_element_tree, or None
+    The <node> or <way> row has None for a missing attribute, written as an empty field by csv.writer
+    Child rows are (id, key, value, type) for tags and (id, node_id, position) for way nodes
+    With way_node_columns, the way node rows are appended to the columns and 'way_nodes' is empty,
+    unless an id is not a plain integer: then the rows of the way are returned as tuples as usual
+    
+    Arguments:
+    element -- the current element tree in the XML file iteration
+    node_attr_fields -- list of attributes for <node> tag, in csv column order
+    way_attr_fields -- list of attributes for <way> tag, in csv column order
+    default_tag_type -- set to 'regular'
+    way_node_columns -- optional WayNodeColumns batch collecting the way node rows
+    stats -- the Stats of the run (in file "fix_it.py"), fix_it.default_stats if None
+    """
+    if stats is None:
+        stats = fix_it.default_stats
+    
+    if element == None:
+        event_log.event(stats, 'error', 'element', 'Element is Null')
+        return None
+    
+    if element.tag not in ('node', 'way') or not check_element_id(element, stats):
+        return None
+    
+    attrib = element.attrib
+    element_id = attrib['id']
+    tags = []
+    
+    if element.tag == 'node':
+        for child in element:
+            tag = clean_tag(child, 'Node', default_tag_type, stats)
+            if tag:
+                tags.append((element_id,) + tag)
+        return {'node': tuple([attrib.get(attr) for attr in node_attr_fields]), 'node_tags': tags}
+    
+    refs = []
+    for child in element:
+        if child.tag == 'tag':
+            tag = clean_tag(child, 'Way', default_tag_type, stats)
+            if tag:
+                tags.append((element_id,) + tag)
+        elif child.tag == 'nd':
+            ref = clean_nd(child, stats)
+            if ref:
+                refs.append(ref)
+    
+    if way_node_columns is not None and way_node_columns.extend(element_id, refs):
+        way_nodes = []
+    else:
+        way_nodes = [(element_id, ref, position) for position, ref in enumerate(refs)]
+    return {'way': tuple([attrib.get(attr) for attr in way_attr_fields]), 'way_nodes': way_nodes,
+            'way_tags': tags}
+
+# ============================================================== #
+#       Columnar batch of the way node rows                      #
+# ============================================================== #
+
+class WayNodeColumns(object):
+    """The way node rows of many ways held as three typed integer arrays (id, node_id, position),
+       instead of a tuple or dictionary per row.
+    
+    Only ids written back unchanged by str(int(id)) are held; see the method extend
+    """
+    __slots__ = ('id', 'node_id', 'position')
+    
+    def __init__(self):
+        self.id = array('q')
+        self.node_id = array('q')
+        self.position = array('q')
+    
+    def __len__(self):
+        return len(self.id)
+    
+    def extend(self, way_id, refs):
+        """Appends the rows of one way and returns True, or returns False and appends nothing
+           if an id is not a plain integer (leading zeros, spaces, other digits, too large).
+        
+        Arguments:
+        way_id -- the id attribute of the <way>
+        refs -- the ref attributes of the child <nd> elements kept, in order
+        """
+        if not plain_integer_re.fullmatch(way_id):
+            return False
+        if refs:
+            joined = ','.join(refs)          # One match for all the refs of the way
+            if not plain_integers_re.fullmatch(joined) or joined.count(',') != len(refs) - 1:
+                return False
+        self.id.extend(repeat(int(way_id), len(refs)))
+        self.node_id.fromlist(list(map(int, refs)))
+        self.position.extend(range(len(refs)))
+        return True
+    
+    def rows(self, start=0):
+        """Returns an iterator of the (id, node_id, position) rows.
+        
+        Arguments:
+        start -- the first row, e.g. the length of the columns before the rows of a way were appended
+        """
+        if start:
+            return zip(self.id[start:], self.node_id[start:], self.position[start:])
+        return zip(self.id, self.node_id, self.position)
+    
+    def clear(self):
+        """Empties the columns, and returns None."""
+        del self.id[:], self.node_id[:], self.position[:]
+        return
+
+def write_way_node_columns(columns, writer):
+    """Writes the rows held in the columns with a csv writer, empties the columns, and returns the row count.
+    
+    Arguments:
+    columns -- the WayNodeColumns batch
+    writer -- csv.writer of the ways_nodes csv file
+    """
+    count = len(columns)
+    writer.writerows(columns.rows())
+    columns.clear()
+    return count
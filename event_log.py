@@ -0,0 +1,242 @@
+# Filename: event_log.py
+# Python 3.7
+# Notes:
+#    This is a module of main_process.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Send the messages of the eliminated values and elements to the console, a JSON lines file or
+#          only the summary counts
+
+# Every value, key, id or reference removed from the dataset is reported through the function "event",
+#   with a level ('debug', 'info', 'warning' or 'error') and a category (the fixer name, or 'key',
+#   'id', 'reference' and 'element' in file "element_to_dictionary.py").
+# MODE chooses where the events go:
+#   'console' -- printed one line at a time, as before (the default)
+#   'jsonl'   -- written to LOG_PATH as one compact JSON object per line, through a buffer of
+#                BUFFER_SIZE bytes, so a run does not wait on the console
+#   'summary' -- only counted
+# Events below LEVEL are only counted. SAMPLE_EVERY keeps one event in N of a category, and RATE_LIMITS
+#   keeps at most N events per second of a category; the others are only counted.
+# The counts are kept in the Stats of the run (in file "fix_it.py"), so they merge across processes:
+#   'events' counts every event of a category and 'events_logged' the events written or printed.
+# "start" opens the log file of a run, "finish" closes it and prints the counts unless MODE is 'console'.
+
+import contextlib
+import json
+import shutil
+import time
+from collections import defaultdict
+
+MODE = 'console'
+LOG_PATH = 'events.jsonl'
+LEVEL = 'info'
+SAMPLE_EVERY = {}          # Category -> keep one event in N
+RATE_LIMITS = {}           # Category -> events kept per second
+
+BUFFER_SIZE = 1 << 20      # Bytes buffered before the log file is written
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+encode = json.JSONEncoder(ensure_ascii=False).encode
+prefixes = {}                                # (level, category) -> start of the JSON line, encoded once
+sink = None                                  # The binary log file, or a buffer of a worker process
+sampled = defaultdict(int)                   # Category -> events seen by the sampling
+buckets = {}                                 # Category -> [tokens left, time of the last refill]
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def configure(mode=None, path=None, level=None, sample_every=None, rate_limits=None):
+    """Sets the options of the event log for the next runs, and returns None.
+
+    Arguments left as None keep their current value
+
+    Arguments:
+    mode -- 'console', 'jsonl' or 'summary'
+    path -- the JSON lines file written in 'jsonl' mode
+    level -- the lowest level written: 'debug', 'info', 'warning' or 'error'
+    sample_every -- dictionary of category -> keep one event in N
+    rate_limits -- dictionary of category -> events kept per second
+    """
+    global MODE, LOG_PATH, LEVEL, SAMPLE_EVERY, RATE_LIMITS
+    if mode is not None:
+        if mode not in ('console', 'jsonl', 'summary'):
+            raise ValueError('Event log mode must be console, jsonl or summary: ' + repr(mode))
+        MODE = mode
+    if level is not None:
+        if level not in LEVELS:
+            raise ValueError('Event log level must be one of {}: {!r}'.format(sorted(LEVELS), level))
+        LEVEL = level
+    if path is not None:
+        LOG_PATH = path
+    if sample_every is not None:
+        SAMPLE_EVERY = dict(sample_every)
+    if rate_limits is not None:
+        RATE_LIMITS = dict(rate_limits)
+    return
+
+def settings():
+    """Returns the options of the event log as a tuple, for the function configure of a worker process."""
+    return MODE, LOG_PATH, LEVEL, SAMPLE_EVERY, RATE_LIMITS
+
+def allowed(category):
+    """Returns True if the sampling and the rate limit of the category keep the next event.
+
+    Arguments:
+    category -- the event category
+    """
+    every = SAMPLE_EVERY.get(category)
+    if every:
+        seen = sampled[category]
+        sampled[category] = seen + 1
+        if seen % every:
+            return False
+
+    rate = RATE_LIMITS.get(category)
+    if rate is not None:
+        now = time.monotonic()
+        bucket = buckets.get(category)
+        if bucket is None:
+            bucket = buckets[category] = [rate, now]
+        else:               # Refill at the rate, up to one second of events
+            bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+    return True
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+
+def event(stats, level, category, *args):
+    """Counts an event in the Stats of the run, prints or writes it unless it is dropped, and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run
+    level -- 'debug', 'info', 'warning' or 'error'
+    category -- the event category, e.g. 'phone' or 'id'
+    args -- the items of the message, as printed by print
+    """
+    stats.events[category] += 1
+    if MODE == 'summary' or LEVELS[level] < LEVELS[LEVEL] or not allowed(category):
+        return
+
+    stats.events_logged[category] += 1
+    if MODE == 'console':
+        print (*args)
+    else:
+        if sink is None:       # An event outside a run
+            open_log(append=True)
+        prefix = prefixes.get((level, category))
+        if prefix is None:
+            prefix = prefixes[level, category] = '{{"level":{},"category":{},"message":'.format(encode(level),
+                                                                                          encode(category))
+        sink.write((prefix + encode(' '.join(map(str, args))) + '}\n').encode('utf-8'))
+    return
+
+def start(length=None, append=False):
+    """Resets the sampling and rate limits and opens the log file in 'jsonl' mode, and returns None.
+
+    Arguments:
+    length -- truncate the log file to this many bytes and append to it, e.g. when resuming a run
+    append -- append to the log file instead of replacing it
+    """
+    close()
+    sampled.clear()
+    buckets.clear()
+    if MODE == 'jsonl':
+        open_log(length, append)
+    return
+
+def open_log(length=None, append=False):
+    """Opens the log file with a buffer of BUFFER_SIZE bytes and returns None.
+
+    Arguments:
+    length -- truncate the log file to this many bytes and append to it
+    append -- append to the log file instead of replacing it
+    """
+    global sink
+    if length is not None:
+        with open(LOG_PATH, 'r+b') as log_file:
+            log_file.truncate(length)        # Drop the events written after the checkpoint
+        append = True
+    sink = open(LOG_PATH, 'ab' if append else 'wb', buffering=BUFFER_SIZE)
+    return
+
+def flush():
+    """Writes the buffered events to the log file and returns its length in bytes, or None if no log file is open."""
+    if sink is None:
+        return None
+    sink.flush()
+    return sink.tell()
+
+def close():
+    """Writes the buffered events and closes the log file, and returns None."""
+    global sink
+    if sink is not None:
+        sink.close()
+        sink = None
+    return
+
+@contextlib.contextmanager
+def redirect(buffer):
+    """Context manager that sends the 'jsonl' events to a buffer instead of the log file, e.g. in a
+       worker process whose events are written in input order by the parent process.
+
+    Arguments:
+    buffer -- a binary file object, e.g. io.BytesIO
+    """
+    global sink
+    saved = sink
+    sink = buffer
+    try:
+        yield buffer
+    finally:
+        sink = saved
+
+def write(data):
+    """Writes the events of a worker process to the log file and returns None.
+
+    Arguments:
+    data -- the bytes of the redirected events, or a binary file object to copy
+    """
+    if not data or MODE != 'jsonl':
+        return
+    if sink is None:
+        open_log(append=True)
+    if isinstance(data, bytes):
+        sink.write(data)
+    else:
+        shutil.copyfileobj(data, sink)
+    return
+
+def finish(stats):
+    """Closes the log file and, unless MODE is 'console', prints the event counts, and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run
+    """
+    close()
+    if MODE != 'console':
+        print_event_summary(stats)
+    return
+
+def print_event_summary(stats):
+    """Prints the events and the events logged of each category, and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run
+    """
+    print ('\n---------')
+    print ('EVENT LOG\n')
+    print ('    {:<12} {:>10} {:>10} {:>10}'.format('Category', 'Events', 'Logged', 'Dropped'))
+    for category, total in sorted(stats.events.items(), key=lambda item: -item[1]):
+        logged = stats.events_logged.get(category, 0)
+        print ('    {:<12} {:>10,} {:>10,} {:>10,}'.format(category, total, logged, total - logged))
+    if MODE == 'jsonl':
+        print ('\nEvents written to', LOG_PATH)
+    elif MODE == 'summary':
+        print ('\nSummary only -- no events written')
+    return
@@ -7,14 +7,19 @@
 # Purpose: Correct problematic data
 
 import xml.etree.cElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import json
 import re
 from email.utils import parseaddr
 from urllib.parse import urlparse
 import pprint
-import operator
 
+import city_index
 import element_to_dictionary
+import event_log
+import fix_rules
+import heavy_hitters
+import quarantine
 
 pp = pprint.PrettyPrinter(indent=4, width=20)
 
@@ -22,106 +27,166 @@
 #     Construct dictionaries     #
 #================================#
 
-streets_issue = defaultdict(int)
-us_states_issue = defaultdict(int)
-us_states_problem = defaultdict(int)
-cities_issue = defaultdict(int)
-cities_problem = defaultdict(int)
-phones_issue = defaultdict(int)
-emails_issue = defaultdict(int)
-websites_issue = defaultdict(int)
-zipcodes_issue = defaultdict(int)
-tiger_issue = defaultdict(int)
-
-streets_fix = defaultdict(int)
-streets_dict = defaultdict(dict)
-cities_fix = defaultdict(int)
-cities_dict = defaultdict(dict)
-us_states_fix = defaultdict(int)
-us_states_dict = defaultdict(dict)
-
-zipcodes_fix = defaultdict(int)
-zipcodes_dict = defaultdict(dict)
-phones_fix = defaultdict(int)
-phones_dict = defaultdict(dict)
-tiger_fix = defaultdict(int)
-tiger_dict = defaultdict(dict)
-
-house_fix = defaultdict(int)
-house_dict = defaultdict(dict)
-cuisine_fix = defaultdict(int)
-cuisine_dict = defaultdict(dict)
-
-counts = defaultdict(int)
-value_issue = defaultdict(list)
-
-bad_keys = defaultdict(int)
-way_id_bad = defaultdict(int)
-node_id_bad = defaultdict(int)
-way_node_reference_bad = defaultdict(int)
+#  Names of the dictionaries of a run, saved and merged between processes
+stats_names = ['counts', 'value_issue',
+               'streets_issue', 'us_states_issue', 'us_states_problem', 'cities_issue', 'cities_problem',
+               'phones_issue', 'emails_issue', 'websites_issue', 'zipcodes_issue', 'tiger_issue',
+               'streets_fix', 'cities_fix', 'us_states_fix', 'zipcodes_fix', 'phones_fix', 'tiger_fix',
+               'house_fix', 'cuisine_fix',
+               'streets_dict', 'cities_dict', 'us_states_dict', 'zipcodes_dict', 'phones_dict', 'tiger_dict',
+               'house_dict', 'cuisine_dict',
+               'bad_keys', 'way_id_bad', 'node_id_bad', 'way_node_reference_bad',
+               'events', 'events_logged', 'quarantined']
+
+#  Each fix dictionary records the running total of its fix counter
+fix_counters = {'streets_dict': 'streets_fix',
+                'cities_dict': 'cities_fix',
+                'us_states_dict': 'us_states_fix',
+                'zipcodes_dict': 'zipcodes_fix',
+                'phones_dict': 'phones_fix',
+                'tiger_dict': 'tiger_fix',
+                'house_dict': 'house_fix',
+                'cuisine_dict': 'cuisine_fix'}
+
+class Stats(object):
+    """The counts and dictionaries of the data corrections and eliminations of one run.
+    
+    One attribute per name in stats_names, e.g. stats.counts or stats.streets_issue
+    A run passes its Stats through the readers, "build_dictionary_element_tree" (in file
+    "element_to_dictionary.py") and the fixers, so runs in separate processes or threads each
+    count into their own Stats; the method merge adds them up in input order
+    The dictionaries of SKETCH_NAMES are sketches of the most counted values when the sketches are
+    enabled (in file "heavy_hitters.py")
+    """
+    __slots__ = stats_names + ['recording', 'element_id', 'reason']
+    
+    def __init__(self):
+        for name in stats_names:
+            if name in fix_counters:
+                setattr(self, name, defaultdict(dict))
+            elif name == 'value_issue':
+                setattr(self, name, defaultdict(list))
+            elif name in heavy_hitters.SKETCH_NAMES:
+                setattr(self, name, heavy_hitters.new_counter())
+            else:
+                setattr(self, name, defaultdict(int))
+        self.recording = None     # Side effects of the fixer run by the memo (see the function memo_fix)
+        self.element_id = None    # The id of the element being cleaned, for the quarantine (in file "quarantine.py")
+        self.reason = None        # The message of the latest warning of a fixer, for the quarantine
+    
+    def clear(self):
+        """Clears the dictionaries and returns None."""
+        for name in stats_names:
+            if name in heavy_hitters.SKETCH_NAMES:
+                setattr(self, name, heavy_hitters.new_counter())     # Exact or sketch, as now configured
+            else:
+                getattr(self, name).clear()
+        self.recording = None
+        self.element_id = None
+        self.reason = None
+        return
+    
+    def total(self, name):
+        """Returns the number of values counted by a dictionary of eliminated values, including the
+           values written to the quarantine file (in file "quarantine.py").
+        
+        Arguments:
+        name -- the dictionary name, e.g. 'streets_issue' or 'value_issue'
+        """
+        dic = getattr(self, name)
+        if name == 'value_issue':
+            total = sum(len(values) for values in dic.values())
+        else:
+            total = sum(dic.values())
+        return total + self.quarantined.get(name, 0)
+    
+    def sketch_errors(self):
+        """Returns the errors of the counts of each sketch (in file "heavy_hitters.py"), by dictionary name."""
+        return {name: getattr(self, name).errors for name in heavy_hitters.SKETCH_NAMES
+                if isinstance(getattr(self, name), heavy_hitters.SpaceSaving)}
+    
+    def snapshot(self):
+        """Returns a copy of the dictionaries as plain dictionaries.
+        
+        The errors of the sketches, if any, are under 'sketch_errors'
+        """
+        stats = {}
+        for name in stats_names:
+            dic = getattr(self, name)
+            if name in fix_counters:
+                stats[name] = {key: dict(val) for key, val in dic.items()}
+            elif name == 'value_issue':
+                stats[name] = {key: list(val) for key, val in dic.items()}
+            else:
+                stats[name] = dict(dic)
+        errors = self.sketch_errors()
+        if errors:
+            stats['sketch_errors'] = {name: dict(val) for name, val in errors.items()}
+        return stats
+    
+    def merge(self, stats):
+        """Adds the dictionaries of another run and returns None.
+        
+        Runs must be merged in input order so the dictionaries end up with the same key order
+        and fix totals as a single serial run over the whole file.
+        
+        Arguments:
+        stats -- a Stats, or a dictionary returned by the method snapshot (e.g. from another process or an older checkpoint)
+        """
+        if isinstance(stats, Stats):
+            stats = dict({name: getattr(stats, name) for name in stats_names}, sketch_errors=stats.sketch_errors())
+        
+        for name, fix_name in fix_counters.items():     # Before the fix counters are added to
+            dic = getattr(self, name)
+            fix = getattr(self, fix_name)
+            for key, val in stats.get(name, {}).items():
+                for better, total in val.items():
+                    dic[key][better] = fix.get(key, 0) + total
+        
+        for name in stats_names:
+            if name in fix_counters:
+                continue
+            dic = getattr(self, name)
+            if isinstance(dic, heavy_hitters.SpaceSaving):
+                dic.merge(stats.get(name, {}), stats.get('sketch_errors', {}).get(name))
+                continue
+            for key, val in stats.get(name, {}).items():
+                dic[key] += val          # Adds counts or extends lists
+        return
+    
+    def to_json(self):
+        """Returns the dictionaries as a JSON string."""
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+    
+    @classmethod
+    def from_json(cls, text):
+        """Returns a new Stats with the dictionaries of a JSON string made by the method to_json.
+        
+        Arguments:
+        text -- the JSON string
+        """
+        stats = cls()
+        stats.merge(json.loads(text))
+        return stats
+
+default_stats = Stats()      # The Stats of the runs that are not given their own
 
 #===========================================#
 #     Initialize lists and dictionaries     #
 #===========================================#
 
-ok_streets = [ 'Americas', 'Avenue', 'Boulevard', 'Broadway', 'Circle', 'Court', 'Drive', 'East', 'Lane',
-               'North', 'Parkway', 'Place', 'Plaza', 'Road', 'South', 'Square', 'Street', 'Terrace', 'Walk',
-               'Way', 'West']
-other_city = ['Union City', 'West New York', 'North Bergen', 'Weehawken', 'Long Island City', 'Roosevelt Island',
-              'Queens', 'Guttenberg', 'Astoria', 'Hoboken', 'Jersey City', 'Morristown']
-ok_domains = ['.com', '.org', '.net', '.edu', '.gov', '.us', '.nyc', '.biz', '.info', '.io', '.it',
-              '.co', '.site', '.cz', '.hu', '.int']
-uws_zips = ['10023', '10024', '10025']
-abbreviations = ['st', 'nd', 'rd', 'th']
-phone_prefixes = ['212 ', '(212', '646 ', '(646', '212-', '646-', '917 ', '(917', '917-', '800 ', '800-', 
-                  '(800', '718-', '(888', '845-', '855-']
-
-direction_mapping = { "N.": "North",
-                      "E.": "East",
-                      "S.": "South",
-                      "W.": "West",
-                      "N ": "North ",
-                      "E ": "East ",
-                      "S ": "South ",
-                      "W ": "West "}
-
-street_mapping = { "St": "Street",    # Street mapping is specific to this dataset
-                  "St.": "Street",
-               "street": "Street",
-                   "st": "Street",
-                  "st.": "Street",
-                   "pl": "Place",
-                  "pl.": "Place",
-                "place": "Place",
-                   "Pl": "Place",
-                  "Pl.": "Place",
-               "avenue": "Avenue",
-                  "ave": "Avenue",
-                 "ave.": "Avenue",
-                  "Ave": "Avenue",
-                 "Ave.": "Avenue",
-                "Avene": "Avenue",
-               "Aveneu": "Avenue",
-          "Avenue,#392": "Avenue",
-                   "dr": "Drive",
-                  "dr.": "Drive",
-                   "Dr": "Drive",
-                  "Dr.": "Drive",
-                    "N": "North",
-                    "S": "South",
-                    "E": "East",
-                    "W": "West"}    # e.g. Central Park West
-
-typo_mapping = {"nwe": "new",
-               "yoro": "york",
-               "ykrk": "york",
-               "ykro": "york"}
+# The lists and mappings of the fixers and the tag keys of each fixer are read from the rule file
+#   'fix_rules.json', compiled into the module rules (see the file "fix_rules.py"), e.g. rules.street_mapping,
+#   rules.ok_street_set or rules.phone_re. Use the function use_rules to load another rule file.
+rules = fix_rules.load()
+
+city_names = city_index.CityIndex(rules.ok_city + rules.other_city)   # Misspelled city names (in file "city_index.py")
 
 #====================================#
 #     Define regular expressions     #
 #====================================#
 
-phone_re = re.compile(r"^(\+1\s?-?\(?\)?)(\d{3})\D*(\d{3})\D*(\d{4})$")  # r: RE must process backslash as escape
+us_phone_re = re.compile(r"^(\+1\s?-?\(?\)?)(\d{3})\D*(\d{3})\D*(\d{4})$")  # A phone number as rewritten by phone_rewrites
 email_re = re.compile(r"[\w.-]+@[\w.-]+")
 website_re = re.compile(r"^(http\:\/\/)?(https\:\/\/)?([\w.-])*[\w-]+\.([a-zA-Z][a-zA-Z][a-zA-Z]?[a-zA-Z]?)(\/[\w/.#?=%&,!+()-]*)?$")
 basic_re = re.compile(r"^[a-zA-Z0-9'_.,;:=–’>!´é~êçóíáô®@½·\"\-\(\)\&\/\+\s]+$")   # Note: Characters are specific to this dataset
@@ -130,96 +195,159 @@
 #                Helper Function                     #
 # ================================================== #
 
-#  Clears the global dictionaries
-def initialize():
-    """Clears the dictionaries and returns a boolean."""
+#  Clears the dictionaries of a run
+def initialize(stats=None):
+    """Clears the dictionaries and returns a boolean.
+    
+    Arguments:
+    stats -- the Stats to clear, default_stats if None
+    """
     try:
-        counts.clear()
-
-        streets_issue.clear()
-        us_states_issue.clear()
-        us_states_problem.clear()
-        cities_issue.clear()
-        cities_problem.clear()
-        phones_issue.clear()
-        emails_issue.clear()
-        websites_issue.clear()
-        zipcodes_issue.clear()
-        tiger_issue.clear()
-        value_issue.clear()
-        
-        streets_fix.clear()
-        streets_dict.clear()
-        cities_fix.clear()
-        cities_dict.clear()
-        us_states_fix.clear()
-        us_states_dict.clear()
-        
-        zipcodes_fix.clear()
-        zipcodes_dict.clear()
-        phones_fix.clear()
-        phones_dict.clear()
-        tiger_fix.clear()
-        tiger_dict.clear()
-        
-        house_fix.clear()
-        house_dict.clear()
-        cuisine_fix.clear()
-        cuisine_dict.clear()
-        
-        bad_keys.clear()
-        way_id_bad.clear()
-        node_id_bad.clear()
-        way_node_reference_bad.clear()
+        (default_stats if stats is None else stats).clear()
     except:
         return None
     
     return True
 
+def snapshot(stats=None):
+    """Returns a copy of the dictionaries as plain dictionaries.
+    
+    Arguments:
+    stats -- the Stats to copy, default_stats if None
+    """
+    return (default_stats if stats is None else stats).snapshot()
+
+def merge(saved, stats=None):
+    """Adds a snapshot taken in another process to the dictionaries and returns None.
+
+    Arguments:
+    saved -- a dictionary returned by the function snapshot, or a Stats
+    stats -- the Stats added to, default_stats if None
+    """
+    (default_stats if stats is None else stats).merge(saved)
+    return
+
+# ==================================================================== #
+#       Side effects of the fixers, recorded for the fixer memo        #
+# ==================================================================== #
+
+# The fixers update the dictionaries of the run and print through these functions. While the memo
+#   (see the function memo_fix) runs a fixer, each call is also recorded in stats.recording, by
+#   dictionary name, so a later call of the fixer with the same value replays the same updates and
+#   messages on the Stats of that call without running the fixer.
+
+def tally(stats, name, key):
+    """Adds one to the count of the key in a dictionary of the run and returns None.
+    
+    Arguments:
+    stats -- the Stats of the run
+    name -- the dictionary name, e.g. 'counts' or 'streets_issue'
+    key -- the key counted
+    """
+    if quarantine.ENABLED and name in quarantine.QUARANTINE_NAMES:
+        quarantine.count(stats, name)             # The value itself is in the quarantine file
+    else:
+        getattr(stats, name)[key] += 1
+    if stats.recording is not None:
+        stats.recording.append((tally, (name, key)))
+    return
+
+def record_fix(stats, fix_name, dict_name, name, better_name):
+    """Counts a fix and records the running total of the fix, and returns None.
+    
+    Arguments:
+    stats -- the Stats of the run
+    fix_name -- the fix counter dictionary name, e.g. 'streets_fix'
+    dict_name -- the fix dictionary name, e.g. 'streets_dict'
+    name -- the value fixed
+    better_name -- the corrected value
+    """
+    fix = getattr(stats, fix_name)
+    fix[name] += 1
+    getattr(stats, dict_name)[name][better_name] = fix[name]
+    if stats.recording is not None:
+        stats.recording.append((record_fix, (fix_name, dict_name, name, better_name)))
+    return
+
+def record_value_issue(stats, key, value):
+    """Records an eliminated value of a key in value_issue and returns None.
+    
+    Arguments:
+    stats -- the Stats of the run
+    key -- the child element tag key
+    value -- the child element tag value
+    """
+    if quarantine.ENABLED:
+        quarantine.count(stats, 'value_issue')
+    else:
+        stats.value_issue[key].append(value)
+    if stats.recording is not None:
+        stats.recording.append((record_value_issue, (key, value)))
+    return
+
+def report(stats, level, category, *args):
+    """Sends a message of a fixer to the event log (in file "event_log.py") and returns None.
+    
+    Arguments:
+    stats -- the Stats of the run
+    level -- 'debug', 'info', 'warning' or 'error'
+    category -- the fixer name, e.g. 'street'
+    args -- the items of the message
+    """
+    event_log.event(stats, level, category, *args)
+    if level == 'warning':
+        stats.reason = args
+    if stats.recording is not None:
+        stats.recording.append((report, (level, category) + args))
+    return
+
 # =================================================================== #
 #               Functions to correct the values                       #
 #                 and related helper functions                        #
 # =================================================================== #
 
-def update_street_city(street_city, mapping):
+def update_street_city(street_city, mapping, stats):
     """Lookup function returns the mapping or None.
     
     Arguments:
     street_city -- the item to be mapped
     mapping -- the mapping lookup dictionary to use
+    stats -- the Stats of the run
     """
     try:
         street_city =  mapping[street_city]
     except:
-        print ('Street or City mapping exception!')
+        report (stats, 'error', 'street', 'Street or City mapping exception!')
         return None
     
     return street_city
 
-def street_problem(name, street, node_or_way):
+def street_problem(name, street, node_or_way, stats):
     """Function fix_streets helper eliminates street and returns None.
     
     Arguments:
     name -- name of street passed from function fix_streets
     street -- street kind passed from function fix_streets
     node_or_way -- node_or_way element tag passed from function fix_streets
+    stats -- the Stats of the run
     """
-    print (node_or_way, ': Street problem removed from dataset -- name: ', name, '  street: ', street)
-    streets_issue[street] += 1
-    counts['value eliminated'] += 1
+    report (stats, 'warning', 'street', node_or_way, ': Street problem removed from dataset -- name: ', name, '  street: ', street)
+    tally(stats, 'streets_issue', street)
+    tally(stats, 'counts', 'value eliminated')
     return None                         # Eliminate problematic data from dataset
 
-def fix_streets(name, node_or_way):
+def fix_streets(name, node_or_way, stats):
     """Correct street dirty data if possible and return corrected value or None if data is eliminated.
     
     Arguments:
     name -- the value of the addr:street key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not name or name.isspace():        # Check for null characters: None, False, '', 0, and ' '
-        print (node_or_way, ': Street problem removed from dataset -- street is null or whitespace  ', name)
-        streets_issue[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'street', node_or_way, ': Street problem removed from dataset -- street is null or whitespace  ', name)
+        tally(stats, 'streets_issue', name)
+        tally(stats, 'counts', 'value eliminated')
         return None                         # Eliminate problematic data from dataset
     
     name = name.strip()
@@ -238,127 +366,125 @@ def fix_streets(name, node_or_way):
         street = name[1]
         name = name[0]
     
-    if street in street_mapping.keys():
+    better_street = rules.street_mapping.get(street)
+    if better_street:
         # Standardize street abbreviations
-        better_street = update_street_city(street, street_mapping)
-        if better_street:
-            streets_fix[street] += 1
-            streets_dict[street][better_street] = streets_fix[street]
-            # print ('Street fixed:  ', street, "=>", better_street)
-            street = better_street
-        else:
-            return street_problem(name, street, node_or_way)
-            
-    for k in direction_mapping.keys():
+        record_fix(stats, 'streets_fix', 'streets_dict', street, better_street)
+        # print ('Street fixed:  ', street, "=>", better_street)
+        street = better_street
+    
+    for k in rules.direction_keys(name):          # One fix record per key, in the order of the mapping
         if k in name:
             # Remove periods e.g. W. 86th => West 86th
             # Convert abbreviations e.g. W 79th => West 79th
-            better_name = name.replace(k, update_street_city(k, direction_mapping))
-            streets_fix[name] += 1
-            streets_dict[name][better_name] = streets_fix[name]
+            better_name = name.replace(k, rules.direction_mapping[k])
+            record_fix(stats, 'streets_fix', 'streets_dict', name, better_name)
             # print ('Street name fixed:  ', name, "=>  name: ", better_name, "  street: ", street)
             name = better_name
     
     if street.isalnum():                          # Alphanumeric characters only
-        if street not in ok_streets:
-            if street[-2:] in abbreviations:      # Examine the last 2 characters e.g. 86th
-                print ('Street with issue allowed ... name: ', name, '  street: ', street)  
+        if street not in rules.ok_street_set:
+            if street[-2:] in rules.abbreviation_set:   # Examine the last 2 characters e.g. 86th
+                report (stats, 'info', 'street', 'Street with issue allowed ... name: ', name, '  street: ', street)  
             else:
-                return street_problem(name, street, node_or_way)
+                return street_problem(name, street, node_or_way, stats)
     else:
-        return street_problem(name, street, node_or_way)
+        return street_problem(name, street, node_or_way, stats)
     
     if flag:
         name = name + ' ' + street
     
     return name
 
-def fix_city(name, node_or_way):
+def fix_city(name, node_or_way, stats):
     """Correct city dirty data if possible and return corrected value or None if data is eliminated.
     
     Arguments:
     name -- the value of the addr:city key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not name or name.isspace():
-        print (node_or_way, ': City is null -- removed from dataset  ', name)
-        cities_problem[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'city', node_or_way, ': City is null -- removed from dataset  ', name)
+        tally(stats, 'cities_problem', name)
+        tally(stats, 'counts', 'value eliminated')
         return None                     # Eliminate problematic data from dataset
     
     name = name.strip()
     
     # Only alphabetical letters, spaces or ","
     if not all(char.isalpha() or char.isspace() or ',' or '.' for char in name):
-        print (node_or_way, ': City contains problem characters -- removed from dataset  ', name)
-        cities_problem[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'city', node_or_way, ': City contains problem characters -- removed from dataset  ', name)
+        tally(stats, 'cities_problem', name)
+        tally(stats, 'counts', 'value eliminated')
         return None                     # Eliminate problematic data from dataset
     
     namelow = name.lower()
     
-    for k in typo_mapping.keys():   # Fix spelling
+    for k in rules.typo_mapping.keys():   # Fix spelling
         if k in namelow:
-            namelow = namelow.replace(k, update_street_city(k, typo_mapping))
+            namelow = namelow.replace(k, update_street_city(k, rules.typo_mapping, stats))
             better_name = namelow.title()
-            cities_fix[name] += 1
-            cities_dict[name][better_name] = cities_fix[name]
+            record_fix(stats, 'cities_fix', 'cities_dict', name, better_name)
             # print ('City spelling fixed:  ', name, "=>", better_name)
             name = better_name
     
-    ok_city = ['New York', 'New York City']
     ok_city_lower = ['new york', 'new york city']
 
-    if namelow in ok_city_lower and name not in ok_city:  # Fix titlecase
+    if namelow in ok_city_lower and name not in rules.ok_city_set:  # Fix titlecase
         better_name = name.title()
-        cities_fix[name] += 1
-        cities_dict[name][better_name] = cities_fix[name]
+        record_fix(stats, 'cities_fix', 'cities_dict', name, better_name)
         # print ('City title case fixed:  ', name, "=>", better_name)
         name = better_name
 
 # Fix abbreviations or state e.g. 'New York NY' or 'New York, NY'
     if any(word in namelow for word in ['ny', 'nyc', 'nyy']):
         better_name = 'New York'
-        cities_fix[name] += 1
-        cities_dict[name][better_name] = cities_fix[name]
+        record_fix(stats, 'cities_fix', 'cities_dict', name, better_name)
         # print ('City abbreviation fixed:  ', name, "=>", better_name)
         name = better_name
     
     if namelow == 'west new york' and name != 'West New York':   # Fix titlecase
         better_name = name.title()
-        cities_fix[name] += 1
-        cities_dict[name][better_name] = cities_fix[name]
+        record_fix(stats, 'cities_fix', 'cities_dict', name, better_name)
         # print ('City West New York title case fixed:  ', name, "=>", better_name)
         name = better_name
     # Change New York City to New York and fix punctuation e.g. 'New York,' in city name
     elif name != 'West New York' and 'new york' in namelow and len(name) > 8:
         better_name = name[:8]
-        cities_fix[name] += 1
-        cities_dict[name][better_name] = cities_fix[name]
+        record_fix(stats, 'cities_fix', 'cities_dict', name, better_name)
         # print ('City extra end characters fixed:  ', name, "=>", better_name)
         name = better_name
     
-    if name not in ok_city:          # Identified a problem
-        cities_issue[name] += 1      # Record the problem
-        if name not in other_city:   # Identified a problem; allow certain cities in NJ
-            print (node_or_way, ': Problem city -- removed from dataset  ', name)
-            cities_problem[name] += 1
-            counts['value eliminated'] += 1
+    if name not in rules.ok_city_set and name not in rules.other_city_set:   # Nearest accepted name e.g. Hobokn => Hoboken
+        better_name = city_names.nearest(name)
+        if better_name:
+            record_fix(stats, 'cities_fix', 'cities_dict', name, better_name)
+            # print ('City spelling fixed:  ', name, "=>", better_name)
+            name = better_name
+    
+    if name not in rules.ok_city_set:          # Identified a problem
+        tally(stats, 'cities_issue', name)      # Record the problem
+        if name not in rules.other_city_set:   # Identified a problem; allow certain cities in NJ
+            report (stats, 'warning', 'city', node_or_way, ': Problem city -- removed from dataset  ', name)
+            tally(stats, 'cities_problem', name)
+            tally(stats, 'counts', 'value eliminated')
             return None                # Eliminate problematic data from dataset 
     
     return name
 
-def fix_state(name, node_or_way):
+def fix_state(name, node_or_way, stats):
     """Correct state dirty data if possible and return corrected value or None if data is eliminated.
     
     Arguments:
     name -- the value of the addr:state key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not name or name.isspace():
-        print (node_or_way, ': State is null -- removed from dataset  ', name)
-        us_states_problem[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'state', node_or_way, ': State is null -- removed from dataset  ', name)
+        tally(stats, 'us_states_problem', name)
+        tally(stats, 'counts', 'value eliminated')
         return None                      # Eliminate problematic data from dataset
     
     name = name.strip().upper()
@@ -366,179 +492,237 @@ def fix_state(name, node_or_way):
     
     if '.' in name or ',' in name:
         better_name = name.replace('.', '').replace(',', '')    # Remove periods or commas e.g. 'N.Y.' => 'NY'
-        us_states_fix[name] += 1
-        us_states_dict[name][better_name] = us_states_fix[name]
+        record_fix(stats, 'us_states_fix', 'us_states_dict', name, better_name)
         # print ('State punctuation fixed:  ', name, "=>", better_name)
         name = better_name
     
     if namelow in ['new york', 'new york city']:   # Fix state to NY
         better_name = 'NY'
-        us_states_fix[name] += 1
-        us_states_dict[name][better_name] = us_states_fix[name]
+        record_fix(stats, 'us_states_fix', 'us_states_dict', name, better_name)
         # print ('State fixed:  ', name, "=>", better_name)
         name = better_name
     
     if namelow == 'ny' and name != 'NY':   # Fix to uppercase
         better_name = 'NY'
-        us_states_fix[name] += 1
-        us_states_dict[name][better_name] = us_states_fix[name]
+        record_fix(stats, 'us_states_fix', 'us_states_dict', name, better_name)
         # print ('State case fixed:  ', name, "=>", better_name)
         name = better_name
                
     if 'ny' in namelow and len(name) > 2:   # Fixes NYC, NYY, 'NY NY' and similar NY issues
         better_name = 'NY'
-        us_states_fix[name] += 1
-        us_states_dict[name][better_name] = us_states_fix[name]
+        record_fix(stats, 'us_states_fix', 'us_states_dict', name, better_name)
         # print ('State fixed:  ', name, "=>", better_name)
         name = better_name
     
     if not name.isalpha():       # string contains only alphabetical characters and no spaces
-        print (node_or_way, ': State contains problem characters -- removed from dataset  ', name)
-        us_states_problem[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'state', node_or_way, ': State contains problem characters -- removed from dataset  ', name)
+        tally(stats, 'us_states_problem', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     if name != 'NY':                 # Identified a problem
-        us_states_issue[name] += 1   # Record the problem
+        tally(stats, 'us_states_issue', name)   # Record the problem
         if name != 'NJ':             # Identified a problem; allow 'NJ' state data
-            print (node_or_way, ': Problem state removed from dataset  ', name)
-            us_states_problem[name] += 1
-            counts['value eliminated'] += 1
+            report (stats, 'warning', 'state', node_or_way, ': Problem state removed from dataset  ', name)
+            tally(stats, 'us_states_problem', name)
+            tally(stats, 'counts', 'value eliminated')
             return None                # Eliminate problematic data from dataset 
     
     return name
 
-def zip_test(zip, node_or_way):
+def zip_test(zip, node_or_way, stats):
     """Function fix_zipcodes helper checks zip code and returns it if valid or returns None to eliminate.
     
     Arguments:
     zip -- the zip code to be examined, passed from function fix_zipcodes
     node_or_way -- node_or_way element tag passed from function fix_zipcodes
+    stats -- the Stats of the run
     """
     if not zip or zip.isspace():
-        print (node_or_way, ': Zipcode is null -- removed from dataset  ', zip)
-        zipcodes_issue[zip] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'zipcode', node_or_way, ': Zipcode is null -- removed from dataset  ', zip)
+        tally(stats, 'zipcodes_issue', zip)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     if zip.isdigit() and len(zip) == 5:        # zipcode contains only 5 digits
         return zip
     else:
-        print (node_or_way, ': Zipcode is not valid -- removed from dataset  ', zip)
-        zipcodes_issue[zip] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'zipcode', node_or_way, ': Zipcode is not valid -- removed from dataset  ', zip)
+        tally(stats, 'zipcodes_issue', zip)
+        tally(stats, 'counts', 'value eliminated')
         return None
 
-def fix_zipcodes(name, node_or_way):
+def fix_zipcodes(name, node_or_way, stats):
     """Correct zip code dirty data if possible and return corrected value or None if data is eliminated.
     
     Arguments:
     name -- the value of the addr:postcode key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     name = name.strip()
     
     if '-' in name and len(name) == 10:   # Zip+4 strip off the plus 4
         better_name = name[:5]
-        zipcodes_fix[name] += 1
-        zipcodes_dict[name][better_name] = zipcodes_fix[name]
+        record_fix(stats, 'zipcodes_fix', 'zipcodes_dict', name, better_name)
         # print ('Zip+4 fixed:  ', name, "=>", better_name)
         name = better_name
     
     if 'NY' in name:               # Strip out NY
         better_name = name[-5:]    # From end of string
-        zipcodes_fix[name] += 1
-        zipcodes_dict[name][better_name] = zipcodes_fix[name]
+        record_fix(stats, 'zipcodes_fix', 'zipcodes_dict', name, better_name)
         # print ('Zip code fixed:  ', name, "=>", better_name)
         name = better_name
     
-    return zip_test(name, node_or_way)
+    return zip_test(name, node_or_way, stats)
     
-def fix_phone(name, node_or_way):
-    """Correct phone number dirty data if possible and return corrected value or None if data is eliminated.
+def normalize_phone(name):
+    """Returns the phone number in the form '+1 212-555-0123', or None if it is not a valid US number.
+    
+    One match of rules.phone_re gives the verdicts of the chain of rewrites of the function
+    phone_rewrites, except for three malformed kinds of values (see canonical_phones in the README)
     
     Arguments:
     name -- the value of the phone key
-    node_or_way -- Indicates XML element tag is a <node> or <way>
     """
-    if not name or name.isspace():
-        print (node_or_way, ': Phone is null -- removed from dataset  ', name)
-        phones_issue[name] += 1
-        counts['value eliminated'] += 1
+    name = name.strip()
+    if name[:3] == '001' and '001' in name[3:] or name[:1] == '+' and name[1:2] != '1' and '+' in name[1:]:
+        return None                             # Refused: the rewrites of these change the digits
+    if ' ' in name[-4:]:                        # Spaces in the line digits, e.g. '555 01 23'
+        name = name[:-5] + name[-5:].replace(' ', '')
+    match = rules.phone_re.match(name)
+    if not match:
         return None
+    return '+1 {}-{}-{}'.format(*match.groups())
+
+def phone_rewrites(name):
+    """Returns the phone number as rewritten, or None if it is not a valid US number, and the
+       list of (value, rewritten value) of the rewrites made.
     
-    name = name.strip()
+    Arguments:
+    name -- the value of the phone key, stripped
+    """
+    fixes = []
     
-    if name[0] == '+' and name[1] != '1':
-        better_name = name.replace('+', '+1 ')      # Fix '+' without '1'
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
+    if name[:1] == '+' and name[1:2] != '1':
+        fixes.append((name, name.replace('+', '+1 ')))      # Fix '+' without '1'
+        name = fixes[-1][1]
     
     if '.' in name:
-        better_name = name.replace('.', '-')     # Replace any periods in phone number with a dash
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
+        fixes.append((name, name.replace('.', '-')))        # Replace any periods in phone number with a dash
+        name = fixes[-1][1]
+    
+    if '001' in name[:3]:                                   # Begining of string
+        fixes.append((name, name.replace('001', '+1')))
+        name = fixes[-1][1]
     
-    if '001' in name[:3]:                        # Begining of string
-        better_name = name.replace('001', '+1')
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
-        
     if '1 ' in name[:2] or '1-' in name[:2]:
-        better_name = '+1 ' + name[2:]
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
-        
-    if any(prefix in name[:4] for prefix in phone_prefixes):
-        better_name = '+1 ' + name
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
-        
-    if ('212' in name[:3] or '646' in name[:3]) and name[3].isdigit():
-        better_name = '+1 ' + name
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
+        fixes.append((name, '+1 ' + name[2:]))
+        name = fixes[-1][1]
+    
+    if any(prefix in name[:4] for prefix in rules.phone_prefixes):
+        fixes.append((name, '+1 ' + name))
+        name = fixes[-1][1]
+    
+    if ('212' in name[:3] or '646' in name[:3]) and name[3:4].isdigit():
+        fixes.append((name, '+1 ' + name))
+        name = fixes[-1][1]
     
     if ' ' in name[-4:]:
         end = len(name) - 5
-        better_name = name[:end] + name[-5:].replace(' ', '')
-        phones_fix[name] += 1
-        phones_dict[name][better_name] = phones_fix[name]
-        # print ('Phone fixed:  ', name, "=>", better_name)
-        name = better_name
+        fixes.append((name, name[:end] + name[-5:].replace(' ', '')))
+        name = fixes[-1][1]
     
-    match = phone_re.search(name)
-    if not match:
-        phones_issue[name] += 1
-        print (node_or_way, ': Phone problem -- removed from dataset  ', name)
-        counts['value eliminated'] += 1
+    return name, fixes
+
+def phone_result(name):
+    """Returns the fixed phone number, or None if it is removed, the list of (value, fixed value)
+       fixes to record, and the value reported if it is removed.
+    
+    With canonical_phones in the rule file the number is normalized by the function normalize_phone,
+    else rewritten by the function phone_rewrites and checked with us_phone_re
+    
+    Arguments:
+    name -- the value of the phone key, stripped
+    """
+    if rules.canonical_phones:
+        better_name = normalize_phone(name)
+        return better_name, [(name, better_name)] if better_name and better_name != name else [], name
+    
+    better_name, fixes = phone_rewrites(name)
+    if not us_phone_re.search(better_name):
+        return None, fixes, better_name
+    return better_name, fixes, better_name
+
+phone_batch = {}     # Stripped value -> phone_result of the values of the latest batch (see normalize_phones)
+
+def normalize_phones(names):
+    """Returns the list of the fixed phone numbers, None for a removed number, fixing each distinct
+       value once, and keeps the results for the function fix_phone, e.g. for a batch of elements
+       in a worker process.
+    
+    The results of the previous batch are dropped
+    
+    Arguments:
+    names -- list of the values of the phone key
+    """
+    phone_batch.clear()
+    fixed = []
+    for name in names:
+        name = name.strip()
+        if not name:
+            fixed.append(None)
+            continue
+        result = phone_batch.get(name)
+        if result is None:
+            result = phone_batch[name] = phone_result(name)
+        fixed.append(result[0])
+    return fixed
+
+def fix_phone(name, node_or_way, stats):
+    """Correct phone number dirty data if possible and return corrected value or None if data is eliminated.
+    
+    Arguments:
+    name -- the value of the phone key
+    node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
+    """
+    if not name or name.isspace():
+        report (stats, 'warning', 'phone', node_or_way, ': Phone is null -- removed from dataset  ', name)
+        tally(stats, 'phones_issue', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
-    return name
+    name = name.strip()
+    result = phone_batch.get(name)
+    if result is None:
+        result = phone_result(name)
+    better_name, fixes, shown_name = result
+    
+    for value, better_value in fixes:
+        record_fix(stats, 'phones_fix', 'phones_dict', value, better_value)
+        # print ('Phone fixed:  ', value, "=>", better_value)
+    
+    if not better_name:
+        tally(stats, 'phones_issue', shown_name)
+        report (stats, 'warning', 'phone', node_or_way, ': Phone problem -- removed from dataset  ', shown_name)
+        tally(stats, 'counts', 'value eliminated')
+        return None
+    
+    return better_name
 
-def fix_email(name, node_or_way):
+def fix_email(name, node_or_way, stats):
     """Checks email address and returns it if valid or returns None if data is eliminated.
     
     Arguments:
     name -- the value of the email key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not name or name.isspace():
-        print (node_or_way, ': Email is null -- removed from dataset  ', name)
-        emails_issue[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'email', node_or_way, ': Email is null -- removed from dataset  ', name)
+        tally(stats, 'emails_issue', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     name = name.strip().lower()
@@ -546,27 +730,28 @@ def fix_email(name, node_or_way):
     first_parse = parseaddr(name)
     second_parse = not email_re.search(name)    # search() returns None (False) if no match can be found
                                                 # If match found, a match object instance is returned
-    third_parse = not first_parse[1].endswith(tuple(ok_domains))
+    third_parse = not first_parse[1].endswith(rules.ok_domain_tuple)
     
     if first_parse == ('', '') or second_parse or third_parse:
-        emails_issue[name] += 1
-        print (node_or_way, ': Email problem -- removed from dataset  ', name)
-        counts['value eliminated'] += 1
+        tally(stats, 'emails_issue', name)
+        report (stats, 'warning', 'email', node_or_way, ': Email problem -- removed from dataset  ', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     return name
 
-def fix_website(name, node_or_way):
+def fix_website(name, node_or_way, stats):
     """Checks website URL and returns it if valid or returns None if data is eliminated.
     
     Arguments:
     name -- the value of the website or url key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not name or name.isspace():
-        print (node_or_way, ': Website is null -- removed from dataset  ', name)
-        websites_issue[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'website', node_or_way, ': Website is null -- removed from dataset  ', name)
+        tally(stats, 'websites_issue', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     name = name.strip().lower()
@@ -579,66 +764,59 @@ def fix_website(name, node_or_way):
     
     match = website_re.search(name)
     
-    flag_2 = False
-    for domain in ok_domains:
-        if domain in name:
-            flag_2 = True
-            break
-        else:
-            flag_2 = False
+    flag_2 = rules.has_ok_domain(name)
     
     if not (match and flag_1 and flag_2):
-        websites_issue[name] += 1
-        print (node_or_way, ': Website problem -- removed from dataset  ', name)
-        counts['value eliminated'] += 1
+        tally(stats, 'websites_issue', name)
+        report (stats, 'warning', 'website', node_or_way, ': Website problem -- removed from dataset  ', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     return name
 
-def fix_tiger_no(name, node_or_way):
+def fix_tiger_no(name, node_or_way, stats):
     """Correct TIGER dirty data if possible and return corrected value or None if data is eliminated.
     
     Arguments:
     name -- the value of the tiger:reviewed key
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not name or name.isspace():
-        print (node_or_way, ': Tiger reviewed is null -- removed from dataset  ', name)
-        tiger_issue[name] += 1
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'tiger', node_or_way, ': Tiger reviewed is null -- removed from dataset  ', name)
+        tally(stats, 'tiger_issue', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     name = name.strip()
                
-    if name in ['; no; no', 'not']:
-        better_name = 'no'
-        tiger_fix[name] += 1
-        tiger_dict[name][better_name] = tiger_fix[name]
+    better_name = rules.tiger_mapping.get(name)
+    if better_name:
+        record_fix(stats, 'tiger_fix', 'tiger_dict', name, better_name)
         # print ('Tiger fixed:  ', name, "=>", better_name)
         return better_name
     
-    stripes = ['yes', 'no', 'aerial']
-    
-    if name not in stripes:
-        tiger_issue[name] += 1
-        print (node_or_way, ': TIGER reviewed problem -- removed from dataset  ', name)
-        counts['value eliminated'] += 1
+    if name not in rules.ok_tiger_set:
+        tally(stats, 'tiger_issue', name)
+        report (stats, 'warning', 'tiger', node_or_way, ': TIGER reviewed problem -- removed from dataset  ', name)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     return name
 
-def basic_fix(key, value, node_or_way):
+def basic_fix(key, value, node_or_way, stats):
     """Correct value dirty data if possible and return corrected value or None if data is eliminated.
     
     Arguments:
     key -- the child element tag key
     value -- the child element tag value
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
     """
     if not value or value.isspace():             # None, False, '', 0, and ' '
-        print (node_or_way, ':  ', key, ' problem removed from dataset -- value is null or whitespace  ', value)
-        value_issue[key].append(value)
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'value', node_or_way, ':  ', key, ' problem removed from dataset -- value is null or whitespace  ', value)
+        record_value_issue(stats, key, value)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     value = value.strip()
@@ -646,211 +824,268 @@ def basic_fix(key, value, node_or_way):
     if key == "addr:housenumber" and '#' in value:
         better_value = value.replace('#', '')
         # print (key, '  value ', value, '  changed to ', better_value)
-        house_fix[value] += 1
-        house_dict[value][better_value] = house_fix[value]
+        record_fix(stats, 'house_fix', 'house_dict', value, better_value)
         value = better_value
             
     if key == "cuisine":
         if (not value.istitle()) or ('_' in value):
             better_value = value.title().replace('_', ' ')    # consistent case for values, change '_'
             # print (key, '  value ', value, '  changed to ', better_value)
-            cuisine_fix[value] += 1
-            cuisine_dict[value][better_value] = cuisine_fix[value]
+            record_fix(stats, 'cuisine_fix', 'cuisine_dict', value, better_value)
             value = better_value
     
     match = basic_re.findall(value)
     
     if not match:
-        print (node_or_way, ':  ', key, ' problem removed from dataset -- value is not allowed  ', value)
-        value_issue[key].append(value)
-        counts['value eliminated'] += 1
+        report (stats, 'warning', 'value', node_or_way, ':  ', key, ' problem removed from dataset -- value is not allowed  ', value)
+        record_value_issue(stats, key, value)
+        tally(stats, 'counts', 'value eliminated')
         return None
     
     return value
 
 # ======================================================= #
-#               Identity Functions                        #
+#               Memo of the Fixer Results                 #
 # ======================================================= #
 
-def is_housenumber(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:housenumber")
+# Tag values repeat: the same streets, cities and phone numbers are fixed over and over.
+# The memo keeps the fixed value and the recorded side effects of the most recent distinct
+#   (key, raw value, node or way) calls, up to FIX_MEMO_SIZE; the least recently used is dropped.
+# A hit replays the side effects in order, so the counts, the fix dictionaries and the printed
+#   messages are the same as running the fixer. Set FIX_MEMO_SIZE to 0 to turn the memo off.
 
-def is_amenity(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "amenity")
+FIX_MEMO_SIZE = 20000
 
-def is_name(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "name")
+fix_memo = OrderedDict()             # (key, raw value, node_or_way) -> (fixed value, side effects)
+fix_memo_stats = defaultdict(int)    # 'hits', 'misses', 'evicted'
 
-def is_cuisine(elem):
-    """Examine the key of the element tag and return a boolean.
+def memo_fix(memo_key, function, stats, *args):
+    """Returns the result of the fixer function for the arguments, from the memo if possible,
+       replaying the side effects of the fixer on the Stats of the run.
     
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "cuisine")
-
-def is_shop(elem):
-    """Examine the key of the element tag and return a boolean.
+    The memo is shared by all the runs of the process; the side effects are recorded by name
     
     Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    memo_key -- tuple of (key, raw value, node_or_way)
+    function -- the fixer function
+    stats -- the Stats of the run
+    args -- the arguments of the fixer function before stats
     """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "shop")
+    entry = fix_memo.get(memo_key)
+    if entry is not None:
+        try:
+            fix_memo.move_to_end(memo_key)
+        except KeyError:              # Dropped by a run in another thread since
+            pass
+        fix_memo_stats['hits'] += 1
+        fixed, effects = entry
+        for effect, effect_args in effects:
+            effect(stats, *effect_args)
+        return fixed
+    
+    fix_memo_stats['misses'] += 1
+    if not FIX_MEMO_SIZE:
+        return function(*args, stats)
+    
+    stats.recording = []
+    try:
+        fixed = function(*args, stats)
+        fix_memo[memo_key] = (fixed, tuple(stats.recording))
+    finally:
+        stats.recording = None
+    
+    if len(fix_memo) > FIX_MEMO_SIZE:
+        fix_memo.popitem(last=False)
+        fix_memo_stats['evicted'] += 1
+    return fixed
+
+def clear_fix_memo():
+    """Clears the fixer memo and its statistics, and returns None."""
+    fix_memo.clear()
+    fix_memo_stats.clear()
+    return
 
-def is_building(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "building")
+def print_fix_memo_stats():
+    """Prints the hit rate of the fixer memo and returns None."""
+    calls = fix_memo_stats['hits'] + fix_memo_stats['misses']
+    print ('\nFixer memo:')
+    print ('    Calls: {:,}'.format(calls))
+    print ('    Hits: {:,}   Hit rate: {:.1%}'.format(fix_memo_stats['hits'],
+                                                   fix_memo_stats['hits'] / calls if calls else 0))
+    print ('    Values held: {:,} of {:,}   Evicted: {:,}'.format(len(fix_memo), FIX_MEMO_SIZE,
+                                                                  fix_memo_stats['evicted']))
+    return
 
-def is_street(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:street")
+# ======================================================= #
+#               Registry of the Fixers                    #
+# ======================================================= #
 
-def is_state(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:state")
+# Each fixer has a name and is found by the key of the child <tag>, in one dictionary lookup:
+#   fixer_keys -- tag keys fixed by the named fixer ('url' is fixed as a 'website')
+#   key_rules  -- (text, name) rules for the keys containing the text, tried in order
+#                 when the key is not in fixer_keys
+# The name found for each key is remembered in resolved_keys, so the many keys without a fixer
+#   are skipped at the cost of one lookup. "initial_scan.py" and "fix_it_demo.py" use the same
+#   names to pick their own counting and demo functions.
 
-def is_city(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:city")
+RESOLVED_KEYS_SIZE = 50000      # Tag keys remembered; an extract has a few thousand distinct keys
 
-def is_zipcode(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:postcode")
+fixer_functions = {}     # fixer name -> (function, takes the key)
+fixer_keys = {}          # tag key -> fixer name
+key_rules = []           # (text in the tag key, fixer name)
+resolved_keys = {}       # tag key -> fixer name, or None if no fixer
 
-def is_phone(elem):
-    """Examine the key of the element tag and return a boolean.
+def register_fixer(name, function, keys, takes_key=False):
+    """Registers a fixer for the tag keys, and returns None.
+    
+    The function is called as function(value, node_or_way, stats), or function(key, value, node_or_way, stats)
+    It returns the corrected value, or None if the value is eliminated
     
     Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    name -- the name of the fixer, e.g. 'street'
+    function -- the fixer function
+    keys -- list of tag keys fixed by the function
+    takes_key -- pass the tag key to the function
     """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "phone")
+    fixer_functions[name] = (function, takes_key)
+    for key in keys:
+        fixer_keys[key] = name
+    resolved_keys.clear()
+    clear_fix_memo()
+    return
 
-def is_email(elem):
-    """Examine the key of the element tag and return a boolean.
+def register_key_rule(name, function, text, takes_key=False):
+    """Registers a fixer for the tag keys containing the text, and returns None.
     
     Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    name -- the name of the fixer, e.g. 'inscription'
+    function -- the fixer function, called as for the function register_fixer
+    text -- the text in the tag key, e.g. 'inscription' for 'inscription:date'
+    takes_key -- pass the tag key to the function
     """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "email")
+    fixer_functions[name] = (function, takes_key)
+    key_rules.append((text, name))
+    resolved_keys.clear()
+    clear_fix_memo()
+    return
 
-def is_website(elem):
-    """Examine the key of the element tag and return a boolean.
+def fixer_name(key):
+    """Returns the name of the fixer of a tag key, or None if the key has no fixer.
     
     Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    key -- the k attribute of the child <tag>
     """
-    return (elem.tag == "tag") and ( (elem.attrib["k"] == "website") or (elem.attrib["k"] == "url") )
+    name = resolved_keys.get(key, False)
+    if name is not False:
+        return name
+    
+    name = fixer_keys.get(key)
+    if name is None:
+        for text, rule_name in key_rules:
+            if text in key:
+                name = rule_name
+                break
+    
+    if len(resolved_keys) < RESOLVED_KEYS_SIZE:
+        resolved_keys[key] = name
+    return name
+
+# The tag keys of each fixer are set by the rule file: "fixer_keys" (fixer name -> tag keys) and
+#   "key_rules" ([text in the tag key, fixer name]), for the functions of fixer_table
+fixer_table = {'housenumber': (basic_fix, True),     # fixer name -> (function, takes the key)
+               'amenity': (basic_fix, True),
+               'name': (basic_fix, True),
+               'cuisine': (basic_fix, True),
+               'shop': (basic_fix, True),
+               'building': (basic_fix, True),
+               'inscription': (basic_fix, True),
+               'street': (fix_streets, False),
+               'state': (fix_state, False),
+               'city': (fix_city, False),
+               'zipcode': (fix_zipcodes, False),
+               'phone': (fix_phone, False),
+               'email': (fix_email, False),
+               'website': (fix_website, False),
+               'tiger': (fix_tiger_no, False)}
+
+def register_rules():
+    """Registers the fixers of the tag keys of the rule file, in place of the former keys, and returns None."""
+    fixer_keys.clear()
+    del key_rules[:]
+    for name in list(rules.fixer_keys) + [name for text, name in rules.key_rules]:
+        if name not in fixer_table:
+            raise ValueError('Rule file ' + rules.path + ' names an unknown fixer: ' + repr(name))
+    
+    for name, keys in rules.fixer_keys.items():
+        function, takes_key = fixer_table[name]
+        register_fixer(name, function, keys, takes_key)
+    for text, name in rules.key_rules:
+        function, takes_key = fixer_table[name]
+        register_key_rule(name, function, text, takes_key)
+    return
 
-def is_tiger(elem):
-    """Examine the key of the element tag and return a boolean.
+def use_rules(path=fix_rules.RULES_PATH):
+    """Loads a rule file for the next runs, and returns None.
     
     Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    path -- the rule file, JSON or YAML (see the file "fix_rules.py")
     """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "tiger:reviewed")
+    global rules, city_names
+    rules = fix_rules.load(path)
+    city_names = city_index.CityIndex(rules.ok_city + rules.other_city)
+    phone_batch.clear()
+    register_rules()
+    return
 
-def is_inscription(elem):
-    """Examine the key of the element tag and return a boolean.
+def ensure_rules(path):
+    """Loads a rule file unless it is the one in use, e.g. in a worker process started by spawning,
+       which imports the default rule file, and returns None.
     
     Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    path -- the rule file of the parent process, fix_it.rules.path
     """
-    return (elem.tag == "tag") and ("inscription" in elem.attrib['k'])
+    if rules.path != path:
+        use_rules(path)
+    return
+
+register_rules()
 
 
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
 
-def fixer(element, node_or_way):
+def fixer(element, node_or_way, stats=None):
     """Sends the value data out for parsing and returns the corrected value, or None if eliminated, 
        or skips the element.
     
     Arguments:
     element -- the child element tag value
     node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run, default_stats if None
     """
-    if is_housenumber(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
-    
-    if is_amenity(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
-
-    if is_name(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
-
-    if is_cuisine(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
-
-    if is_shop(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
-
-    if is_building(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
-
-    if is_street(element):
-        return fix_streets(element.attrib['v'], node_or_way)
-
-    if is_state(element):
-        return fix_state(element.attrib["v"], node_or_way)
-
-    if is_city(element):
-        return fix_city(element.attrib["v"], node_or_way)
-
-    if is_zipcode(element):
-        return fix_zipcodes(element.attrib["v"], node_or_way)
-
-    if is_phone(element):
-        return fix_phone(element.attrib["v"], node_or_way)
-
-    if is_email(element):
-        return fix_email(element.attrib["v"], node_or_way)
-
-    if is_website(element):
-        return fix_website(element.attrib["v"], node_or_way)
-
-    if is_tiger(element):
-        return fix_tiger_no(element.attrib["v"], node_or_way)
-    
-    if is_inscription(element):
-        return basic_fix(element.attrib['k'], element.attrib['v'], node_or_way)
+    if stats is None:
+        stats = default_stats
+    
+    if element.tag != "tag":
+        return '$skip'
+    
+    name = fixer_name(element.attrib['k'])
+    if name is None:
+        return '$skip'    # Ignore the keys without a registered fixer
+    
+    key = element.attrib['k']
+    value = element.attrib['v']
+    function, takes_key = fixer_functions[name]
+    stats.reason = None
+    if takes_key:
+        fixed = memo_fix((key, value, node_or_way), function, stats, key, value, node_or_way)
+    else:
+        fixed = memo_fix((key, value, node_or_way), function, stats, value, node_or_way)
     
-    return '$skip'    # Ignore the elements not listed above
+    if not fixed and quarantine.ENABLED:
+        quarantine.write_row(stats, node_or_way, key, value, quarantine.reason_text(stats.reason, node_or_way))
+    return fixed
 
 # ========================================================================= #
 #       Functions to print reports of data corrected or eliminated          #
@@ -879,137 +1114,112 @@ def print_dictionary(dic, text):
     print (text + 's' + ' fixed:', total) 
     return
 
-def print_detailed_fixes(counts):
+def print_detailed_fixes(stats=None):
     """Prints a detailed report of data corrections and eliminations, and returns None.
     
+    The dictionaries counted in sketches print their most counted values (in file "heavy_hitters.py")
+    
     Arguments:
-    counts -- a dictionary of the number of data issues
+    stats -- the Stats of the run, default_stats if None
     """
-    streets_issue_sort = sorted(streets_issue.items(), key=operator.itemgetter(1))
-    streets_issue_sort.reverse()  # Note: In-place reversal
-    
-    cities_issue_sort = sorted(cities_issue.items(), key=operator.itemgetter(1))
-    cities_issue_sort.reverse()  # Note: In-place reversal
-    
-    cities_problem_sort = sorted(cities_problem.items(), key=operator.itemgetter(1))
-    cities_problem_sort.reverse()  # Note: In-place reversal
-    
-    us_states_issue_sort = sorted(us_states_issue.items(), key=operator.itemgetter(1))
-    us_states_issue_sort.reverse()  # Note: In-place reversal
-    
-    us_states_problem_sort = sorted(us_states_problem.items(), key=operator.itemgetter(1))
-    us_states_problem_sort.reverse()  # Note: In-place reversal
-    
-    zipcodes_issue_sort = sorted(zipcodes_issue.items(), key=operator.itemgetter(1))
-    zipcodes_issue_sort.reverse()  # Note: In-place reversal
-    
-    phones_issue_sort = sorted(phones_issue.items(), key=operator.itemgetter(1))
-    phones_issue_sort.reverse()  # Note: In-place reversal
-    
-    emails_issue_sort = sorted(emails_issue.items(), key=operator.itemgetter(1))
-    emails_issue_sort.reverse()  # Note: In-place reversal
-    
-    websites_issue_sort = sorted(websites_issue.items(), key=operator.itemgetter(1))
-    websites_issue_sort.reverse()  # Note: In-place reversal
-    
-    bad_keys_sort = sorted(bad_keys.items(), key=operator.itemgetter(1))
-    bad_keys_sort.reverse()  # Note: In-place reversal
+    if stats is None:
+        stats = default_stats
     
     print("\n---------------------------------------------------------")
     print("CONSOLIDATED DETAILS OF DATA CORRECTIONS AND ELIMINATIONS")
     
-    print_dictionary(streets_dict, 'Street')      # Street fixes
+    print_dictionary(stats.streets_dict, 'Street')      # Street fixes
     
-    sum_val = sum(streets_issue.values())
+    sum_val = stats.total('streets_issue')
     print ('\nNumber of street issues: {:,}'.format(sum_val), 'streets removed from dataset')
     print ("Street problems: ")
-    print ( *streets_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.streets_issue)
     
-    print_dictionary(cities_dict, 'City')         # City fixes
+    print_dictionary(stats.cities_dict, 'City')         # City fixes
     
-    sum_val = sum(cities_issue.values())
+    sum_val = stats.total('cities_issue')
     print ('\nNumber of cities not in NYC: {:,}'.format(sum_val))
     print ("Cities outside NYC: ")
-    print ( *cities_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.cities_issue)
     
-    sum_val = sum(cities_problem.values())
+    sum_val = stats.total('cities_problem')
     print ('\nNumber of city problems: {:,}'.format(sum_val), 'cities removed from dataset')
     print ("City problems: ")
-    print ( *cities_problem_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.cities_problem)
     
-    print_dictionary(us_states_dict, 'State')       # State fixes
+    print_dictionary(stats.us_states_dict, 'State')       # State fixes
     
-    sum_val = sum(us_states_issue.values())
+    sum_val = stats.total('us_states_issue')
     print ('\nNumber of state issues: {:,}'.format(sum_val))
     print ("States outside NY: ")
-    print ( *us_states_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.us_states_issue)
     
-    sum_val = sum(us_states_problem.values())
+    sum_val = stats.total('us_states_problem')
     print ('\nNumber of state problems: {:,}'.format(sum_val), 'states removed from dataset')
     print ("State problems: ")
-    print ( *us_states_problem_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.us_states_problem)
     
-    print_dictionary(zipcodes_dict, 'Zip code')       # Zip code fixes
+    print_dictionary(stats.zipcodes_dict, 'Zip code')       # Zip code fixes
     
-    sum_val = sum(zipcodes_issue.values())
+    sum_val = stats.total('zipcodes_issue')
     print ('\nNumber of zipcode issues: {:,}'.format(sum_val), 'zipcodes removed from dataset')
     print ("Zipcode problems: ")
-    print ( *zipcodes_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.zipcodes_issue)
     
-    print_dictionary(phones_dict, 'Phone')       # Phone fixes
+    print_dictionary(stats.phones_dict, 'Phone')       # Phone fixes
+    if rules.canonical_phones:
+        print ('(canonical_phones: phone numbers written as +1 AAA-BBB-CCCC, three malformed kinds removed)')
     
-    sum_val = sum(phones_issue.values())
+    sum_val = stats.total('phones_issue')
     print ('\nNumber of phone number issues: {:,}'.format(sum_val), 'phone numbers removed from dataset')
     print ("Phone problems: ")
-    print ( *phones_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.phones_issue)
     
-    sum_val = sum(emails_issue.values())
+    sum_val = stats.total('emails_issue')
     print ('\nNumber of email address issues: {:,}'.format(sum_val), 'emails removed from dataset')
     print ("email problems: ")
-    print ( *emails_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.emails_issue)
     
-    sum_val = sum(websites_issue.values())
+    sum_val = stats.total('websites_issue')
     print ('\nNumber of website URL issues: {:,}'.format(sum_val), 'websites removed from dataset')
     print ("Website problems: ")
-    print ( *websites_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.websites_issue)
     
-    print_dictionary(tiger_dict, 'Tiger no')       # TIGER fixes
+    print_dictionary(stats.tiger_dict, 'Tiger no')       # TIGER fixes
     
-    sum_val = sum(tiger_issue.values())
+    sum_val = stats.total('tiger_issue')
     print ('\nNumber of TIGER issues: {:,}'.format(sum_val), 'TIGER tags removed from dataset')
-    print ('(TIGER is not [\'yes\', \'no\', \'aerial\'])')
+    print ('(TIGER is not {})'.format(rules.ok_tiger))
     print ("TIGER problems: ")
-    pp.pprint ( dict(tiger_issue) )
+    pp.pprint ( dict(stats.tiger_issue) )
     
-    print_dictionary(house_dict, 'House number')       # House number fixes
+    print_dictionary(stats.house_dict, 'House number')       # House number fixes
     
-    print_dictionary(cuisine_dict, 'Cuisine name')       # Cuisine fixes
+    print_dictionary(stats.cuisine_dict, 'Cuisine name')       # Cuisine fixes
     
-    total = 0
-    for value in value_issue.values():
-        total += len(value)
+    total = stats.total('value_issue')
     
     print ('\nNumber of other value issues: ', total, 'tags removed from dataset')
     print ("Other value problems: ")
-    pp.pprint ( dict(value_issue) )
+    pp.pprint ( dict(stats.value_issue) )
     
-    n = counts['node child key eliminated'] + counts['way child key eliminated']
+    n = stats.counts['node child key eliminated'] + stats.counts['way child key eliminated']
     print ('\n<nodes><tags> and <ways><tags> corrupted keys: {:,}'.format(n), 'tags removed from dataset')
     print ('Tag key problems:')
-    print ( *bad_keys_sort, sep = "\n" )
+    heavy_hitters.print_items(stats.bad_keys)
     
-    total = sum(node_id_bad.values())
+    total = stats.total('node_id_bad')
     print ('\nNumber of <nodes> eliminated: ', total, 'nodes removed from dataset')
     print ("Nodes ID problems: ")
-    pp.pprint ( dict(node_id_bad) )
+    pp.pprint ( dict(stats.node_id_bad) )
     
-    total = sum(way_id_bad.values())
+    total = stats.total('way_id_bad')
     print ('\nNumber of <ways> eliminated: ', total, 'ways removed from dataset')
     print ("Ways ID problems: ")
-    pp.pprint ( dict(way_id_bad) )
+    pp.pprint ( dict(stats.way_id_bad) )
     
-    total = sum(way_node_reference_bad.values())
+    total = stats.total('way_node_reference_bad')
     print ('\nNumber of <ways nodes> eliminated: ', total, 'ways nodes removed from dataset')
     print ("Ways nodes reference problems: ")
-    pp.pprint ( dict(way_node_reference_bad) )
+    pp.pprint ( dict(stats.way_node_reference_bad) )
     return
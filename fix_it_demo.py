@@ -10,6 +10,10 @@
 import pprint
 import operator
 
+import compressed_input
+import fix_it
+import pbf_reader
+
 pp = pprint.PrettyPrinter(indent=4, width=20)
 
 map_file = "UpperWestSideTest.osm"    # Test file size is 10.1MB
@@ -61,58 +65,16 @@
 #     Initialize lists and dictionaries     #
 #===========================================#
 
-ok_streets = [ 'Americas', 'Avenue', 'Boulevard', 'Broadway', 'Circle', 'Court', 'Drive', 'East', 'Lane',
-               'North', 'Parkway', 'Place', 'Plaza', 'Road', 'South', 'Square', 'Street', 'Terrace', 'Walk',
-               'Way', 'West']
-other_city = ['Union City', 'West New York', 'North Bergen', 'Weehawken', 'Long Island City', 'Roosevelt Island',
-              'Queens', 'Guttenberg', 'Astoria', 'Hoboken', 'Jersey City', 'Morristown']
-ok_domains = ['.com', '.org', '.net', '.edu', '.gov', '.us', '.nyc', '.biz', '.info', '.io', '.it',
-              '.co', '.site', '.cz', '.hu', '.int']
-uws_zips = ['10023', '10024', '10025']
-abbreviations = ['st', 'nd', 'rd', 'th']
-phone_prefixes = ['212 ', '(212', '646 ', '(646', '212-', '646-', '917 ', '(917', '917-', '800 ', '800-', 
-                  '(800', '718-', '(888', '845-', '855-']
-
-direction_mapping = { "N.": "North",
-                      "E.": "East",
-                      "S.": "South",
-                      "W.": "West",
-                      "N ": "North ",
-                      "E ": "East ",
-                      "S ": "South ",
-                      "W ": "West "}
-
-street_mapping = { "St": "Street",    # Street mapping is specific to this dataset
-                  "St.": "Street",
-               "street": "Street",
-                   "st": "Street",
-                  "st.": "Street",
-                   "pl": "Place",
-                  "pl.": "Place",
-                "place": "Place",
-                   "Pl": "Place",
-                  "Pl.": "Place",
-               "avenue": "Avenue",
-                  "ave": "Avenue",
-                 "ave.": "Avenue",
-                  "Ave": "Avenue",
-                 "Ave.": "Avenue",
-                "Avene": "Avenue",
-               "Aveneu": "Avenue",
-          "Avenue,#392": "Avenue",
-                   "dr": "Drive",
-                  "dr.": "Drive",
-                   "Dr": "Drive",
-                  "Dr.": "Drive",
-                    "N": "North",
-                    "S": "South",
-                    "E": "East",
-                    "W": "West"}    # e.g. Central Park West
-
-typo_mapping = {"nwe": "new",
-               "yoro": "york",
-               "ykrk": "york",
-               "ykro": "york"}
+# The lists and mappings of the rule file of "fix_it.py" (see the file "fix_rules.py")
+ok_streets = fix_it.rules.ok_streets
+other_city = fix_it.rules.other_city
+ok_domains = fix_it.rules.ok_domains
+uws_zips = fix_it.rules.uws_zips
+abbreviations = fix_it.rules.abbreviations
+phone_prefixes = fix_it.rules.phone_prefixes
+direction_mapping = fix_it.rules.direction_mapping
+street_mapping = fix_it.rules.street_mapping
+typo_mapping = fix_it.rules.typo_mapping
 
 #====================================#
 #     Define regular expressions     #
@@ -666,128 +628,25 @@ def basic_fix(key, value, node_or_way):
     return value
 
 # ======================================================= #
-#               Identity Functions                        #
+#               Demo Fixers                               #
 # ======================================================= #
 
-def is_housenumber(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:housenumber")
-
-def is_amenity(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "amenity")
-
-def is_name(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "name")
-
-def is_cuisine(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "cuisine")
-
-def is_shop(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "shop")
-
-def is_building(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "building")
-
-def is_street(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:street")
-
-def is_state(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:state")
-
-def is_city(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:city")
-
-def is_zipcode(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:postcode")
-
-def is_phone(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "phone")
-
-def is_email(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "email")
-
-def is_website(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and ( (elem.attrib["k"] == "website") or (elem.attrib["k"] == "url") )
-
-def is_tiger(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "tiger:reviewed")
-
-def is_inscription(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and ("inscription" in elem.attrib['k'])
+# Demo function of each fixer name in the registry of "fix_it.py", and whether it takes the key
+demo_fixers = {'housenumber': (basic_fix, True),
+               'amenity': (basic_fix, True),
+               'name': (basic_fix, True),
+               'cuisine': (basic_fix, True),
+               'shop': (basic_fix, True),
+               'building': (basic_fix, True),
+               'street': (fix_streets, False),
+               'state': (fix_state, False),
+               'city': (fix_city, False),
+               'zipcode': (fix_zipcodes, False),
+               'phone': (fix_phone, False),
+               'email': (fix_email, False),
+               'website': (fix_website, False),
+               'tiger': (fix_tiger_no, False),
+               'inscription': (basic_fix, True)}
 
 
 # ================================================== #
@@ -801,8 +660,13 @@ def element_tree(osm_file):
     as a tree of the element
     
     Arguments:
-    osm_file -- the Open Street Map XML file to process
+    osm_file -- the Open Street Map file to process (.osm, .osm.bz2, .osm.gz, .osm.xz or .osm.pbf)
     """
+    if pbf_reader.is_pbf(osm_file):                  # Same elements, in the same order as the XML end events
+        yield from pbf_reader.iter_elements(osm_file)
+        return
+    
+    osm_file = compressed_input.open_osm(osm_file)   # Plain or compressed file
     context = ET.iterparse(osm_file, events=('start', 'end'))
     _, root = next(context)      # root saves a reference to the iterator (block of XML) currently in process
  
@@ -812,6 +676,7 @@ def element_tree(osm_file):
             root.clear()
     
     del context
+    osm_file.close()
     return
 
 def fix_it_demo():
@@ -878,50 +743,13 @@ def fix_it_demo():
                         way_bad_keys[child.attrib['k']] += 1
                     continue      # eliminate the problematic child tag
                 
-                if is_housenumber(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
-
-                if is_amenity(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
-
-                if is_name(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
-
-                if is_cuisine(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
-
-                if is_shop(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
-
-                if is_building(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
-
-                if is_street(child):
-                    skip = fix_streets(child.attrib['v'], node_or_way)
-
-                if is_state(child):
-                    skip = fix_state(child.attrib["v"], node_or_way)
-
-                if is_city(child):
-                    skip = fix_city(child.attrib["v"], node_or_way)
-
-                if is_zipcode(child):
-                    skip = fix_zipcodes(child.attrib["v"], node_or_way)
-
-                if is_phone(child):
-                    skip = fix_phone(child.attrib["v"], node_or_way)
-
-                if is_email(child):
-                    skip = fix_email(child.attrib["v"], node_or_way)
-
-                if is_website(child):
-                    skip = fix_website(child.attrib["v"], node_or_way)
-
-                if is_tiger(child):
-                    skip = fix_tiger_no(child.attrib["v"], node_or_way)
-
-                if is_inscription(child):
-                    skip = basic_fix(child.attrib['k'], child.attrib['v'], node_or_way)
+                demo_fixer = demo_fixers.get(fix_it.fixer_name(child.attrib['k']))
+                if demo_fixer:
+                    function, takes_key = demo_fixer
+                    if takes_key:
+                        skip = function(child.attrib['k'], child.attrib['v'], node_or_way)
+                    else:
+                        skip = function(child.attrib['v'], node_or_way)
 
                 if skip not in [None, '?']:
                     counts['tags processed'] += 1
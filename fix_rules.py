@@ -0,0 +1,232 @@
+# Filename: fix_rules.py
+# Python 3.7
+# Notes:
+#    This is a module of fix_it.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Load the cleaning rules of the fixers from a rule file, compiled into Python code
+
+# The lists and mappings of the fixers (ok_streets, street_mapping, direction_mapping, typo_mapping,
+#   phone_prefixes, ok_domains ...) and the tag keys of each fixer are kept in a rule file,
+#   'fix_rules.json' by default, or a YAML file if PyYAML is installed.
+# "load" compiles the rules into the source of a Python module: the lists and mappings as literals,
+#   their frozensets, the patterns built from the rules (direction_re, phone_re) and functions
+#   specialized on the rules, e.g. has_ok_domain tests each domain in one expression
+#   ('.com' in name or '.org' in name or ...) instead of a loop over ok_domains.
+#   direction_keys finds the direction keys of a street name with one scan of direction_re, unless
+#   the keys or replacements of the rule file contain or overlap each other (see direction_scan_safe).
+# The OPTIONS switch fixers between two behaviors, e.g. canonical_phones (see "fix_phone" in file
+#   "fix_it.py"); a rule file without them gets the defaults.
+# The compiled code is saved in CACHE_DIR, named by the SHA-256 hash of the rule file, so the next
+#   runs with the same rules load the code without parsing and compiling the rules again.
+#   A changed rule file has a new hash and is compiled again.
+
+import hashlib
+import json
+import marshal
+import os
+import re
+import sys
+import types
+from importlib.util import MAGIC_NUMBER
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fix_rules.json')
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+
+COMPILER_VERSION = 3      # Part of the cache key: raise it when the generated code changes
+
+# The lists and mappings every rule file must have, and the sets made of the lists
+LISTS = ['ok_streets', 'abbreviations', 'ok_city', 'other_city', 'uws_zips', 'phone_prefixes', 'ok_domains',
+         'ok_tiger']
+MAPPINGS = ['street_mapping', 'direction_mapping', 'typo_mapping', 'tiger_mapping', 'fixer_keys']
+OPTIONS = {'canonical_phones': False}      # The options a rule file may leave out, with their defaults
+SETS = {'ok_street_set': 'ok_streets', 'abbreviation_set': 'abbreviations', 'ok_city_set': 'ok_city',
+        'other_city_set': 'other_city', 'uws_zip_set': 'uws_zips', 'ok_tiger_set': 'ok_tiger'}
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def read_rules(data, path):
+    """Returns the dictionary of rules parsed from the bytes of a rule file.
+
+    Arguments:
+    data -- the bytes of the rule file
+    path -- the rule file name; '.yaml' or '.yml' files are read with PyYAML
+    """
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('Reading the YAML rule file ' + path + ' needs PyYAML: pip install pyyaml')
+        rules = yaml.safe_load(data)
+    else:
+        rules = json.loads(data.decode('utf-8'))
+
+    missing = [name for name in LISTS + MAPPINGS + ['key_rules'] if name not in rules]
+    if missing:
+        raise ValueError('Rule file ' + path + ' is missing: ' + ', '.join(missing))
+    return rules
+
+def phone_pattern(phone_prefixes):
+    """Returns the pattern of phone_re: the lead of a US number, then the area code, exchange and line digits.
+
+    '+1', '001', '1 ' or '1-' country codes, or '+' followed by the area code
+    A local number starting with one of the phone_prefixes, or with '212' or '646' and a digit
+    A '.' reads as a '-'
+
+    Arguments:
+    phone_prefixes -- list of the starts of a local number
+    """
+    lead = (r"\+1\s?[-.]?|\+(?!1)[-.]?|001\s?[-.]?|1[ .-][-.]?|(?=" +
+            '|'.join(''.join('[-.]' if c == '-' else re.escape(c) for c in prefix) for prefix in phone_prefixes) +
+            r"|(?:212|646)\d)")
+    return r"^(?:" + lead + r")\(?\)?(\d{3})\D*(\d{3})\D*(\d{4})$"
+
+def overlaps(a, b):
+    """Returns True if the end of a is the start of b, e.g. 'N.' and '.E'.
+
+    Arguments:
+    a -- first string
+    b -- second string
+    """
+    return any(b.startswith(a[i:]) for i in range(1, len(a)))
+
+def direction_scan_safe(direction_mapping):
+    """Returns True if one scan of the name finds the same direction keys as testing each key in turn
+       on the name being replaced.
+
+    No key may contain or overlap another key, and no replacement may contain, overlap or be
+    empty, as a replacement could then make or break a key, e.g. with 'E.' and 'NE.' the key by
+    key test turns 'NE. 5th' into 'NEast 5th'
+
+    Arguments:
+    direction_mapping -- dictionary of direction key -> replacement
+    """
+    keys = list(direction_mapping)
+    for k in keys:
+        for other in keys:
+            if other is not k and (other in k or overlaps(k, other)):
+                return False
+        for replacement in direction_mapping.values():
+            if not replacement or k in replacement or overlaps(k, replacement) or overlaps(replacement, k):
+                return False
+    return True
+
+def rule_source(rules, path):
+    """Returns the source of the Python module compiled from the rules.
+
+    Arguments:
+    rules -- the dictionary returned by read_rules
+    path -- the rule file name, noted in the source
+    """
+    lines = ['# Compiled from ' + path, 'import re', '']
+    for name in LISTS + MAPPINGS:
+        lines.append('{} = {!r}'.format(name, rules[name]))
+    lines.append('key_rules = {!r}'.format([tuple(rule) for rule in rules['key_rules']]))
+    for name, default in OPTIONS.items():
+        lines.append('{} = {!r}'.format(name, rules.get(name, default)))
+    lines.append('')
+
+    for name, list_name in SETS.items():
+        lines.append('{} = frozenset({!r})'.format(name, sorted(set(rules[list_name]))))
+    lines.append('ok_domain_tuple = {!r}'.format(tuple(rules['ok_domains'])))
+
+    lines.append('direction_re = re.compile({!r})'.format('|'.join(re.escape(k) for k in rules['direction_mapping'])))
+    lines.append('phone_re = re.compile({!r})'.format(phone_pattern(rules['phone_prefixes'])))
+    lines.append('')
+
+    # direction_keys returns the keys fix_streets tests on the name, in the order of direction_mapping
+    if direction_scan_safe(rules['direction_mapping']):
+        lines += ['def direction_keys(name):',
+                  '    """Returns the direction keys found in the name by one scan."""',
+                  '    found = direction_re.findall(name)',
+                  '    if not found:',
+                  '        return ()',
+                  '    found = set(found)',
+                  '    return [k for k in direction_mapping if k in found]',
+                  '']
+    else:       # Keys that contain or overlap each other: every key is tested in turn
+        lines += ['def direction_keys(name):',
+                  '    """Returns every direction key, as the keys contain or overlap each other."""',
+                  '    return direction_mapping',
+                  '']
+
+    domains = ' or '.join('{!r} in name'.format(domain) for domain in rules['ok_domains']) or 'False'
+    lines += ['def has_ok_domain(name):',
+              '    """Returns True if the name contains one of ok_domains."""',
+              '    return ' + domains,
+              '']
+    return '\n'.join(lines)
+
+def cache_path(digest):
+    """Returns the file name of the compiled code of a rule file.
+
+    Arguments:
+    digest -- the SHA-256 hash of the rule file
+    """
+    return os.path.join(CACHE_DIR, 'fix_rules.{}.{}.bin'.format(digest[:20], sys.implementation.cache_tag))
+
+def read_cache(digest):
+    """Returns the compiled code of a rule file saved in CACHE_DIR, or None if there is none.
+
+    Arguments:
+    digest -- the SHA-256 hash of the rule file
+    """
+    try:
+        with open(cache_path(digest), 'rb') as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return None
+    if data[:len(MAGIC_NUMBER)] != MAGIC_NUMBER:     # Written by another Python version
+        return None
+    return marshal.loads(data[len(MAGIC_NUMBER):])
+
+def write_cache(digest, code):
+    """Saves the compiled code of a rule file in CACHE_DIR and returns None.
+
+    The cache is skipped if CACHE_DIR cannot be written.
+
+    Arguments:
+    digest -- the SHA-256 hash of the rule file
+    code -- the code object compiled from the rule source
+    """
+    path = cache_path(digest)
+    temp_path = path + '.' + str(os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(MAGIC_NUMBER + marshal.dumps(code))
+        os.replace(temp_path, path)             # Other processes read the whole file or none of it
+    except OSError:
+        pass
+    return
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def load(path=RULES_PATH):
+    """Returns the rules of a rule file as a module of lists, mappings, sets, patterns and functions.
+
+    The module also has: path, the rule file name; digest, its SHA-256 hash; cached, True if the
+    code was loaded from CACHE_DIR
+
+    Arguments:
+    path -- the rule file, JSON or YAML
+    """
+    with open(path, 'rb') as rule_file:
+        data = rule_file.read()
+    digest = hashlib.sha256(data + b'\0' + str(COMPILER_VERSION).encode()).hexdigest()
+
+    code = read_cache(digest)
+    cached = code is not None
+    if not cached:
+        code = compile(rule_source(read_rules(data, path), path), path, 'exec')
+        write_cache(digest, code)
+
+    rules = types.ModuleType('fix_rules_compiled')
+    exec(code, rules.__dict__)
+    rules.path = path
+    rules.digest = digest
+    rules.cached = cached
+    return rules
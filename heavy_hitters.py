@@ -0,0 +1,207 @@
+# Filename: heavy_hitters.py
+# Python 3.7
+# Notes:
+#    This is a module of fix_it.py and initial_scan.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Count the most frequent problem values in a fixed number of counters
+
+# The dictionaries of problems (streets_issue, cities_issue, phones_issue, websites_issue ...) keep one
+#   count per distinct value, so they grow with a dirty extract and the report sorts all of them.
+# With ENABLED, the dictionaries of SKETCH_NAMES are SpaceSaving sketches instead: at most CAPACITY
+#   values with their counts. A value not counted yet takes the counter of the least counted value,
+#   and its count starts from that count, the most it may be over (its error). So:
+#   - the sum of the counts is still the exact number of values counted, and the report totals are unchanged
+#   - every value counted more than (number of values / CAPACITY) times is in the sketch
+#   - a value left out of the sketch was counted at most 'least' times, the smallest count kept
+#   The report prints the TOP values of each sketch, as (value, count, error), and these bounds.
+# The sketches of runs in separate processes are merged by adding their counts and errors.
+# "configure" sets the options; they apply to the Stats (in file "fix_it.py") created or cleared afterwards.
+
+from collections import defaultdict
+import operator
+
+ENABLED = False
+CAPACITY = 250      # Counters of a sketch
+TOP = 25            # Values of a sketch printed by the report
+
+#  The dictionaries of problem values counted in sketches when ENABLED
+SKETCH_NAMES = frozenset(['streets_issue', 'cities_issue', 'cities_problem', 'us_states_issue',
+                          'us_states_problem', 'zipcodes_issue', 'phones_issue', 'emails_issue',
+                          'websites_issue', 'bad_keys'])
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def configure(enabled=None, capacity=None, top=None):
+    """Sets the options of the sketches for the next runs, and returns None.
+
+    Arguments left as None keep their current value
+
+    Arguments:
+    enabled -- True to count the problem values in sketches, False for exact dictionaries
+    capacity -- the counters of a sketch
+    top -- the values of a sketch printed by the report
+    """
+    global ENABLED, CAPACITY, TOP
+    if enabled is not None:
+        ENABLED = enabled
+    if capacity is not None:
+        CAPACITY = capacity
+    if top is not None:
+        TOP = top
+    return
+
+def settings():
+    """Returns the options of the sketches as a tuple, for the function configure of a worker process."""
+    return ENABLED, CAPACITY, TOP
+
+def new_counter():
+    """Returns an empty dictionary of counts: a SpaceSaving sketch if ENABLED, else a defaultdict(int)."""
+    if ENABLED:
+        return SpaceSaving(CAPACITY)
+    return defaultdict(int)
+
+def restore(capacity, items):
+    """Returns a SpaceSaving sketch of (value, count, error) items, e.g. when unpickled.
+
+    Arguments:
+    capacity -- the counters of the sketch
+    items -- list of (value, count, error)
+    """
+    sketch = SpaceSaving(capacity)
+    for key, count, error in items:
+        sketch[key] = count
+        sketch.errors[key] = error
+    return sketch
+
+# ================================================== #
+#               Main Class                           #
+# ================================================== #
+
+class SpaceSaving(dict):
+    """Space-Saving sketch: a dictionary of at most capacity values -> counts, the values counted most.
+
+    Count with sketch[value] += n, as with a defaultdict(int); a missing value reads 0.
+    The attribute errors holds the most each count may be over.
+
+    Arguments:
+    capacity -- the counters of the sketch
+    """
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = max(capacity, 1)
+        self.errors = {}          # Value -> the most its count may be over
+        self.buckets = {}         # Count -> the values with this count, oldest first
+        self.least = 0            # The smallest count
+
+    def __missing__(self, key):
+        return 0
+
+    def __setitem__(self, key, count):
+        old = dict.get(self, key)
+        if old is None:
+            error = 0
+            if len(self) >= self.capacity:
+                error = self.least                       # The new value takes the least counted counter
+                victim = next(iter(self.buckets[error]))
+                dict.__delitem__(self, victim)
+                del self.errors[victim]
+                self.place(key, count + error)
+                self.displace(victim, error)
+            else:
+                self.place(key, count)
+            self.errors[key] = error
+            dict.__setitem__(self, key, count + error)
+        elif count != old:
+            self.place(key, count)
+            self.displace(key, old)
+            dict.__setitem__(self, key, count)
+
+    def __reduce__(self):
+        return restore, (self.capacity, [(key, count, self.errors[key]) for key, count in self.items()])
+
+    def place(self, key, count):
+        """Adds a value to the bucket of its count and returns None.
+
+        Arguments:
+        key -- the value
+        count -- its count
+        """
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = {}
+            if len(self.buckets) == 1 or count < self.least:
+                self.least = count
+        bucket[key] = None
+        return
+
+    def displace(self, key, count):
+        """Removes a value from the bucket of its former count and returns None.
+
+        Arguments:
+        key -- the value
+        count -- its former count
+        """
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if count == self.least and self.buckets:
+                # One more is the usual next count, else look for the smallest
+                self.least = count + 1 if count + 1 in self.buckets else min(self.buckets)
+        return
+
+    def clear(self):
+        """Removes every value and returns None."""
+        dict.clear(self)
+        self.errors.clear()
+        self.buckets.clear()
+        self.least = 0
+        return
+
+    def bound(self):
+        """Returns the most a value left out of the sketch may have been counted: 0 until the sketch is full."""
+        return self.least if len(self) >= self.capacity else 0
+
+    def merge(self, counts, errors=None):
+        """Adds the counts of another sketch or dictionary, the most counted first, and returns None.
+
+        Arguments:
+        counts -- dictionary of value -> count
+        errors -- dictionary of value -> the most the count may be over, None for exact counts
+        """
+        errors = errors or {}
+        for key, count in sorted(counts.items(), key=operator.itemgetter(1), reverse=True):
+            self[key] += count
+            self.errors[key] += errors.get(key, 0)
+        return
+
+# ================================================== #
+#               Report Function                      #
+# ================================================== #
+
+def print_items(dic):
+    """Prints the items of a dictionary of counts, the most counted first, and returns None.
+
+    A sketch prints its TOP values as (value, count, error) and the bounds of the counts.
+
+    Arguments:
+    dic -- a dictionary of counts or a SpaceSaving sketch
+    """
+    items = sorted(dic.items(), key=operator.itemgetter(1))
+    items.reverse()  # Note: In-place reversal
+    if not isinstance(dic, SpaceSaving):
+        print ( *items, sep = "\n" )
+        return
+
+    print ( *[(key, count, dic.errors[key]) for key, count in items[:TOP]], sep = "\n" )
+    if not items:
+        return
+    if dic.bound():
+        print ('(Top {} of {:,} values kept, as (value, count, error): a count may be over by its error;'.format(
+               min(TOP, len(items)), len(items)),
+               'a value not kept was counted at most {:,} times)'.format(dic.bound()))
+    else:
+        print ('(Top {} of {:,} values, as (value, count, error): exact counts)'.format(min(TOP, len(items)), len(items)))
+    return
@@ -8,7 +8,11 @@
 from email.utils import parseaddr
 from urllib.parse import urlparse
 import pprint
-import operator
+
+import compressed_input
+import fix_it
+import heavy_hitters
+import pbf_reader
 
 pp = pprint.PrettyPrinter(indent=4, width=20)
 
@@ -25,14 +29,11 @@
 tiger_issue = defaultdict(int)
 counts = defaultdict(int)
 
-# Known correct data lists
-ok_streets = [ 'Americas', 'Avenue', 'Boulevard', 'Broadway', 'Circle', 'Court', 'Drive', 'East', 'Lane',
-               'North', 'Parkway', 'Place', 'Plaza', 'Road', 'South', 'Square', 'Street', 'Terrace', 'Walk',
-               'Way', 'West']
-ok_city = ['New York', 'New York City']
-ok_domains = ['.com', '.org', '.net', '.edu', '.gov', '.us', '.nyc', '.biz', '.info', '.io', '.it',
-           '.co', '.site', '.cz', '.hu', '.int']
-uws_zips = ['10023', '10024', '10025']  # Upper West Side zip codes
+# Known correct data lists, from the rule file of "fix_it.py" (see the file "fix_rules.py")
+ok_streets = fix_it.rules.ok_streets
+ok_city = fix_it.rules.ok_city
+ok_domains = fix_it.rules.ok_domains
+uws_zips = fix_it.rules.uws_zips  # Upper West Side zip codes
 
 # Regular expressions
 # r prefix means raw string -- send RE module backslash -- RE module must process backslash as escape
@@ -176,88 +177,58 @@ def count_issues_streets(name):
             streets_issue[street_type] += 1
             return
 
-def is_street(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:street")
-
-def is_state(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:state")
-
-def is_city(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:city")
+# Count key and counting function of each fixer name (in file "fix_it.py") examined by the scan
+scan_counters = {'street': ('total_street', count_issues_streets),
+                 'city': ('total_city', count_issues_cities),
+                 'state': ('total_state', count_issues_states),
+                 'zipcode': ('total_zipcode', count_issues_zipcodes),
+                 'phone': ('total_phone', count_issues_phones),
+                 'email': ('total_email', count_issues_emails),
+                 'website': ('total_website', count_issues_websites),
+                 'tiger': ('total_tiger', count_issues_tiger)}
 
-def is_phone(elem):
-    """Examine the key of the element tag and return a boolean.
-    
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "phone")
 
-def is_email(elem):
-    """Examine the key of the element tag and return a boolean.
+def initialize_dicts():
+    """Flush the toilet and return a boolean.
     
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
+    The problem dictionaries are replaced by new ones: exact, or sketches of the most counted
+    values when the sketches are enabled (in file "heavy_hitters.py")
     """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "email")
-
-def is_website(elem):
-    """Examine the key of the element tag and return a boolean.
+    global streets_issue, us_states_issue, cities_issue, phones_issue, emails_issue, websites_issue
+    global zipcodes_issue, zips_outside
+    try:
+        streets_issue = heavy_hitters.new_counter()
+        us_states_issue = heavy_hitters.new_counter()
+        cities_issue = heavy_hitters.new_counter()
+        phones_issue = heavy_hitters.new_counter()
+        emails_issue = heavy_hitters.new_counter()
+        websites_issue = heavy_hitters.new_counter()
+        zipcodes_issue = heavy_hitters.new_counter()
+        zips_outside = heavy_hitters.new_counter()
+        tiger_issue.clear()
+        counts.clear()
+    except:
+        return None
     
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "website" or (elem.attrib["k"] == "url"))
+    return True
 
-def is_zipcode(elem):
-    """Examine the key of the element tag and return a boolean.
+def count_element(elem):
+    """Count the element if it is one of the examined tags, record any problem, and return None.
     
-    Arguments:
-    elem -- the current XML element in the Element Tree iteration
-    """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "addr:postcode")
-
-def is_tiger(elem):
-    """Examine the key of the element tag and return a boolean.
+    The tag key is looked up in the registry of fixers (in file "fix_it.py")
     
     Arguments:
     elem -- the current XML element in the Element Tree iteration
     """
-    return (elem.tag == "tag") and (elem.attrib["k"] == "tiger:reviewed")
-
-
-def initialize_dicts():
-    """Flush the toilet and return a boolean."""
-    try:
-        streets_issue.clear()
-        us_states_issue.clear()
-        cities_issue.clear()
-        phones_issue.clear()
-        emails_issue.clear()
-        websites_issue.clear()
-        zipcodes_issue.clear()
-        zips_outside.clear()
-        tiger_issue.clear()
-        counts.clear()
-    except:
-        return None
+    if elem.tag != "tag":
+        return
     
-    return True
+    counter = scan_counters.get(fix_it.fixer_name(elem.attrib['k']))
+    if counter:
+        total, count_issues = counter
+        counts[total] += 1
+        count_issues(elem.attrib['v'])
+    return
 
 #----------------------#
 #     Main routine     #
@@ -272,44 +243,32 @@ def initial_count_problems():
         print ('\nTerminating execution...')
         return None
     
-    osm_file = open(map_file, "r")
-    
-    for event, elem in ET.iterparse(osm_file):
-        if event == "end":
-            if is_street(elem):
-                counts['total_street'] += 1
-                count_issues_streets(elem.attrib['v'])
-            
-            if is_city(elem):
-                counts['total_city'] += 1
-                count_issues_cities(elem.attrib["v"])
-                
-            if is_state(elem):
-                counts['total_state'] += 1
-                count_issues_states(elem.attrib["v"])
-            
-            if is_zipcode(elem):
-                counts['total_zipcode'] += 1
-                count_issues_zipcodes(elem.attrib["v"])
-            
-            if is_phone(elem):
-                counts['total_phone'] += 1
-                count_issues_phones(elem.attrib["v"])
-                
-            if is_email(elem):
-                counts['total_email'] += 1
-                count_issues_emails(elem.attrib["v"])
-                
-            if is_website(elem):
-                counts['total_website'] += 1
-                count_issues_websites(elem.attrib["v"])
-            
-            if is_tiger(elem):
-                counts['total_tiger'] += 1
-                count_issues_tiger(elem.attrib["v"])
+    if pbf_reader.is_pbf(map_file):       # Binary file: same elements as the XML end events
+        for elem in pbf_reader.iter_elements(map_file):
+            count_element(elem)
+            counts['record_count'] += 1
+        print_initial_scan()
+        return
+    
+    osm_file = compressed_input.open_osm(map_file)   # Plain or compressed file
+    
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)          # The <osm> root element
+    depth = 1
+    
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        count_element(elem)
         
         counts['record_count'] += 1         
         elem.clear()
+        if depth == 1:               # Remove the cleared top level element from the root
+            root.clear()
+    
+    del context
     
     osm_file.close()
     print_initial_scan()
@@ -317,85 +276,61 @@ def initial_count_problems():
 
 def print_initial_scan():
     """Print a report and return None."""
-    streets_issue_sort = sorted(streets_issue.items(), key=operator.itemgetter(1))
-    streets_issue_sort.reverse()  # Note: In-place reversal
-    
-    cities_issue_sort = sorted(cities_issue.items(), key=operator.itemgetter(1))
-    cities_issue_sort.reverse()  # Note: In-place reversal
-    
-    us_states_issue_sort = sorted(us_states_issue.items(), key=operator.itemgetter(1))
-    us_states_issue_sort.reverse()  # Note: In-place reversal
-    
-    zipcodes_issue_sort = sorted(zipcodes_issue.items(), key=operator.itemgetter(1))
-    zipcodes_issue_sort.reverse()  # Note: In-place reversal
-    
-    zips_outside_sort = sorted(zips_outside.items(), key=operator.itemgetter(1))
-    zips_outside_sort.reverse()  # Note: In-place reversal
-    
-    phones_issue_sort = sorted(phones_issue.items(), key=operator.itemgetter(1))
-    phones_issue_sort.reverse()  # Note: In-place reversal
-    
-    emails_issue_sort = sorted(emails_issue.items(), key=operator.itemgetter(1))
-    emails_issue_sort.reverse()  # Note: In-place reversal
-    
-    websites_issue_sort = sorted(websites_issue.items(), key=operator.itemgetter(1))
-    websites_issue_sort.reverse()  # Note: In-place reversal
-    
     sum_val = sum(streets_issue.values())
     print ('Number of street issues: {:,}'.format(sum_val))
     print ('Total number of streets: {:,}'.format(counts['total_street']),           \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_street']))
     print ("Street problems: ")
-    print ( *streets_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(streets_issue)
     
     sum_val = sum(cities_issue.values())
     print ('\nNumber of city issues: {:,}'.format(sum_val))
     print ('Total number of cities: {:,}'.format(counts['total_city']),            \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_city']))
     print ("City problems: ")
-    print ( *cities_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(cities_issue)
     
     sum_val = sum(us_states_issue.values())
     print ('\nNumber of state issues: {:,}'.format(sum_val))
     print ('Total number of states: {:,}'.format(counts['total_state']),            \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_state']))
     print ("State problems: ")
-    print ( *us_states_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(us_states_issue)
     
     sum_val = sum(zipcodes_issue.values())
     print ('\nNumber of zipcode issues: {:,}'.format(sum_val))
     print ('Total number of zipcodes: {:,}'.format(counts['total_zipcode']),          \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_zipcode']))
     print ("Zip code problems: ")
-    print ( *zipcodes_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(zipcodes_issue)
     
     sum_val = sum(zips_outside.values())
     print ('\nNumber of zipcodes outside Upper West Side: {:,}'.format(sum_val))
     print ('Total number of zipcodes: {:,}'.format(counts['total_zipcode']),             \
            '  Percent outside UWS: {:.1%}'.format(float(sum_val)/counts['total_zipcode']))
     print ("Zip codes outside UWS: ")
-    print ( *zips_outside_sort, sep = "\n" )
+    heavy_hitters.print_items(zips_outside)
     
     sum_val = sum(phones_issue.values())
     print ('\nNumber of phone number issues: {:,}'.format(sum_val))
     print ('Total number of phone numbers: {:,}'.format(counts['total_phone']),     \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_phone']))
     print ("Phone problems: ")
-    print ( *phones_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(phones_issue)
     
     sum_val = sum(emails_issue.values())
     print ('\nNumber of email address issues: {:,}'.format(sum_val))
     print ('Total number of email addresses: {:,}'.format(counts['total_email']),   \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_email']))
     print ("email problems: ")
-    print ( *emails_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(emails_issue)
     
     sum_val = sum(websites_issue.values())
     print ('\nNumber of website URL issues: {:,}'.format(sum_val))
     print ('Total number of websites: {:,}'.format(counts['total_website']),          \
            '  Percent problems: {:.1%}'.format(float(sum_val)/counts['total_website']))
     print ("Website problems: ")
-    print ( *websites_issue_sort, sep = "\n" )
+    heavy_hitters.print_items(websites_issue)
     
     sum_val = sum(tiger_issue.values())
     print ('\nNumber of TIGER issues: {:,}'.format(sum_val))
@@ -0,0 +1,129 @@
+# Filename: interning.py
+# Python 3.7
+# Notes:
+#    This is a module of main_process.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Share one string object between the repeated attribute values of the parsed elements
+
+# The parser makes a new string for every attribute value, so a 'user' name or an 'addr:city'
+#   value repeated across a million elements is held a million times by the elements in flight.
+# "intern_element" replaces the values of the opted in fields with one shared string per distinct
+#   value, right after parsing:
+#   INTERN_ATTRIBUTES -- attributes of the <node> and <way> elements and of their <nd> children
+#   INTERN_TAG_KEYS   -- the k attribute of the child <tag> elements
+#   INTERN_TAG_VALUES -- the v attribute of the child <tag> elements with these keys
+# Each field has its own table of at most TABLE_SIZE values; once a table is full, new values of a
+#   high cardinality field pass through unchanged.
+# "print_intern_stats" reports the lookups, the hits and the bytes of the duplicate strings released.
+
+import sys
+from collections import defaultdict
+
+INTERN_ATTRIBUTES = ['user', 'uid', 'version']
+INTERN_TAG_KEYS = True
+INTERN_TAG_VALUES = ['addr:city', 'addr:state', 'addr:postcode', 'addr:street', 'amenity', 'building',
+                     'cuisine', 'shop', 'tiger:reviewed']
+
+TABLE_SIZE = 20000        # Distinct values kept for each field
+
+tables = defaultdict(dict)                            # field -> {value: shared value}
+intern_stats = defaultdict(lambda: defaultdict(int))  # field -> 'lookups', 'hits', 'bytes', 'table full'
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def intern_value(field, value):
+    """Returns the shared string equal to the value, adding the value to the table of the field
+       while the table has room.
+
+    Arguments:
+    field -- the attribute name or the tag key the value belongs to
+    value -- the attribute value
+    """
+    table = tables[field]
+    stats = intern_stats[field]
+    stats['lookups'] += 1
+
+    shared = table.get(value)
+    if shared is not None:
+        if shared is not value:
+            stats['hits'] += 1
+            stats['bytes'] += sys.getsizeof(value)     # The parsed copy can now be released
+        return shared
+
+    if len(table) < TABLE_SIZE:
+        table[value] = value
+    else:
+        stats['table full'] += 1
+    return value
+
+def clear():
+    """Clears the intern tables and their statistics, and returns None."""
+    tables.clear()
+    intern_stats.clear()
+    return
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+
+def intern_element(element, attributes=INTERN_ATTRIBUTES, tag_keys=INTERN_TAG_KEYS, tag_values=INTERN_TAG_VALUES):
+    """Replaces the opted in attribute values of the element and its children with shared strings,
+       and returns the element.
+
+    Arguments:
+    element -- an element tree or Record of a <node> or <way>
+    attributes -- attribute names of the element and its <nd> children to intern
+    tag_keys -- intern the k attribute of the child <tag> elements
+    tag_values -- keys of the child <tag> elements whose v attribute is interned
+    """
+    attrib = element.attrib
+    for name in attributes:
+        if name in attrib:
+            attrib[name] = intern_value(name, attrib[name])
+
+    for child in element:
+        attrib = child.attrib
+        if child.tag == 'tag':
+            k = attrib.get('k')
+            if k is None:
+                continue
+            if tag_keys:
+                attrib['k'] = k = intern_value('k', k)
+            if k in tag_values and 'v' in attrib:
+                attrib['v'] = intern_value(k, attrib['v'])
+        else:
+            for name in attributes:
+                if name in attrib:
+                    attrib[name] = intern_value(name, attrib[name])
+    return element
+
+def interned(elements, attributes=INTERN_ATTRIBUTES, tag_keys=INTERN_TAG_KEYS, tag_values=INTERN_TAG_VALUES):
+    """Yield the elements with their opted in attribute values interned.
+
+    Arguments:
+    elements -- iterable of element trees or Records
+    attributes -- attribute names of the element and its <nd> children to intern
+    tag_keys -- intern the k attribute of the child <tag> elements
+    tag_values -- keys of the child <tag> elements whose v attribute is interned
+    """
+    for element in elements:
+        yield intern_element(element, attributes, tag_keys, tag_values)
+    return
+
+def print_intern_stats():
+    """Prints the lookups, hits and bytes released of each interned field, and returns None."""
+    print ('\n----------------')
+    print ('STRING INTERNING\n')
+    print ('    {:<16} {:>12} {:>12} {:>10} {:>14} {:>12}'.format('Field', 'Lookups', 'Hits', 'Distinct',
+                                                               'Bytes saved', 'Table full'))
+    total = 0
+    for field in sorted(intern_stats, key=lambda f: -intern_stats[f]['bytes']):
+        stats = intern_stats[field]
+        total += stats['bytes']
+        print ('    {:<16} {:>12,} {:>12,} {:>10,} {:>14,} {:>12,}'.format(field, stats['lookups'], stats['hits'],
+                                                                        len(tables[field]), stats['bytes'],
+                                                                        stats['table full']))
+    print ('\nDuplicate strings released: {:,.1f} MB'.format(total / 1e6))
+    return
@@ -18,13 +18,20 @@
 import xml.etree.cElementTree as ET
 import cerberus
 import sys
+import threading
 
 #==========================#
 #     Import .py files     #
 #==========================#
 
+import compressed_input
 import db_schema
+import element_index
 import element_to_dictionary
+import event_log
+import interning
+import pbf_reader
+import quarantine
 import fix_it
 
 #===============================#
@@ -51,20 +58,39 @@
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
 
+# Element dictionary key, csv file and field list of each csv file
+CSV_TABLES = [('node', NODES_PATH, NODE_FIELDS),
+              ('node_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+              ('way', WAYS_PATH, WAY_FIELDS),
+              ('way_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS),
+              ('way_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS)]
+
 # =============================================================== #
 #               Main Process Helper Functions                     #
 # =============================================================== #
 
-def get_element_tree(osm_file, tags=('node', 'way')):
+def get_element_tree(osm_file, tags=('node', 'way'), stats=None):
     """Parse XML file data and yield an element tree.
        
     Iteratively step through each top level XML element <node> or <way> 
     and read in sections of the XML file as a tree of the element
     
     Arguments:
-    osm_file -- the Open Street Map XML file to process
+    osm_file -- the Open Street Map file to process (.osm, .osm.bz2, .osm.gz, .osm.xz or .osm.pbf),
+                or a file object opened in binary mode
     tags -- list of XML parent tags to process
+    stats -- the Stats (in file "fix_it.py") counting the elements, fix_it.default_stats if None
     """
+    if pbf_reader.is_pbf(osm_file):       # Binary file decoded on a pool of worker processes
+        yield from pbf_reader.read_records(osm_file, tags, stats=stats)
+        return
+    
+    counts = (fix_it.default_stats if stats is None else stats).counts
+    
+    opened = isinstance(osm_file, str)
+    if opened:
+        osm_file = compressed_input.open_osm(osm_file)   # Decompress on the fly
+    
     context = ET.iterparse(osm_file, events=('start', 'end'))
         # iterparse returns a stream of events between start and end.
         # Returns an iterator providing (event, element) pairs
@@ -74,16 +100,24 @@ def get_element_tree(osm_file, tags=('node', 'way')):
         # next() returns the next item in an iterator. Do not use context.next() in Python 3
         # _ is a dummy variable for event. We are only interested in the root reference  
     
+    depth = 0                         # 0 while between the top level elements
     for event, element in context:    # the result is an iterable that returns a stream of (event, element) tuples 
-        if event == 'end':            # end returns the fully populated element (including children)
-            fix_it.counts['element count'] += 1
+        if event == 'start':
+            depth += 1
+        else:                         # end returns the fully populated element (including children)
+            depth -= 1
+            counts['element count'] += 1
             if element.tag in tags:
                 yield element        # yield returns a generator
                 root.clear()         # remove the XML section from memory
             else:
-                fix_it.counts['not a node or way count'] += 1
+                counts['not a node or way count'] += 1
+                if depth == 0:       # <relation>, <bounds> and other top level elements are removed too
+                    root.clear()
     
     del context
+    if opened:
+        osm_file.close()
     return
 
 #  Raise Validation Error if dictionary does not match schema
@@ -109,11 +143,138 @@ def validate_dictionary(dict, validator, schema=SCHEMA):
     return
 
 
+def write_element(element_tree, writers, validator, validate, stats=None):
+    """Builds the dictionary of one element tree, validates it, writes it to the CSV files, and returns None.
+    
+    Arguments:
+    element_tree -- the current element tree in the XML file iteration
+    writers -- dictionary of csv.DictWriter objects keyed by 'node', 'node_tags', 'way', 'way_nodes', 'way_tags'
+    validator -- Cerberus
+    validate -- boolean switch to turn on or off validation
+    stats -- the Stats (in file "fix_it.py") of the run, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    dict = element_to_dictionary.build_dictionary_element_tree(element_tree, stats=stats)
+    if dict:                   # returns False if dict is equal to '0', None', '', False, or empty structure
+        stats.counts['node way count'] += 1
+        if validate is True:
+            validate_dictionary(dict, validator, schema=SCHEMA)
+
+        if element_tree.tag == 'node':
+            stats.counts['node count'] += 1
+            writers['node'].writerow(dict['node'])
+            writers['node_tags'].writerows(dict['node_tags'])
+        
+        elif element_tree.tag == 'way':
+            stats.counts['way count'] += 1
+            writers['way'].writerow(dict['way'])
+            writers['way_nodes'].writerows(dict['way_nodes'])
+            writers['way_tags'].writerows(dict['way_tags'])
+            
+    else:
+        event_log.event(stats, 'info', 'element', '    -- Dictionary returned is:  ', dict)
+    return
+
+def write_element_compact(element_tree, writers, validator, validate, stats=None):
+    """Builds the compact rows of one element tree, validates them, writes them to the CSV files, and returns None.
+    
+    Same csv files as the function write_element, without a dictionary per row
+    
+    Arguments:
+    element_tree -- the current element tree in the XML file iteration
+    writers -- dictionary of csv.writer objects keyed by 'node', 'node_tags', 'way', 'way_nodes', 'way_tags'
+    validator -- Cerberus
+    validate -- boolean switch to turn on or off validation
+    stats -- the Stats (in file "fix_it.py") of the run, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    rows = element_to_dictionary.build_rows_element_tree(element_tree, stats=stats)
+    if rows:
+        stats.counts['node way count'] += 1
+        if validate is True:
+            validate_dictionary(rows_to_dictionary(rows), validator, schema=SCHEMA)
+
+        if element_tree.tag == 'node':
+            stats.counts['node count'] += 1
+            writers['node'].writerow(rows['node'])
+            writers['node_tags'].writerows(rows['node_tags'])
+        
+        else:
+            stats.counts['way count'] += 1
+            writers['way'].writerow(rows['way'])
+            writers['way_nodes'].writerows(rows['way_nodes'])
+            writers['way_tags'].writerows(rows['way_tags'])
+            
+    else:
+        event_log.event(stats, 'info', 'element', '    -- Dictionary returned is:  ', rows)
+    return
+
+def write_element_columnar(element_tree, writers, validator, validate, columns, stats=None):
+    """Same as the function write_element_compact, but the way node rows are collected in the columns
+       and written in blocks of WAY_NODES_BATCH rows, and returns None.
+    
+    Arguments:
+    element_tree -- the current element tree in the XML file iteration
+    writers -- dictionary of csv.writer objects keyed by 'node', 'node_tags', 'way', 'way_nodes', 'way_tags'
+    validator -- Cerberus
+    validate -- boolean switch to turn on or off validation
+    columns -- the WayNodeColumns batch (in file "element_to_dictionary.py")
+    stats -- the Stats (in file "fix_it.py") of the run, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    start = len(columns)          # The rows of a way are appended after this row
+    rows = element_to_dictionary.build_rows_element_tree(element_tree, way_node_columns=columns, stats=stats)
+    if rows:
+        stats.counts['node way count'] += 1
+        if validate is True:
+            dict = rows_to_dictionary(rows)
+            if len(columns) > start:      # The way node rows held in the columns, as integers the schema accepts
+                dict['way_nodes'] = [{'id': way_id, 'node_id': node_id, 'position': position}
+                                     for way_id, node_id, position in columns.rows(start)]
+            validate_dictionary(dict, validator, schema=SCHEMA)
+
+        if element_tree.tag == 'node':
+            stats.counts['node count'] += 1
+            writers['node'].writerow(rows['node'])
+            writers['node_tags'].writerows(rows['node_tags'])
+        
+        else:
+            stats.counts['way count'] += 1
+            writers['way'].writerow(rows['way'])
+            if rows['way_nodes']:             # A way kept as tuples: write the rows before it first
+                element_to_dictionary.write_way_node_columns(columns, writers['way_nodes'])
+                writers['way_nodes'].writerows(rows['way_nodes'])
+            elif len(columns) >= element_to_dictionary.WAY_NODES_BATCH:
+                element_to_dictionary.write_way_node_columns(columns, writers['way_nodes'])
+            writers['way_tags'].writerows(rows['way_tags'])
+            
+    else:
+        event_log.event(stats, 'info', 'element', '    -- Dictionary returned is:  ', rows)
+    return
+
+def rows_to_dictionary(rows):
+    """Returns the dictionary of the function build_dictionary_element_tree for the compact rows
+       of the function build_rows_element_tree, for validation.
+    
+    Arguments:
+    rows -- the dictionary of compact rows of one element
+    """
+    dict = {}
+    for key, path, fields in CSV_TABLES:
+        if key in ('node', 'way'):
+            if key in rows:          # Missing attributes are None in the compact row
+                dict[key] = {field: value for field, value in zip(fields, rows[key]) if value is not None}
+        elif key in rows:
+            dict[key] = [{field: value for field, value in zip(fields, row)} for row in rows[key]]
+    return dict
+
+
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
 
-def process_xml_elements(file_in, validate):
+def process_xml_elements(file_in, validate, index=False, compact=False, intern=False,
+                         columnar=False, key_stats=False, stats=None):
     """Iteratively process each XML element tree, build dictionary, validate, and write to CSV files.
     
     Aborts execution if a problem occurs or returns None if successful
@@ -125,15 +286,30 @@ def process_xml_elements(file_in, validate):
     Prints a report and returns if successful or aborts if problem occurs
     
     Arguments:
-    file_in -- the Open Street Map XML file to process
+    file_in -- the Open Street Map file to process (XML or PBF)
     validate -- boolean switch to turn on or off validation
+    index -- also write the byte offset index of the elements (in file "element_index.py") in a second thread
+    compact -- build the csv rows as tuples and write them with csv.writer instead of dictionaries and csv.DictWriter
+    intern -- share one string between the repeated attribute values (in file "interning.py") and report the saving
+    columnar -- compact rows, with the way node rows held in typed integer arrays and written in large blocks
+    key_stats -- report the hit rate of the key cache (in file "element_to_dictionary.py")
+    stats -- the Stats (in file "fix_it.py") to count in, fix_it.default_stats if None
     """
-    response = fix_it.initialize()
+    if index and (compressed_input.is_compressed(file_in) or pbf_reader.is_pbf(file_in)):
+        print ('The index needs an uncompressed .osm file: ', file_in)
+        print ('\nTerminating execution...')
+        return None
+    
+    stats = fix_it.default_stats if stats is None else stats
+    response = fix_it.initialize(stats)
     
     if not response:
         print ('Fatal Error initializing dictionaries')
         print ('\nTerminating execution...')
         return None
+    
+    event_log.start()
+    quarantine.start()
         
     with open(NODES_PATH, 'w') as nodes_file, \
          open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
@@ -153,81 +329,106 @@ def process_xml_elements(file_in, validate):
         way_nodes_writer.writeheader()
         way_tags_writer.writeheader()
 
+        writers = {'node': nodes_writer, 'node_tags': node_tags_writer,
+                   'way': ways_writer, 'way_nodes': way_nodes_writer, 'way_tags': way_tags_writer}
+
+        if compact or columnar:      # Plain writers for the tuples of the compact rows, with the same header rows
+            writers = {'node': csv.writer(nodes_file), 'node_tags': csv.writer(nodes_tags_file),
+                       'way': csv.writer(ways_file), 'way_nodes': csv.writer(way_nodes_file),
+                       'way_tags': csv.writer(way_tags_file)}
+
         validator = cerberus.Validator()
         
+        if index:
+            indexed = []      # The element count returned by the index thread
+            index_thread = threading.Thread(target=lambda: indexed.append(element_index.build_index(file_in)))
+            index_thread.start()
+        
         print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
 
-        for element_tree in get_element_tree(file_in, tags=('node', 'way')):
-            dict = element_to_dictionary.build_dictionary_element_tree(element_tree)
-            if dict:                   # returns False if dict is equal to '0', None', '', False, or empty structure
-                fix_it.counts['node way count'] += 1
-                if validate is True:
-                    validate_dictionary(dict, validator, schema=SCHEMA)
-
-                if element_tree.tag == 'node':
-                    fix_it.counts['node count'] += 1
-                    nodes_writer.writerow(dict['node'])
-                    node_tags_writer.writerows(dict['node_tags'])
-                
-                elif element_tree.tag == 'way':
-                    fix_it.counts['way count'] += 1
-                    ways_writer.writerow(dict['way'])
-                    way_nodes_writer.writerows(dict['way_nodes'])
-                    way_tags_writer.writerows(dict['way_tags'])
-                    
-            else:
-                print ('    -- Dictionary returned is:  ', dict)
+        element_to_dictionary.clear_key_cache()
+        elements = get_element_tree(file_in, tags=('node', 'way'), stats=stats)
+
+        if intern:
+            interning.clear()
+            elements = interning.interned(elements)
+        
+        if columnar:
+            columns = element_to_dictionary.WayNodeColumns()
+            for element_tree in elements:
+                write_element_columnar(element_tree, writers, validator, validate, columns, stats)
+            element_to_dictionary.write_way_node_columns(columns, writers['way_nodes'])
+        else:
+            write = write_element_compact if compact else write_element
+            for element_tree in elements:
+                write(element_tree, writers, validator, validate, stats)
+    
+    if index:
+        index_thread.join()
     
-    print_summary()
-    fix_it.print_detailed_fixes(fix_it.counts)
+    print_summary(stats)
+    fix_it.print_detailed_fixes(stats)
     print ()
     if validate is True:
         print ('Validation... Passed')
     print ('\nCSV files created')
+    if index and indexed:
+        print ('Index of {:,} nodes and ways written to {}'.format(indexed[0], element_index.index_path(file_in)))
+    if key_stats:
+        element_to_dictionary.print_key_cache_stats()
+    if intern:
+        interning.print_intern_stats()
+    event_log.finish(stats)
+    quarantine.finish(stats)
     return
 
 # ================================================================================= #
 #               Function to print a report of the process                           #
 # ================================================================================= #
 
-def print_summary():
-    """Prints a summary report of data corrections and eliminations, and returns None."""
+def print_summary(stats=None):
+    """Prints a summary report of data corrections and eliminations, and returns None.
+    
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
     print ('\n-------')
     print ('SUMMARY')
     print ("\nTag counts:")
-    print ("    Nodes: {:,}".format(fix_it.counts['node count']) )
-    print ("    Ways: {:,}".format(fix_it.counts['way count']) )
-    print ("    Nodes tags: {:,}".format(fix_it.counts['node tag count']) )
-    print ("    Ways tags: {:,}".format(fix_it.counts['way tag count']) )
-    print ("    Ways Nodes: {:,}".format(fix_it.counts['way node tag count']) )
+    print ("    Nodes: {:,}".format(stats.counts['node count']) )
+    print ("    Ways: {:,}".format(stats.counts['way count']) )
+    print ("    Nodes tags: {:,}".format(stats.counts['node tag count']) )
+    print ("    Ways tags: {:,}".format(stats.counts['way tag count']) )
+    print ("    Ways Nodes: {:,}".format(stats.counts['way node tag count']) )
     
     print ('\nEliminated tag counts:')
     print ("    Tags with bad data values")
-    print ('        Nodes tags voided: {:,}'.format(fix_it.counts['node child value eliminated']))
-    print ('        Ways tags voided: {:,}'.format(fix_it.counts['way child value eliminated']))
+    print ('        Nodes tags voided: {:,}'.format(stats.counts['node child value eliminated']))
+    print ('        Ways tags voided: {:,}'.format(stats.counts['way child value eliminated']))
     
     print ('\n    Tags with corrupt ID')
-    total = sum(fix_it.node_id_bad.values())
+    total = stats.total('node_id_bad')
     print ('        Nodes removed: {:,}'.format(total))
-    total = sum(fix_it.way_id_bad.values())
+    total = stats.total('way_id_bad')
     print ('        Ways removed: {:,}'.format(total))
     
     print ("\n    Tags with corrupt keys")
-    print ('        Nodes tags with key problem:  {:,}'.format(fix_it.counts['node child key eliminated']))
-    print ('        Ways tags with key problem:  {:,}'.format(fix_it.counts['way child key eliminated']))
+    print ('        Nodes tags with key problem:  {:,}'.format(stats.counts['node child key eliminated']))
+    print ('        Ways tags with key problem:  {:,}'.format(stats.counts['way child key eliminated']))
     
     print ("\n    Tags with defective reference")
-    total = sum(fix_it.way_node_reference_bad.values())
+    total = stats.total('way_node_reference_bad')
     print ('        Ways Nodes tags voided: {:,}'.format(total))
     
     print ("\nSkipped tag counts")
-    print ('    Node child tags skipped: {:,}'.format(fix_it.counts['node tag skipped']))
-    print ('    Way child tags skipped: {:,}'.format(fix_it.counts['way tag skipped']))
-    total = fix_it.counts['node tag skipped'] + fix_it.counts['way tag skipped']
+    print ('    Node child tags skipped: {:,}'.format(stats.counts['node tag skipped']))
+    print ('    Way child tags skipped: {:,}'.format(stats.counts['way tag skipped']))
+    total = stats.counts['node tag skipped'] + stats.counts['way tag skipped']
     print ('    Total tags skipped: {:,}'.format(total))
     
-    print ( "\nTotal non-node or non-way count: {:,}".format(fix_it.counts['not a node or way count']) )
-    print ( "\nTotal elements processed: {:,}".format(fix_it.counts['element count']) )
+    print ( "\nTotal non-node or non-way count: {:,}".format(stats.counts['not a node or way count']) )
+    print ( "\nTotal elements processed: {:,}".format(stats.counts['element count']) )
     return
 
 
@@ -0,0 +1,125 @@
+# Filename: memory_check.py
+# Python 3.7
+# Purpose: Check that the XML readers keep memory flat on relation heavy files
+
+# The <relation> elements (with their <member> and <tag> children) sit at the end of an OSM file.
+# A reader that only clears the root after a <node> or <way> keeps every relation in memory
+#   until the parse finishes.
+# This check writes two synthetic OSM files, a small one and one with hundreds of thousands of
+#   relations, reads each in a fresh Python process, and compares the peak resident memory (RSS).
+# The large file may use at most RSS_LIMIT_MB more than the small one.
+#
+# 'python memory_check.py' prints the peak memory of each reader and exits with status 1 on a failure
+# 'python -m pytest -m slow' runs the same check as a test (see file "test_memory_check.py")
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+RELATIONS = 300000         # Relations in the large synthetic file
+SMALL_RELATIONS = 50000    # Relations in the small synthetic file
+RSS_LIMIT_MB = 32          # Allowed growth of the peak memory between the two files (a few reader blocks)
+
+# Child tags of the synthetic nodes: one of each key examined by "initial_scan.py"
+NODE_TAGS = ''.join('  <tag k="{}" v="{}"/>\n'.format(k, v) for k, v in
+                    [('amenity', 'cafe'), ('addr:street', 'Broadway'), ('addr:city', 'New York'),
+                     ('addr:state', 'NY'), ('addr:postcode', '10024'), ('phone', '+1 212 555 1234'),
+                     ('email', 'cafe@example.com'), ('website', 'http://example.com'), ('tiger:reviewed', 'no')])
+
+# Reader name and the code run in the child process for the file name in sys.argv[1]
+READERS = [('main_process.get_element_tree',
+            "import main_process\nfor e in main_process.get_element_tree(sys.argv[1], tags=('node', 'way')): pass"),
+           ('xml_csv_validation_routines.element_tree',
+            "import xml_csv_validation_routines\nfor e in xml_csv_validation_routines.element_tree(sys.argv[1]): pass"),
+           ('initial_scan.initial_count_problems',
+            "import initial_scan\ninitial_scan.map_file = sys.argv[1]\ninitial_scan.initial_count_problems()")]
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def write_osm_file(path, relations):
+    """Writes a synthetic OSM file with a <bounds>, some nodes and ways, and the relations, returns None.
+
+    Arguments:
+    path -- the file name
+    relations -- the number of <relation> elements
+    """
+    with open(path, 'w') as osm_file:
+        osm_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        osm_file.write(' <bounds minlat="40.77" minlon="-73.99" maxlat="40.80" maxlon="-73.95"/>\n')
+        for i in range(1, 1001):
+            osm_file.write(' <node id="{}" lat="40.78" lon="-73.97" version="1" changeset="1" user="a" uid="1"'
+                           ' timestamp="2016-01-01T00:00:00Z">\n'.format(i) + NODE_TAGS + ' </node>\n')
+        for i in range(1, 101):
+            osm_file.write(' <way id="{}" version="1" changeset="1" user="a" uid="1" timestamp="2016-01-01T00:00:00Z">\n'
+                           '  <nd ref="{}"/>\n  <nd ref="{}"/>\n </way>\n'.format(i, i, i + 1))
+        for i in range(1, relations + 1):
+            osm_file.write(' <relation id="{}" version="1" changeset="1" user="a" uid="1"'
+                           ' timestamp="2016-01-01T00:00:00Z">\n'
+                           '  <member type="node" ref="{}" role=""/>\n'
+                           '  <member type="way" ref="{}" role="outer"/>\n'
+                           '  <member type="way" ref="{}" role="inner"/>\n'
+                           '  <tag k="type" v="multipolygon"/>\n'
+                           '  <tag k="name" v="Relation {}"/>\n'
+                           ' </relation>\n'.format(i, i % 1000 + 1, i % 100 + 1, (i + 1) % 100 + 1, i))
+        osm_file.write('</osm>\n')
+    return
+
+def peak_rss_mb(code, osm_file):
+    """Runs the reader code in a new Python process and returns its peak resident memory in MB.
+
+    Arguments:
+    code -- the Python code reading the file name in sys.argv[1]
+    osm_file -- the OSM file to read
+    """
+    script = ("import resource, sys\n" + code +
+              "\nprint(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    output = subprocess.check_output([sys.executable, '-c', script, osm_file],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return int(output.split()[-1]) / 1024        # ru_maxrss is in kilobytes on Linux
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def check_memory(relations=RELATIONS, limit_mb=RSS_LIMIT_MB):
+    """Compares the peak memory of each reader on a small and a relation heavy file, prints a report,
+       and returns True if every reader stays within the limit.
+
+    Arguments:
+    relations -- the number of relations in the large file
+    limit_mb -- allowed growth of the peak memory in MB
+    """
+    temp_dir = tempfile.mkdtemp(prefix='memory_check_')
+    small_file = os.path.join(temp_dir, 'small.osm')
+    large_file = os.path.join(temp_dir, 'relations.osm')
+    passed = True
+
+    try:
+        write_osm_file(small_file, SMALL_RELATIONS)
+        write_osm_file(large_file, relations)
+        print ('Synthetic file: {:,} relations, {:,} bytes\n'.format(relations, os.path.getsize(large_file)))
+        print ('    {:<42} {:>10} {:>10} {:>8}'.format('Reader', 'Small MB', 'Large MB', 'Result'))
+
+        for name, code in READERS:
+            small = peak_rss_mb(code, small_file)
+            large = peak_rss_mb(code, large_file)
+            ok = large - small <= limit_mb
+            passed = passed and ok
+            print ('    {:<42} {:>10.1f} {:>10.1f} {:>8}'.format(name, small, large, 'ok' if ok else 'FAILED'))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print ('\nPeak memory growth limit: {} MB... {}'.format(limit_mb, 'Passed' if passed else 'FAILED'))
+    return passed
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    if not check_memory():
+        sys.exit(1)
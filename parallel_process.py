@@ -0,0 +1,307 @@
+# Filename: parallel_process.py
+# Python 3.7
+# Purpose: Process the XML file in parallel byte range shards
+
+# The OSM file is split into byte ranges that start on a top level <node> or <way> element; the
+#   markup inside comments and CDATA sections is skipped when looking for these starts.
+# Each shard is parsed in its own worker process by the same routines used in "main_process.py":
+#   "get_element_tree", "build_dictionary_element" (in file "element_to_dictionary.py") and
+#   "fixer" (in file "fix_it.py").
+# Every worker writes its rows to csv part files, its 'jsonl' events (in file "event_log.py") to an
+#   event part file and its eliminated values (in file "quarantine.py") to a quarantine part file,
+#   and returns a snapshot of the "fix_it" dictionaries.
+# The part files and the snapshots are merged in file order, so the csv files and the report are
+#   the same as a serial run of "process_xml_elements".
+
+import csv
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import cerberus
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import compressed_input
+import element_index
+import element_to_dictionary
+import event_log
+import fix_it
+import heavy_hitters
+import main_process
+import pbf_reader
+import quarantine
+
+#=========================================#
+#     Define regular expression           #
+#=========================================#
+
+# The start of a comment or CDATA section (group 1), or the start of a top level <node> or <way> element
+element_start_re = re.compile(rb"(<!--|<!\[CDATA\[)|<(node|way)[\s/>]")
+skip_start_re = re.compile(rb"<!--|<!\[CDATA\[")      # The start of a comment or CDATA section
+
+SHARDS_PER_WORKER = 4      # Smaller shards balance the load between the workers
+EVENTS_PART = 'events.jsonl'     # Part file name of the events of a shard in 'jsonl' mode
+QUARANTINE_PART = 'quarantine'   # Part file name of the eliminated values of a shard, not compressed
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def find_element_start(osm_file, offset, known=0):
+    """Returns the byte offset of the first <node> or <way> element at or after the offset,
+       or None if there is none.
+
+    Markup inside comments and CDATA sections is skipped, as an XML parser skips it, so a
+    commented out element is never the start of a shard
+
+    Arguments:
+    osm_file -- the Open Street Map XML file opened in binary mode
+    offset -- the byte offset where the search starts
+    known -- a byte offset before the offset that is not inside a comment or CDATA section,
+             e.g. the previous boundary; the sections are looked for from there
+    """
+    if offset >= os.fstat(osm_file.fileno()).st_size:
+        return None
+    with mmap.mmap(osm_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = known
+        while True:                   # Step over the comments and CDATA sections started before the offset
+            pos = mm.find(b'<!', pos, offset + 1)
+            if pos < 0:
+                pos = offset
+                break
+            m = skip_start_re.match(mm, pos)
+            if not m:                 # e.g. <!DOCTYPE
+                pos += 2
+                continue
+            pos = element_index.skip_end(mm, m)
+            if pos < 0:
+                return None           # Not closed
+            if pos >= offset:
+                break
+
+        while True:
+            m = element_start_re.search(mm, pos)
+            if not m:
+                return None
+            if not m.group(1):
+                return m.start()
+            pos = element_index.skip_end(mm, m)
+            if pos < 0:
+                return None
+
+def shard_offsets(file_in, shards):
+    """Splits the file into byte ranges and returns the list of the range boundaries.
+
+    Every boundary after the first is the start of a top level <node> or <way> element,
+    and the last boundary is the size of the file
+
+    Arguments:
+    file_in -- the Open Street Map XML file to process
+    shards -- the number of byte ranges wanted
+    """
+    size = os.path.getsize(file_in)
+    offsets = [0]
+
+    with open(file_in, 'rb') as osm_file:
+        for i in range(1, shards):
+            start = find_element_start(osm_file, size * i // shards, offsets[-1])
+            if start is None:      # Only <relation> elements are left
+                break
+            if start > offsets[-1]:
+                offsets.append(start)
+
+    offsets.append(size)
+    return offsets
+
+class ShardFile(object):
+    """Read only file object for one byte range of the OSM file.
+
+    The byte range is wrapped in an <osm> root element when it does not contain
+    the start or the end of the file, so the shard parses as a complete XML document.
+    """
+    def __init__(self, file_in, start, end):
+        self.osm_file = open(file_in, 'rb')
+        self.osm_file.seek(start)
+        self.remaining = end - start
+        self.head = b'' if start == 0 else b'<osm>'
+        self.tail = b'' if end == os.path.getsize(file_in) else b'</osm>'
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.remaining + len(self.head) + len(self.tail)
+        data = self.head[:size]
+        self.head = self.head[len(data):]
+
+        if len(data) < size and self.remaining > 0:
+            block = self.osm_file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(block)
+            data += block
+
+        if len(data) < size and self.remaining == 0:
+            end = self.tail[:size - len(data)]
+            self.tail = self.tail[len(end):]
+            data += end
+        return data
+
+    def close(self):
+        self.osm_file.close()
+
+def part_path(part_dir, path, index):
+    """Returns the name of the csv part file written by one shard.
+
+    Arguments:
+    part_dir -- the directory of the part files
+    path -- the name of the final csv file
+    index -- the shard number
+    """
+    return os.path.join(part_dir, '{}.{:05d}'.format(path, index))
+
+# ==================================================== #
+#               Worker Function                        #
+# ==================================================== #
+
+def process_shard(job):
+    """Processes one byte range of the XML file into csv part files and returns
+       a snapshot of the Stats of the shard and the statistics of the key cache.
+
+    Arguments:
+    job -- tuple of (shard number, OSM file, start offset, end offset, part file directory, validate,
+           options of the event log, rule file, options of the quarantine, options of the sketches)
+    """
+    index, file_in, start, end, part_dir, validate, log_settings, rules_path, quarantine_settings, sketch_settings = job
+    event_log.configure(*log_settings)
+    fix_it.ensure_rules(rules_path)
+    quarantine.configure(*quarantine_settings)
+    heavy_hitters.configure(*sketch_settings)
+    stats = fix_it.Stats()                # After the options of the sketches
+    element_to_dictionary.clear_key_cache(stats_only=True)     # The cached keys serve the next shards
+
+    files = []
+    writers = {}
+    for key, path, fields in main_process.CSV_TABLES:
+        csv_file = open(part_path(part_dir, path, index), 'w')
+        files.append(csv_file)
+        writers[key] = csv.DictWriter(csv_file, fieldnames = fields)     # No header in the part files
+
+    validator = cerberus.Validator()
+    shard = ShardFile(file_in, start, end)
+    events = open(part_path(part_dir, EVENTS_PART, index), 'wb')
+    files.append(events)
+    rejects = open(part_path(part_dir, QUARANTINE_PART, index), 'wb')
+    files.append(rejects)
+
+    try:
+        with event_log.redirect(events), quarantine.redirect(rejects):
+            for element_tree in main_process.get_element_tree(shard, tags=('node', 'way'), stats=stats):
+                main_process.write_element(element_tree, writers, validator, validate, stats)
+    finally:
+        shard.close()
+        for csv_file in files:
+            csv_file.close()
+
+    return stats.snapshot(), element_to_dictionary.key_cache_counts()
+
+def merge_csv_files(part_dir, shards):
+    """Writes the csv headers, appends the part files in shard order, and returns None.
+
+    Arguments:
+    part_dir -- the directory of the part files
+    shards -- the number of shards
+    """
+    for key, path, fields in main_process.CSV_TABLES:
+        with open(path, 'w') as csv_file:
+            csv.DictWriter(csv_file, fieldnames = fields).writeheader()
+
+        with open(path, 'ab') as csv_file:
+            for index in range(shards):
+                with open(part_path(part_dir, path, index), 'rb') as part_file:
+                    shutil.copyfileobj(part_file, csv_file)
+    return
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def process_xml_elements_parallel(file_in, validate, workers=None, key_stats=False, stats=None):
+    """Processes the XML file in byte range shards across a pool of worker processes.
+
+    Aborts execution if a problem occurs or returns None if successful
+
+    Writes the same csv files and prints the same report as the function process_xml_elements
+    (in file "main_process.py"); only the eliminations printed by the workers are interleaved
+
+    Arguments:
+    file_in -- the Open Street Map XML file to process (uncompressed, UTF-8)
+    validate -- boolean switch to turn on or off validation
+    workers -- number of worker processes, defaults to the number of CPUs
+    key_stats -- report the hit rate of the key cache (in file "element_to_dictionary.py")
+    stats -- the Stats (in file "fix_it.py") the shards are merged into, fix_it.default_stats if None
+    """
+    if compressed_input.is_compressed(file_in) or pbf_reader.is_pbf(file_in):
+        print ('Parallel processing needs an uncompressed .osm file: ', file_in)
+        print ('\nTerminating execution...')
+        return None
+
+    stats = fix_it.default_stats if stats is None else stats
+    response = fix_it.initialize(stats)
+
+    if not response:
+        print ('Fatal Error initializing dictionaries')
+        print ('\nTerminating execution...')
+        return None
+
+    workers = workers or os.cpu_count() or 1
+    offsets = shard_offsets(file_in, workers * SHARDS_PER_WORKER)
+    shards = len(offsets) - 1
+    part_dir = tempfile.mkdtemp(prefix='shards_', dir='.')
+    jobs = [(i, file_in, offsets[i], offsets[i + 1], part_dir, validate, event_log.settings(),
+             fix_it.rules.path, quarantine.settings(), heavy_hitters.settings())
+            for i in range(shards)]
+    element_to_dictionary.clear_key_cache()
+    event_log.start()
+    quarantine.start()
+
+    print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
+
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for shard_stats, key_counts in pool.imap(process_shard, jobs):    # Results return in shard order
+                stats.merge(shard_stats)
+                element_to_dictionary.merge_key_cache_counts(key_counts)
+
+        merge_csv_files(part_dir, shards)
+        for index in range(shards):
+            with open(part_path(part_dir, EVENTS_PART, index), 'rb') as events:
+                event_log.write(events)
+            with open(part_path(part_dir, QUARANTINE_PART, index), 'rb') as rejects:
+                quarantine.write(rejects)
+    finally:
+        shutil.rmtree(part_dir)
+
+    # Each shard counted its own <osm> root element
+    stats.counts['element count'] -= shards - 1
+    stats.counts['not a node or way count'] -= shards - 1
+
+    main_process.print_summary(stats)
+    fix_it.print_detailed_fixes(stats)
+    print ()
+    if validate is True:
+        print ('Validation... Passed')
+    print ('\nCSV files created')
+    if key_stats:
+        element_to_dictionary.print_key_cache_stats()
+    event_log.finish(stats)
+    quarantine.finish(stats)
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    process_xml_elements_parallel(main_process.OSM_PATH, validate = True)
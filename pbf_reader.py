@@ -0,0 +1,484 @@
+# Filename: pbf_reader.py
+# Python 3.7
+# Notes:
+#    This is a module of main_process.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Read <node>, <way> and <relation> elements from an OSM PBF file (.osm.pbf)
+
+# An OSM PBF file is a sequence of blobs: a length, a BlobHeader message and a Blob message.
+# Each OSMData blob holds one zlib compressed PrimitiveBlock of about 8,000 nodes, ways or relations
+#   with its own string table. See https://wiki.openstreetmap.org/wiki/PBF_Format
+# The blobs are decompressed and decoded on a pool of worker processes, and the results are
+#   returned in file order.
+# Dense nodes and ways are expanded into the same Records (in file "records.py") as the XML
+#   readers produce: the attributes are formatted as they appear in an OSM XML file, and the
+#   <tag>, <nd> and <member> children follow in XML order. "build_dictionary_element_tree"
+#   (in file "element_to_dictionary.py"), "fixer" (in file "fix_it.py"), the initial scan and the
+#   reconciliation counts read them unchanged.
+# The protocol buffer messages are decoded here, so no protobuf package is needed.
+
+import itertools
+import lzma
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+from collections import deque
+
+import fix_it
+from records import Record
+
+PBF_EXTENSIONS = ('.pbf',)
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# ==================================================== #
+#               Protocol Buffer Decoding               #
+# ==================================================== #
+
+def read_varint(data, pos):
+    """Returns the varint at the position and the position after it.
+
+    Arguments:
+    data -- protocol buffer message bytes
+    pos -- the position of the varint
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def signed(value):
+    """Returns a 64 bit two's complement varint as a signed integer."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def zigzag(value):
+    """Returns a zigzag encoded (sint32, sint64) varint as a signed integer."""
+    return (value >> 1) ^ -(value & 1)
+
+def message_fields(data):
+    """Yields (field number, value) tuples of a protocol buffer message.
+
+    The value is an integer for a varint field and bytes for any other field
+
+    Arguments:
+    data -- protocol buffer message bytes
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key = data[pos]
+        if key < 0x80:                 # One byte key: field numbers below 16
+            pos += 1
+        else:
+            key, pos = read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value = data[pos]
+            if value < 0x80:
+                pos += 1
+            else:
+                value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            size = data[pos]
+            if size < 0x80:
+                pos += 1
+            else:
+                size, pos = read_varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('Unsupported protocol buffer wire type: {}'.format(wire_type))
+        yield key >> 3, value
+
+def packed_varints(data):
+    """Returns the list of integers of a packed repeated varint field.
+
+    Arguments:
+    data -- the bytes of the packed field
+    """
+    values = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        byte = data[pos]
+        if byte < 0x80:            # One byte varint
+            values.append(byte)
+            pos += 1
+        else:
+            value, pos = read_varint(data, pos)
+            values.append(value)
+    return values
+
+def packed_deltas(data):
+    """Returns the list of integers of a packed, zigzag and delta encoded repeated field.
+
+    Arguments:
+    data -- the bytes of the packed field
+    """
+    return list(itertools.accumulate(zigzag(value) for value in packed_varints(data)))
+
+# ==================================================== #
+#               Attribute Formatting                   #
+# ==================================================== #
+
+def degrees(nanodegrees):
+    """Returns a coordinate in nanodegrees as decimal degrees text, as written in an OSM XML file.
+
+    Arguments:
+    nanodegrees -- integer latitude or longitude
+    """
+    sign = '-' if nanodegrees < 0 else ''
+    whole, fraction = divmod(abs(nanodegrees), 1000000000)
+    fraction = '{:09d}'.format(fraction).rstrip('0')
+    return sign + str(whole) + ('.' + fraction if fraction else '')
+
+def timestamp(milliseconds):
+    """Returns a time in milliseconds since the epoch as an OSM XML timestamp."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(milliseconds // 1000))
+
+class PrimitiveBlock(object):
+    """String table and coordinate settings of one PrimitiveBlock."""
+    def __init__(self, data):
+        self.strings = []
+        self.groups = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.date_granularity = 1000
+
+        for number, value in message_fields(data):
+            if number == 1:                                     # StringTable
+                self.strings = [s.decode('utf-8') for n, s in message_fields(value) if n == 1]
+            elif number == 2:
+                self.groups.append(value)
+            elif number == 17:
+                self.granularity = value
+            elif number == 18:
+                self.date_granularity = value
+            elif number == 19:
+                self.lat_offset = signed(value)
+            elif number == 20:
+                self.lon_offset = signed(value)
+
+    def lat(self, value):
+        return degrees(self.lat_offset + self.granularity * value)
+
+    def lon(self, value):
+        return degrees(self.lon_offset + self.granularity * value)
+
+    def tags(self, keys, vals):
+        return [(self.strings[k], self.strings[v]) for k, v in zip(keys, vals)]
+
+    def info(self, attrib, data):
+        """Adds the attributes of an Info message to the attrib dictionary, returns None."""
+        fields = dict(message_fields(data))
+        if 1 in fields:
+            attrib['version'] = str(fields[1])
+        if 2 in fields:
+            attrib['timestamp'] = timestamp(signed(fields[2]) * self.date_granularity)
+        if 4 in fields:
+            attrib['uid'] = str(signed(fields[4]))
+        if 5 in fields:
+            attrib['user'] = self.strings[fields[5]]
+        if 3 in fields:
+            attrib['changeset'] = str(signed(fields[3]))
+        return
+
+# ==================================================== #
+#               Primitive Decoding                     #
+# ==================================================== #
+
+# Every entity is a tuple of (tag, attrib, list of (key, value) tags, refs or members)
+
+def decode_dense(block, data):
+    """Returns the list of node entities of a DenseNodes message.
+
+    Arguments:
+    block -- the PrimitiveBlock of the message
+    data -- the DenseNodes message bytes
+    """
+    ids = lats = lons = keys_vals = ()
+    info = {}
+    for number, value in message_fields(data):
+        if number == 1:
+            ids = packed_deltas(value)
+        elif number == 5:
+            info = dict(message_fields(value))
+        elif number == 8:
+            lats = packed_deltas(value)
+        elif number == 9:
+            lons = packed_deltas(value)
+        elif number == 10:
+            keys_vals = packed_varints(value)
+
+    versions = packed_varints(info[1]) if 1 in info else None
+    timestamps = packed_deltas(info[2]) if 2 in info else None
+    changesets = packed_deltas(info[3]) if 3 in info else None
+    uids = packed_deltas(info[4]) if 4 in info else None
+    user_sids = packed_deltas(info[5]) if 5 in info else None
+
+    strings = block.strings
+    pos = 0
+    nodes = []
+    for i, node_id in enumerate(ids):
+        attrib = {'id': str(node_id)}
+        if versions:
+            attrib['version'] = str(versions[i])
+        if timestamps:
+            attrib['timestamp'] = timestamp(timestamps[i] * block.date_granularity)
+        if uids:
+            attrib['uid'] = str(uids[i])
+        if user_sids:
+            attrib['user'] = strings[user_sids[i]]
+        if changesets:
+            attrib['changeset'] = str(changesets[i])
+        attrib['lat'] = block.lat(lats[i])
+        attrib['lon'] = block.lon(lons[i])
+
+        tags = []
+        if keys_vals:
+            while keys_vals[pos]:                # Each node's keys and values end with a 0
+                tags.append((strings[keys_vals[pos]], strings[keys_vals[pos + 1]]))
+                pos += 2
+            pos += 1
+        nodes.append(('node', attrib, tags, ()))
+    return nodes
+
+def decode_primitive(block, tag, data):
+    """Returns the entity of a Node, Way or Relation message.
+
+    Arguments:
+    block -- the PrimitiveBlock of the message
+    tag -- 'node', 'way' or 'relation'
+    data -- the message bytes
+    """
+    attrib = {}
+    keys = vals = info = roles = ids = types = ()
+    lat = lon = 0
+    for number, value in message_fields(data):
+        if number == 1:
+            attrib['id'] = str(zigzag(value) if tag == 'node' else signed(value))
+        elif number == 2:
+            keys = packed_varints(value)
+        elif number == 3:
+            vals = packed_varints(value)
+        elif number == 4:
+            info = value
+        elif number == 8:
+            if tag == 'node':
+                lat = zigzag(value)
+            elif tag == 'way':
+                ids = packed_deltas(value)
+            else:
+                roles = packed_varints(value)
+        elif number == 9:
+            if tag == 'node':
+                lon = zigzag(value)
+            elif tag == 'relation':
+                ids = packed_deltas(value)
+            # Way fields 9 and 10 are the lat and lon of its nodes (LocationsOnWays), not needed
+        elif number == 10 and tag == 'relation':
+            types = packed_varints(value)
+
+    if info:
+        block.info(attrib, info)
+    if tag == 'node':
+        attrib['lat'] = block.lat(lat)
+        attrib['lon'] = block.lon(lon)
+        extra = ()
+    elif tag == 'way':
+        extra = [str(ref) for ref in ids]
+    else:
+        extra = [(MEMBER_TYPES[member_type], str(ref), block.strings[role])
+                 for member_type, ref, role in zip(types, ids, roles)]
+    return (tag, attrib, block.tags(keys, vals), extra)
+
+def decode_block(data):
+    """Decodes one OSMData blob and returns the list of its entities in file order.
+
+    Runs in the worker processes
+
+    Arguments:
+    data -- the Blob message bytes
+    """
+    block = PrimitiveBlock(blob_data(data))
+    entities = []
+    for group in block.groups:
+        for number, value in message_fields(group):
+            if number == 1:
+                entities.append(decode_primitive(block, 'node', value))
+            elif number == 2:
+                entities.extend(decode_dense(block, value))
+            elif number == 3:
+                entities.append(decode_primitive(block, 'way', value))
+            elif number == 4:
+                entities.append(decode_primitive(block, 'relation', value))
+    return entities
+
+def decode_header(data):
+    """Returns the entities of an OSMHeader blob: a <bounds> entity if the header has a bounding box.
+
+    Arguments:
+    data -- the Blob message bytes
+    """
+    for number, value in message_fields(blob_data(data)):
+        if number == 1:                                       # HeaderBBox in nanodegrees
+            box = {n: zigzag(v) for n, v in message_fields(value)}
+            attrib = {'minlat': degrees(box.get(4, 0)), 'minlon': degrees(box.get(1, 0)),
+                      'maxlat': degrees(box.get(3, 0)), 'maxlon': degrees(box.get(2, 0))}
+            return [('bounds', attrib, [], ())]
+    return []
+
+def blob_data(data):
+    """Returns the uncompressed data of a Blob message.
+
+    Arguments:
+    data -- the Blob message bytes
+    """
+    for number, value in message_fields(data):
+        if number == 1:                    # raw
+            return value
+        if number == 3:                    # zlib_data
+            return zlib.decompress(value)
+        if number == 4:                    # lzma_data
+            return lzma.decompress(value)
+    raise ValueError('Unsupported PBF blob compression')
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def is_pbf(osm_file):
+    """Returns True if the file name has a PBF file extension.
+
+    Arguments:
+    osm_file -- the Open Street Map file name
+    """
+    return isinstance(osm_file, str) and osm_file.lower().endswith(PBF_EXTENSIONS)
+
+def read_blobs(osm_file):
+    """Yields (blob type, Blob message bytes) tuples in file order.
+
+    Arguments:
+    osm_file -- the PBF file opened in binary mode
+    """
+    while True:
+        size = osm_file.read(4)
+        if not size:
+            return
+        header = osm_file.read(struct.unpack('!I', size)[0])
+        fields = dict(message_fields(header))
+        yield fields[1].decode('utf-8'), osm_file.read(fields[3])
+
+def read_entities(osm_file, workers=None):
+    """Yields the entities of the PBF file in file order.
+
+    OSMData blobs are decoded on a pool of worker processes, with at most two blobs per
+    worker in flight so memory stays bounded
+
+    Arguments:
+    osm_file -- the Open Street Map PBF file name
+    workers -- number of worker processes, defaults to the number of CPUs
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    pending = deque()
+
+    try:
+        with open(osm_file, 'rb') as pbf_file:
+            for blob_type, data in read_blobs(pbf_file):
+                if blob_type == 'OSMHeader':
+                    pending.append(decode_header(data))
+                elif blob_type != 'OSMData':
+                    continue              # Unknown blob types are skipped, as the format requires
+                elif pool:
+                    pending.append(pool.apply_async(decode_block, (data,)))
+                else:
+                    pending.append(decode_block(data))
+
+                while pending and (len(pending) > 2 * workers or isinstance(pending[0], list)):
+                    result = pending.popleft()
+                    yield from result if isinstance(result, list) else result.get()
+
+        for result in pending:
+            yield from result if isinstance(result, list) else result.get()
+    finally:
+        if pool:
+            pool.terminate()
+    return
+
+def make_record(entity):
+    """Returns the Record of an entity, with its children in XML order.
+
+    Arguments:
+    entity -- tuple of (tag, attrib, tags, refs or members)
+    """
+    tag, attrib, tags, extra = entity
+    if tag == 'way':
+        children = [Record('nd', {'ref': ref}) for ref in extra]
+    elif tag == 'relation':
+        children = [Record('member', {'type': member_type, 'ref': ref, 'role': role})
+                    for member_type, ref, role in extra]
+    else:
+        children = []
+    children.extend(Record('tag', {'k': k, 'v': v}) for k, v in tags)
+    return Record(tag, attrib, children)
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+
+def read_records(osm_file, tags=('node', 'way'), workers=None, stats=None):
+    """Yield a Record for each top level element in tags.
+
+    Element counts are kept the same way as "get_element_tree" (in file "main_process.py")
+    counts the equivalent XML file
+
+    Arguments:
+    osm_file -- the Open Street Map PBF file to process
+    tags -- list of XML parent tags to process
+    workers -- number of worker processes, defaults to the number of CPUs
+    stats -- the Stats (in file "fix_it.py") counting the elements, fix_it.default_stats if None
+    """
+    counts = (fix_it.default_stats if stats is None else stats).counts
+    for entity in read_entities(osm_file, workers):
+        n = len(entity[2]) + len(entity[3])
+        counts['element count'] += 1 + n
+        if entity[0] in tags:
+            counts['not a node or way count'] += n
+            yield make_record(entity)
+        else:
+            counts['not a node or way count'] += 1 + n
+
+    counts['element count'] += 1             # The <osm> root element
+    counts['not a node or way count'] += 1
+    return
+
+def iter_elements(osm_file, workers=None):
+    """Yield every element in the order of the XML end events: each child, then its parent,
+       and the <osm> root element last.
+
+    Arguments:
+    osm_file -- the Open Street Map PBF file to process
+    workers -- number of worker processes, defaults to the number of CPUs
+    """
+    for entity in read_entities(osm_file, workers):
+        record = make_record(entity)
+        yield from record.children
+        yield record
+
+    yield Record('osm', {'version': '0.6', 'generator': 'pbf_reader'})
+    return
@@ -0,0 +1,311 @@
+# Filename: pipeline_process.py
+# Python 3.7
+# Purpose: Process the XML file in pipelined parse, clean and write stages
+
+# "process_xml_elements" (in file "main_process.py") parses, cleans, validates and writes each element
+#   in one loop, so a slow disk write holds up the parser and a slow parse leaves the disk idle.
+# This routine runs the same work as a pipeline of threads:
+#   reader  -- "get_element_tree" (in file "main_process.py") parses the file into batches of elements
+#   clean   -- "build_dictionary_element_tree" (in file "element_to_dictionary.py") and the optional
+#              validation turn each batch into batches of csv rows, one per csv file
+#   writers -- one thread per csv file writes its rows
+# The stages are joined by bounded queues: a stage that gets ahead waits for room in the next queue
+#   (backpressure), so memory stays flat whichever stage is the slowest.
+# Each stage records the time it spent waiting for input and waiting for room to send its output,
+#   and the report shows which stage limits the throughput.
+# Rows reach each csv file in the same order, so the csv files and the report are the same as
+#   "process_xml_elements".
+
+import csv
+import queue
+import threading
+import time
+import cerberus
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import element_to_dictionary
+import event_log
+import fix_it
+import interning
+import main_process
+import quarantine
+
+BATCH_SIZE = 500          # Elements sent from the reader to the clean stage at a time
+QUEUE_BATCHES = 8         # Batches waiting between two stages
+
+# ==================================================== #
+#               Pipeline Helpers                       #
+# ==================================================== #
+
+class PipelineStopped(Exception):
+    """Raised in a stage when another stage has failed."""
+
+class StageTimer(object):
+    """Elapsed time of a stage and the time it spent blocked on its queues."""
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = 0.0
+        self.waiting_input = 0.0
+        self.waiting_output = 0.0
+
+def put(q, item, timer, stop):
+    """Puts the item on the queue, waiting while the queue is full, and returns None.
+
+    Raises PipelineStopped if another stage fails while waiting
+
+    Arguments:
+    q -- the bounded queue to the next stage
+    item -- the batch to send
+    timer -- the StageTimer of the sending stage
+    stop -- threading.Event set when a stage fails
+    """
+    start = time.perf_counter()
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            break
+        except queue.Full:
+            if stop.is_set():
+                raise PipelineStopped()
+    timer.waiting_output += time.perf_counter() - start
+    return
+
+def get(q, timer, stop):
+    """Returns the next item on the queue, waiting while the queue is empty.
+
+    Raises PipelineStopped if another stage fails while waiting
+
+    Arguments:
+    q -- the bounded queue from the previous stage
+    timer -- the StageTimer of the receiving stage
+    stop -- threading.Event set when a stage fails
+    """
+    start = time.perf_counter()
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+            break
+        except queue.Empty:
+            if stop.is_set():
+                raise PipelineStopped()
+    timer.waiting_input += time.perf_counter() - start
+    return item
+
+def run_stage(target, timer, stop, errors, *args):
+    """Runs a stage function, times it, records any error and stops the other stages, and returns None.
+
+    Arguments:
+    target -- the stage function
+    timer -- the StageTimer of the stage
+    stop -- threading.Event set when a stage fails
+    errors -- list of the exceptions raised by the stages
+    args -- the arguments of the stage function
+    """
+    start = time.perf_counter()
+    try:
+        target(timer, stop, *args)
+    except PipelineStopped:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    timer.elapsed = time.perf_counter() - start
+    return
+
+# ==================================================== #
+#               Stage Functions                        #
+# ==================================================== #
+
+def read_stage(timer, stop, file_in, out_q, intern=False, stats=None):
+    """Parses the XML file and sends batches of <node> and <way> elements, then None.
+
+    Arguments:
+    timer -- the StageTimer of the stage
+    stop -- threading.Event set when a stage fails
+    file_in -- the Open Street Map file to process
+    out_q -- the queue to the clean stage
+    intern -- share one string between the repeated attribute values of the queued elements
+    stats -- the Stats (in file "fix_it.py") counting the elements, fix_it.default_stats if None
+    """
+    elements = main_process.get_element_tree(file_in, tags=('node', 'way'), stats=stats)
+    if intern:
+        elements = interning.interned(elements)
+
+    batch = []
+    for element_tree in elements:
+        batch.append(element_tree)
+        if len(batch) >= BATCH_SIZE:
+            put(out_q, batch, timer, stop)
+            batch = []
+    put(out_q, batch, timer, stop)
+    put(out_q, None, timer, stop)          # End of the elements
+    return
+
+def clean_stage(timer, stop, validate, in_q, out_qs, stats=None):
+    """Builds and validates the dictionary of each element and sends the rows of each batch to the
+       csv writer of each table, then None.
+
+    Arguments:
+    timer -- the StageTimer of the stage
+    stop -- threading.Event set when a stage fails
+    validate -- boolean switch to turn on or off validation
+    in_q -- the queue from the reader stage
+    out_qs -- dictionary of the queues to the csv writers, keyed by table
+    stats -- the Stats (in file "fix_it.py") of the run, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    validator = cerberus.Validator()
+    while True:
+        batch = get(in_q, timer, stop)
+        if batch is None:
+            break
+
+        rows = {key: [] for key in out_qs}
+        for element_tree in batch:
+            dict = element_to_dictionary.build_dictionary_element_tree(element_tree, stats=stats)
+            if not dict:
+                event_log.event(stats, 'info', 'element', '    -- Dictionary returned is:  ', dict)
+                continue
+
+            stats.counts['node way count'] += 1
+            if validate is True:
+                main_process.validate_dictionary(dict, validator, schema=main_process.SCHEMA)
+
+            if element_tree.tag == 'node':
+                stats.counts['node count'] += 1
+                rows['node'].append(dict['node'])
+                rows['node_tags'].extend(dict['node_tags'])
+            elif element_tree.tag == 'way':
+                stats.counts['way count'] += 1
+                rows['way'].append(dict['way'])
+                rows['way_nodes'].extend(dict['way_nodes'])
+                rows['way_tags'].extend(dict['way_tags'])
+
+        for key, out_q in out_qs.items():
+            if rows[key]:
+                put(out_q, rows[key], timer, stop)
+
+    for out_q in out_qs.values():
+        put(out_q, None, timer, stop)      # End of the rows
+    return
+
+def write_stage(timer, stop, path, fields, in_q):
+    """Writes the header and the batches of rows to one csv file, then returns None.
+
+    Arguments:
+    timer -- the StageTimer of the stage
+    stop -- threading.Event set when a stage fails
+    path -- the csv file name
+    fields -- the csv column names
+    in_q -- the queue from the clean stage
+    """
+    with open(path, 'w') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames = fields)
+        writer.writeheader()
+        while True:
+            rows = get(in_q, timer, stop)
+            if rows is None:
+                break
+            writer.writerows(rows)
+    return
+
+def print_stage_times(timers):
+    """Prints the time each stage spent working and blocked, and returns None.
+
+    Arguments:
+    timers -- list of StageTimer objects in pipeline order
+    """
+    print ('\n---------------')
+    print ('PIPELINE STAGES\n')
+    print ('    {:<22} {:>10} {:>20} {:>20}'.format('Stage', 'Working', 'Waiting for input', 'Waiting for output'))
+    for timer in timers:
+        working = timer.elapsed - timer.waiting_input - timer.waiting_output
+        print ('    {:<22} {:>9.2f}s {:>19.2f}s {:>19.2f}s'.format(timer.name, working, timer.waiting_input,
+                                                                 timer.waiting_output))
+
+    busiest = max(timers, key=lambda t: t.elapsed - t.waiting_input - t.waiting_output)
+    print ('\nThroughput is limited by the stage:  ', busiest.name)
+    return
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def process_xml_elements_pipelined(file_in, validate, intern=False, key_stats=False, stats=None):
+    """Processes the XML file in a pipeline of reader, clean and csv writer threads.
+
+    Aborts execution if a problem occurs or returns None if successful
+
+    Writes the same csv files and prints the same report as the function process_xml_elements
+    (in file "main_process.py"), followed by the time each stage spent working and blocked
+
+    Arguments:
+    file_in -- the Open Street Map file to process
+    validate -- boolean switch to turn on or off validation
+    intern -- share one string between the repeated attribute values (in file "interning.py") and report the saving
+    key_stats -- report the hit rate of the key cache (in file "element_to_dictionary.py")
+    stats -- the Stats (in file "fix_it.py") to count in, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    response = fix_it.initialize(stats)
+
+    if not response:
+        print ('Fatal Error initializing dictionaries')
+        print ('\nTerminating execution...')
+        return None
+
+    element_to_dictionary.clear_key_cache()
+    if intern:
+        interning.clear()
+    event_log.start()
+    quarantine.start()
+
+    stop = threading.Event()
+    errors = []
+    element_q = queue.Queue(QUEUE_BATCHES)
+    row_qs = {key: queue.Queue(QUEUE_BATCHES) for key, path, fields in main_process.CSV_TABLES}
+
+    timers = [StageTimer('reader'), StageTimer('clean')]
+    threads = [threading.Thread(target=run_stage, args=(read_stage, timers[0], stop, errors, file_in, element_q,
+                                                       intern, stats)),
+               threading.Thread(target=run_stage, args=(clean_stage, timers[1], stop, errors, validate,
+                                                        element_q, row_qs, stats))]
+    for key, path, fields in main_process.CSV_TABLES:
+        timers.append(StageTimer('write ' + path))
+        threads.append(threading.Thread(target=run_stage, args=(write_stage, timers[-1], stop, errors,
+                                                                path, fields, row_qs[key])))
+
+    print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    main_process.print_summary(stats)
+    fix_it.print_detailed_fixes(stats)
+    print ()
+    if validate is True:
+        print ('Validation... Passed')
+    print ('\nCSV files created')
+    if key_stats:
+        element_to_dictionary.print_key_cache_stats()
+    if intern:
+        interning.print_intern_stats()
+    event_log.finish(stats)
+    quarantine.finish(stats)
+    print_stage_times(timers)
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    process_xml_elements_pipelined(main_process.OSM_PATH, validate = True)
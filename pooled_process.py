@@ -0,0 +1,274 @@
+# Filename: pooled_process.py
+# Python 3.7
+# Purpose: Clean the elements of one parsed stream on a pool of worker processes
+
+# "parallel_process.py" splits an uncompressed file into byte ranges, which is not possible for a
+#   compressed file or a pipe.
+# Here one process parses the stream with "get_element_tree" (in file "main_process.py") and sends
+#   batches of plain (tag, attrib, children) tuples to a pool of worker processes.
+# Each worker rebuilds lightweight Records (in file "records.py"), runs the same "write_element"
+#   (in file "main_process.py"), with the phone numbers of the batch fixed at once by "normalize_phones"
+#   (in file "fix_it.py"), and returns the csv text, a snapshot of the "fix_it" dictionaries
+#   and the printed corrections of the batch.
+# The results are written and merged in input order, so the csv files and the report are the same as
+#   "process_xml_elements".
+# Only a few batches per worker are in flight at a time, so memory stays flat on any input size.
+#
+# 'python pooled_process.py [file] [--batch-size N] [--workers N] [--intern] [--key-stats]' processes a file, or the standard input for '-'
+# 'python pooled_process.py [file] --benchmark' prints the throughput for 1 to the number of CPUs workers,
+#   and the CPU time of the parsing process, the bound on the throughput of any number of CPUs
+
+import collections
+import contextlib
+import csv
+import io
+import multiprocessing
+import os
+import sys
+import time
+import cerberus
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import element_to_dictionary
+import event_log
+import fix_it
+import heavy_hitters
+import interning
+import main_process
+import quarantine
+from records import Record
+
+BATCH_SIZE = 2000          # Elements sent to a worker at a time
+BATCHES_PER_WORKER = 2     # Batches in flight for each worker
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def element_batches(osm_file, batch_size, intern=False, stats=None):
+    """Parse the file and yield lists of (tag, attrib, children) tuples for the <node> and <way> elements.
+
+    Arguments:
+    osm_file -- the Open Street Map file to process, or a file object opened in binary mode
+    batch_size -- the number of elements in a list
+    intern -- share one string between the repeated attribute values (pickled once per batch)
+    stats -- the Stats (in file "fix_it.py") counting the elements, fix_it.default_stats if None
+    """
+    elements = main_process.get_element_tree(osm_file, tags=('node', 'way'), stats=stats)
+    if intern:
+        elements = interning.interned(elements)
+
+    batch = []
+    for element_tree in elements:
+        batch.append((element_tree.tag, element_tree.attrib,
+                      [(child.tag, child.attrib) for child in element_tree]))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+    return
+
+# ==================================================== #
+#               Worker Function                        #
+# ==================================================== #
+
+def clean_batch(batch, validate, log_settings, rules_path, quarantine_settings, sketch_settings):
+    """Cleans a batch of elements and returns the csv text keyed by table, a snapshot of the
+       Stats of the batch, the printed output, the events written in 'jsonl' mode, the rows of
+       the quarantine and the statistics of the key cache.
+
+    Arguments:
+    batch -- list of (tag, attrib, children) tuples
+    validate -- boolean switch to turn on or off validation
+    log_settings -- the options of the event log of the parent process (in file "event_log.py")
+    rules_path -- the rule file of the parent process (in file "fix_it.py")
+    quarantine_settings -- the options of the quarantine of the parent process (in file "quarantine.py")
+    sketch_settings -- the options of the sketches of the parent process (in file "heavy_hitters.py")
+    """
+    event_log.configure(*log_settings)
+    fix_it.ensure_rules(rules_path)
+    quarantine.configure(*quarantine_settings)
+    heavy_hitters.configure(*sketch_settings)
+    fix_it.normalize_phones([child_attrib.get('v', '') for tag, attrib, children in batch     # The phone numbers of the
+                             for child_tag, child_attrib in children                        #   batch, fixed at once
+                             if child_tag == 'tag' and fix_it.fixer_name(child_attrib.get('k', '')) == 'phone'])
+    stats = fix_it.Stats()                    # Counts of this batch only, merged by the parent in input order
+    element_to_dictionary.clear_key_cache(stats_only=True)     # The cached keys serve the next batches
+    texts = {}
+    writers = {}
+    for key, path, fields in main_process.CSV_TABLES:
+        texts[key] = io.StringIO()            # The rows are sent back as csv text, cheaper to pickle than dictionaries
+        writers[key] = csv.DictWriter(texts[key], fieldnames = fields)
+    validator = cerberus.Validator()
+    output = io.StringIO()
+    events = io.BytesIO()
+    rejects = io.BytesIO()
+
+    with contextlib.redirect_stdout(output), event_log.redirect(events), quarantine.redirect(rejects):
+        for tag, attrib, children in batch:
+            element_tree = Record(tag, attrib, [Record(child_tag, child_attrib)
+                                                for child_tag, child_attrib in children])
+            main_process.write_element(element_tree, writers, validator, validate, stats)
+
+    return ({key: text.getvalue() for key, text in texts.items()}, stats.snapshot(), output.getvalue(),
+            events.getvalue(), rejects.getvalue(), element_to_dictionary.key_cache_counts())
+
+def clean_elements(file_in, validate, workers, batch_size, intern=False, stats=None):
+    """Parses the file, cleans the batches on a pool of worker processes, writes the csv files in
+       input order, merges the Stats of the batches, and returns None.
+
+    Arguments:
+    file_in -- the Open Street Map file to process, or a file object opened in binary mode
+    validate -- boolean switch to turn on or off validation
+    workers -- number of worker processes
+    batch_size -- the number of elements sent to a worker at a time
+    intern -- share one string between the repeated attribute values
+    stats -- the Stats (in file "fix_it.py") the batches are merged into, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    files = {}
+    for key, path, fields in main_process.CSV_TABLES:
+        files[key] = open(path, 'w')
+        csv.DictWriter(files[key], fieldnames = fields).writeheader()
+
+    def write_result(result):
+        texts, batch_stats, output, events, rejects, key_counts = result
+        print (output, end='')
+        event_log.write(events)
+        quarantine.write(rejects)
+        for key, csv_file in files.items():
+            csv_file.write(texts[key])
+        stats.merge(batch_stats)
+        element_to_dictionary.merge_key_cache_counts(key_counts)
+
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            pending = collections.deque()           # Results in input order
+            for batch in element_batches(file_in, batch_size, intern, stats):
+                pending.append(pool.apply_async(clean_batch, (batch, validate, event_log.settings(),
+                                                               fix_it.rules.path, quarantine.settings(), heavy_hitters.settings())))
+                if len(pending) >= workers * BATCHES_PER_WORKER:
+                    write_result(pending.popleft().get())
+            while pending:
+                write_result(pending.popleft().get())
+    finally:
+        for csv_file in files.values():
+            csv_file.close()
+    return
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def process_xml_elements_pooled(file_in, validate, workers=None, batch_size=BATCH_SIZE, intern=False,
+                                key_stats=False, stats=None):
+    """Parses the file in this process and cleans batches of elements on a pool of worker processes.
+
+    Aborts execution if a problem occurs or returns None if successful
+
+    Writes the same csv files and prints the same report as the function process_xml_elements
+    (in file "main_process.py")
+
+    Arguments:
+    file_in -- the Open Street Map file to process (.osm, .osm.bz2, .osm.gz, .osm.xz or .osm.pbf),
+               or a file object opened in binary mode such as sys.stdin.buffer
+    validate -- boolean switch to turn on or off validation
+    workers -- number of worker processes, defaults to the number of CPUs
+    batch_size -- the number of elements sent to a worker at a time
+    intern -- share one string between the repeated attribute values (in file "interning.py") and report the saving
+    key_stats -- report the hit rate of the key cache (in file "element_to_dictionary.py")
+    stats -- the Stats (in file "fix_it.py") to count in, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    response = fix_it.initialize(stats)
+
+    if not response:
+        print ('Fatal Error initializing dictionaries')
+        print ('\nTerminating execution...')
+        return None
+
+    element_to_dictionary.clear_key_cache()
+    if intern:
+        interning.clear()
+    event_log.start()
+    quarantine.start()
+
+    print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
+    clean_elements(file_in, validate, workers or os.cpu_count() or 1, batch_size, intern, stats)
+
+    main_process.print_summary(stats)
+    fix_it.print_detailed_fixes(stats)
+    print ()
+    if validate is True:
+        print ('Validation... Passed')
+    print ('\nCSV files created')
+    if key_stats:
+        element_to_dictionary.print_key_cache_stats()
+    if intern:
+        interning.print_intern_stats()
+    event_log.finish(stats)
+    quarantine.finish(stats)
+    return
+
+def benchmark(file_in, validate=True, batch_size=BATCH_SIZE, worker_counts=None):
+    """Processes the file with each number of workers and prints the elements cleaned per second,
+       returns None.
+
+    Also prints the CPU time of this process, which parses the file, sends the batches and writes
+    the results: it cannot be spread over the workers, so the elements per second of this process
+    bound the throughput on any number of CPUs
+
+    Arguments:
+    file_in -- the Open Street Map file to process (a file name, the file is read once per run)
+    validate -- boolean switch to turn on or off validation
+    batch_size -- the number of elements sent to a worker at a time
+    worker_counts -- list of the numbers of workers to run, defaults to 1 to the number of CPUs
+    """
+    worker_counts = worker_counts or range(1, (os.cpu_count() or 1) + 1)
+    results = []
+    for workers in worker_counts:
+        stats = fix_it.Stats()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):        # Only the csv files, not the report
+            clean_elements(file_in, validate, workers, batch_size, stats=stats)
+        cpu = max(time.process_time() - cpu_start, 1e-9)
+        seconds = time.perf_counter() - start
+        elements = stats.counts['node way count']
+        results.append((workers, seconds, elements / seconds, cpu, elements / cpu))
+
+    print ('\nTHROUGHPUT ({:,} elements per batch, {} CPUs)\n'.format(batch_size, os.cpu_count() or 1))
+    print ('    {:>7} {:>10} {:>18} {:>14} {:>18}'.format('Workers', 'Seconds', 'Elements/second',
+                                                           'Parent CPU s', 'Bound elements/s'))
+    for workers, seconds, rate, cpu, bound in results:
+        print ('    {:>7} {:>10.2f} {:>18,.0f} {:>14.2f} {:>18,.0f}'.format(workers, seconds, rate, cpu, bound))
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for name in ('--batch-size', '--workers'):
+        if name in args:
+            i = args.index(name)
+            options[name] = int(args[i + 1])
+            del args[i:i + 2]
+    batch_size = options.get('--batch-size', BATCH_SIZE)
+
+    if '--benchmark' in args:
+        args.remove('--benchmark')
+        benchmark(args[0] if args else main_process.OSM_PATH, batch_size = batch_size)
+    else:
+        file_in = next((arg for arg in args if arg not in ('--intern', '--key-stats')), main_process.OSM_PATH)
+        if file_in == '-':
+            file_in = sys.stdin.buffer          # e.g. 'bzcat extract.osm.bz2 | python pooled_process.py -'
+        process_xml_elements_pooled(file_in, validate = True, workers = options.get('--workers'),
+                                    batch_size = batch_size, intern = '--intern' in args,
+                                    key_stats = '--key-stats' in args)
@@ -0,0 +1,236 @@
+# Filename: quarantine.py
+# Python 3.7
+# Notes:
+#    This is a module of main_process.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Write every eliminated value to a compressed quarantine file instead of keeping it in memory
+
+# Without the quarantine, value_issue keeps every eliminated value of the other keys in a list, and the
+#   dictionaries of problems (streets_issue, phones_issue ... node_id_bad) keep every distinct
+#   eliminated value, so they grow with a dirty extract.
+# With ENABLED, each eliminated tag value, tag key, element id and way node reference is written as it
+#   happens to PATH, one row of FIELDS: the element id, 'Node' or 'Way', the tag key ('id' or 'nd' for
+#   an id or a reference), the raw value and the reason, the message of the event log.
+#   The dictionaries of QUARANTINE_NAMES then only count their values, in the Stats dictionary
+#   'quarantined' (dictionary name -> count), so the memory of a run does not grow with the rejects.
+#   cities_issue and us_states_issue still count each value, as they hold the cities and states kept
+#   outside NY as well.
+# PATH ending in '.jsonl' or '.jsonl.gz' writes JSON lines, else csv rows; '.gz' compresses the file.
+# "start" opens the file of a run and "finish" closes it, as for the event log (in file "event_log.py").
+
+import contextlib
+import csv
+import io
+import json
+import zlib
+
+ENABLED = False
+PATH = 'quarantine.csv.gz'
+
+BUFFER_SIZE = 1 << 20      # Bytes buffered before the file is written
+COMPRESS_LEVEL = 6
+
+FIELDS = ['element_id', 'element', 'key', 'value', 'reason']
+
+#  The dictionaries of eliminated values, counted in Stats.quarantined when ENABLED
+QUARANTINE_NAMES = frozenset(['value_issue', 'streets_issue', 'cities_problem', 'us_states_problem',
+                              'phones_issue', 'emails_issue', 'websites_issue', 'zipcodes_issue',
+                              'tiger_issue', 'bad_keys', 'node_id_bad', 'way_id_bad',
+                              'way_node_reference_bad'])
+
+encode = json.JSONEncoder(ensure_ascii=False).encode
+line = io.StringIO()                 # One csv row, reused
+line_writer = csv.writer(line)
+sink = None                          # The binary quarantine file, or a buffer of a worker process
+compressor = None                    # The gzip stream of the file, None if not compressed
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def configure(enabled=None, path=None):
+    """Sets the options of the quarantine for the next runs, and returns None.
+
+    Arguments left as None keep their current value
+
+    Arguments:
+    enabled -- True to write the eliminated values to the quarantine file
+    path -- the quarantine file, e.g. 'quarantine.csv.gz' or 'quarantine.jsonl.gz'
+    """
+    global ENABLED, PATH
+    if enabled is not None:
+        ENABLED = enabled
+    if path is not None:
+        PATH = path
+    return
+
+def settings():
+    """Returns the options of the quarantine as a tuple, for the function configure of a worker process."""
+    return ENABLED, PATH
+
+def format_row(row):
+    """Returns the bytes of a row of the quarantine file.
+
+    Arguments:
+    row -- list of the values of FIELDS
+    """
+    if '.jsonl' in PATH:
+        return (encode(dict(zip(FIELDS, row))) + '\n').encode('utf-8')
+    line.seek(0)
+    line.truncate()
+    line_writer.writerow(row)
+    return line.getvalue().encode('utf-8')
+
+def new_compressor():
+    """Returns a compressor of a new gzip member."""
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)     # 31: gzip header and trailer
+
+def write_bytes(data):
+    """Compresses if needed and writes bytes to the quarantine file, and returns None.
+
+    Arguments:
+    data -- the bytes of one or more rows
+    """
+    if sink is None:          # A value eliminated outside a run
+        open_file(append=True)
+    sink.write(data if compressor is None else compressor.compress(data))
+    return
+
+# ================================================== #
+#               Main Functions                       #
+# ================================================== #
+
+def count(stats, name):
+    """Counts a value of a dictionary of QUARANTINE_NAMES in the Stats of the run, and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run
+    name -- the dictionary name, e.g. 'streets_issue'
+    """
+    stats.quarantined[name] += 1
+    return
+
+def reason_text(args, node_or_way):
+    """Returns the reason of a row: the message of a 'warning' event without the leading 'Node' or 'Way'.
+
+    Arguments:
+    args -- the items of the message of the event
+    node_or_way -- 'Node' or 'Way'
+    """
+    if args and args[0] == node_or_way:
+        args = args[1:]
+    return ' '.join(' '.join(map(str, args)).split()).lstrip(': ')
+
+def write_row(stats, node_or_way, key, value, reason):
+    """Writes an eliminated value to the quarantine file and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run, with the id of the element being cleaned
+    node_or_way -- 'Node' or 'Way'
+    key -- the tag key, 'id' for an element id or 'nd' for a way node reference
+    value -- the raw value
+    reason -- why the value is eliminated
+    """
+    stats.quarantined['rows'] += 1
+    write_bytes(format_row([stats.element_id, node_or_way, key, value, reason]))
+    return
+
+def start(length=None):
+    """Opens the quarantine file of a run if ENABLED, and returns None.
+
+    Arguments:
+    length -- truncate the file to this many bytes and append to it, e.g. when resuming a run
+    """
+    close()
+    if ENABLED:
+        open_file(length)
+    return
+
+def open_file(length=None, append=False):
+    """Opens the quarantine file with a buffer of BUFFER_SIZE bytes and returns None.
+
+    A compressed file is a series of gzip members, one per call of flush, so it can be truncated
+    at the length returned by flush and appended to.
+
+    Arguments:
+    length -- truncate the file to this many bytes and append to it
+    append -- append to the file instead of replacing it
+    """
+    global sink, compressor
+    if length is not None:
+        with open(PATH, 'r+b') as quarantine_file:
+            quarantine_file.truncate(length)     # Drop the rows written after the checkpoint
+        append = True
+    sink = open(PATH, 'ab' if append else 'wb', buffering=BUFFER_SIZE)
+    compressor = new_compressor() if PATH.endswith('.gz') else None
+    if sink.tell() == 0 and '.jsonl' not in PATH:
+        write_bytes(format_row(FIELDS))          # The csv header of a new file
+    return
+
+def flush():
+    """Ends the gzip member, writes the buffered rows to the file, and returns its length in bytes,
+       or None if no file is open."""
+    global compressor
+    if sink is None:
+        return None
+    if compressor is not None:
+        sink.write(compressor.flush())
+        compressor = new_compressor()
+    sink.flush()
+    return sink.tell()
+
+def close():
+    """Writes the buffered rows and closes the quarantine file, and returns None."""
+    global sink, compressor
+    if sink is not None:
+        if compressor is not None:
+            sink.write(compressor.flush())
+        sink.close()
+        sink = None
+        compressor = None
+    return
+
+@contextlib.contextmanager
+def redirect(buffer):
+    """Context manager that sends the rows, not compressed, to a buffer instead of the quarantine file,
+       e.g. in a worker process whose rows are written in input order by the parent process.
+
+    Arguments:
+    buffer -- a binary file object, e.g. io.BytesIO
+    """
+    global sink, compressor
+    saved = sink, compressor
+    sink, compressor = buffer, None
+    try:
+        yield buffer
+    finally:
+        sink, compressor = saved
+
+def write(data):
+    """Writes the rows of a worker process to the quarantine file and returns None.
+
+    Arguments:
+    data -- the bytes of the redirected rows, or a binary file object to copy
+    """
+    if not data or not ENABLED:
+        return
+    if isinstance(data, bytes):
+        write_bytes(data)
+    else:
+        while True:
+            block = data.read(BUFFER_SIZE)
+            if not block:
+                break
+            write_bytes(block)
+    return
+
+def finish(stats):
+    """Closes the quarantine file and, if ENABLED, prints the number of values written, and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run
+    """
+    close()
+    if ENABLED:
+        print ('\nEliminated values written to {}: {:,}'.format(PATH, stats.quarantined.get('rows', 0)))
+    return
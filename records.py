@@ -0,0 +1,57 @@
+# Filename: records.py
+# Python 3.7
+# Notes:
+#    This is a module of main_process.py
+#    Not to be run independently -- Use 'python main_process.py'
+# Purpose: Lightweight stand ins for the ElementTree elements of a <node> or <way>
+
+# A Record has the tag, attrib and children of an Element, so "build_dictionary_element_tree"
+#   (in file "element_to_dictionary.py") and "fixer" (in file "fix_it.py") use it unchanged.
+# The PBF reader (in file "pbf_reader.py") and the workers of "pooled_process.py" build Records
+#   instead of Elements, and the element index (in file "element_index.py") reads the entity and
+#   character references of the attribute values with "entity".
+
+import re
+
+#====================================#
+#     Define regular expressions     #
+#====================================#
+
+entity_re = re.compile(r"&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);")
+
+entities = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+# ==================================================== #
+#               Record Type                            #
+# ==================================================== #
+
+class Record(object):
+    """Lightweight stand in for an ElementTree Element: a tag, an attrib dictionary and children."""
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib, children=()):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def __repr__(self):
+        return '<Record {} {}>'.format(self.tag, self.attrib)
+
+# ==================================================== #
+#               Helper Function                        #
+# ==================================================== #
+
+def entity(m):
+    """Returns the character of an entity or character reference match."""
+    ref = m.group(1)
+    if ref[:2] == '#x':
+        return chr(int(ref[2:], 16))
+    if ref[0] == '#':
+        return chr(int(ref[1:]))
+    return entities[ref]
@@ -0,0 +1,205 @@
+# Filename: resumable_process.py
+# Python 3.7
+# Purpose: Process the XML file with checkpoints so an interrupted run can be resumed
+
+# The OSM file is processed in byte range segments that start on a top level <node> or <way> element,
+#   read with the same "ShardFile" and "find_element_start" used by "parallel_process.py".
+# After each segment the csv files are flushed to disk and a checkpoint is saved with:
+#   the byte offset of the next segment, the length of each csv file, of the 'jsonl' event log
+#   (in file "event_log.py") and of the quarantine file (in file "quarantine.py"), and a snapshot of
+#   the "fix_it" dictionaries (in file "fix_it.py")
+# Running again with resume=True (or 'python resumable_process.py --resume') truncates the csv files,
+#   the event log and the quarantine file to the checkpoint lengths, restores the dictionaries, and carries
+#   on from the saved offset.
+# The csv files and the summary report are the same as an uninterrupted run of "process_xml_elements".
+
+import csv
+import os
+import pickle
+import sys
+import cerberus
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import compressed_input
+import element_to_dictionary
+import event_log
+import fix_it
+import main_process
+import parallel_process
+import pbf_reader
+import quarantine
+
+CHECKPOINT_PATH = 'process_checkpoint.pickle'
+CHECKPOINT_BYTES = 64 << 20      # Input bytes processed between checkpoints
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """Writes the checkpoint to a temporary file, replaces the previous checkpoint with it, and returns None.
+
+    Arguments:
+    checkpoint_path -- the checkpoint file name
+    checkpoint -- dictionary of the file name, file size, offset, csv lengths, event log length and fix_it snapshot
+    """
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'wb') as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, checkpoint_path)      # Atomic: a crash leaves the old or the new checkpoint
+    return
+
+def load_checkpoint(checkpoint_path, file_in):
+    """Returns the saved checkpoint, or None if there is no checkpoint for the XML file.
+
+    Arguments:
+    checkpoint_path -- the checkpoint file name
+    file_in -- the Open Street Map XML file to process
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    with open(checkpoint_path, 'rb') as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+
+    if checkpoint['file'] != os.path.abspath(file_in) or checkpoint['size'] != os.path.getsize(file_in):
+        print ('Checkpoint is for a different file: ', checkpoint['file'])
+        return None
+    return checkpoint
+
+def flush_csv_files(files):
+    """Flushes the csv files to disk and returns a dictionary of their lengths in bytes.
+
+    Arguments:
+    files -- dictionary of open csv files keyed by file name
+    """
+    lengths = {}
+    for path, csv_file in files.items():
+        csv_file.flush()
+        os.fsync(csv_file.fileno())
+        lengths[path] = os.path.getsize(path)
+    return lengths
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def process_xml_elements_resumable(file_in, validate, resume=False, checkpoint_path=CHECKPOINT_PATH,
+                                   checkpoint_bytes=CHECKPOINT_BYTES, key_stats=False, stats=None):
+    """Processes the XML file in segments, saving a checkpoint after each one.
+
+    Aborts execution if a problem occurs or returns None if successful
+
+    Writes the same csv files and prints the same report as the function process_xml_elements
+    (in file "main_process.py"); the checkpoint is removed when the run completes
+
+    Arguments:
+    file_in -- the Open Street Map XML file to process (uncompressed)
+    validate -- boolean switch to turn on or off validation
+    resume -- carry on from the last checkpoint instead of starting over
+    checkpoint_path -- the checkpoint file name
+    checkpoint_bytes -- input bytes processed between checkpoints
+    key_stats -- report the hit rate of the key cache (in file "element_to_dictionary.py")
+    stats -- the Stats (in file "fix_it.py") to count in, fix_it.default_stats if None
+    """
+    if compressed_input.is_compressed(file_in) or pbf_reader.is_pbf(file_in):
+        print ('Checkpoints need an uncompressed .osm file: ', file_in)
+        print ('\nTerminating execution...')
+        return None
+
+    stats = fix_it.default_stats if stats is None else stats
+    response = fix_it.initialize(stats)
+
+    if not response:
+        print ('Fatal Error initializing dictionaries')
+        print ('\nTerminating execution...')
+        return None
+
+    checkpoint = load_checkpoint(checkpoint_path, file_in) if resume else None
+    if resume and not checkpoint:
+        print ('No checkpoint found -- starting from the beginning of the file')
+
+    element_to_dictionary.clear_key_cache()
+    size = os.path.getsize(file_in)
+    offset = 0
+    files = {}
+    writers = {}
+
+    if checkpoint:
+        offset = checkpoint['offset']
+        stats.merge(checkpoint['stats'])
+        element_to_dictionary.merge_key_cache_counts(checkpoint.get('key_cache', {}))
+        event_log.start(length=checkpoint.get('events'))
+        quarantine.start(length=checkpoint.get('quarantine'))
+        for key, path, fields in main_process.CSV_TABLES:
+            with open(path, 'r+b') as csv_file:
+                csv_file.truncate(checkpoint['lengths'][path])     # Drop rows written after the checkpoint
+            files[path] = open(path, 'a')
+            writers[key] = csv.DictWriter(files[path], fieldnames = fields)
+        print ('Resuming at byte {:,} of {:,}'.format(offset, size))
+    else:
+        event_log.start()
+        quarantine.start()
+        for key, path, fields in main_process.CSV_TABLES:
+            files[path] = open(path, 'w')
+            writers[key] = csv.DictWriter(files[path], fieldnames = fields)
+            writers[key].writeheader()
+
+    validator = cerberus.Validator()
+
+    print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
+
+    try:
+        with open(file_in, 'rb') as osm_file:
+            while offset < size:
+                end = parallel_process.find_element_start(osm_file, offset + checkpoint_bytes, offset)
+                if end is None:           # Only <relation> elements are left
+                    end = size
+
+                segment = parallel_process.ShardFile(file_in, offset, end)
+                try:
+                    for element_tree in main_process.get_element_tree(segment, tags=('node', 'way'), stats=stats):
+                        main_process.write_element(element_tree, writers, validator, validate, stats)
+                finally:
+                    segment.close()
+
+                if end < size:            # The segment counted its own <osm> root element
+                    stats.counts['element count'] -= 1
+                    stats.counts['not a node or way count'] -= 1
+
+                offset = end
+                save_checkpoint(checkpoint_path, {'file': os.path.abspath(file_in), 'size': size,
+                                                  'offset': offset, 'lengths': flush_csv_files(files),
+                                                  'stats': stats.snapshot(), 'events': event_log.flush(),
+                                                  'quarantine': quarantine.flush(),
+                                                  'key_cache': element_to_dictionary.key_cache_counts()})
+    finally:
+        for csv_file in files.values():
+            csv_file.close()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    main_process.print_summary(stats)
+    fix_it.print_detailed_fixes(stats)
+    print ()
+    if validate is True:
+        print ('Validation... Passed')
+    print ('\nCSV files created')
+    if key_stats:
+        element_to_dictionary.print_key_cache_stats()
+    event_log.finish(stats)
+    quarantine.finish(stats)
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    process_xml_elements_resumable(main_process.OSM_PATH, validate = True, resume = '--resume' in sys.argv)
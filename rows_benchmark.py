@@ -0,0 +1,151 @@
+# Filename: rows_benchmark.py
+# Python 3.7
+# Purpose: Compare the dictionary rows, the compact tuple rows and the columnar way node rows of the csv files
+
+# "build_dictionary_element_tree" (in file "element_to_dictionary.py") returns a dictionary for every
+#   child <tag> and <nd>, written with csv.DictWriter by "write_element" (in file "main_process.py").
+# "build_rows_element_tree" returns tuples in csv column order instead, written with csv.writer by
+#   "write_element_compact", or "process_xml_elements(..., compact=True)".
+# The columnar rows are the compact rows with the way node rows held in the typed arrays of a
+#   "WayNodeColumns" batch and written in blocks, or "process_xml_elements(..., columnar=True)".
+# This benchmark reads the elements of an OSM file into memory once, then for each representation:
+#   the CPU time to build and write the rows of every element (best of several interleaved runs), and
+#   the memory and the number of memory blocks taken by the rows of all the elements (tracemalloc).
+# Validation is off: Cerberus needs dictionaries and costs the same for both.
+#
+# 'python rows_benchmark.py [file]' prints the comparison
+
+import contextlib
+import csv
+import io
+import sys
+import time
+import tracemalloc
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import element_to_dictionary
+import fix_it
+import main_process
+from records import Record
+
+RUNS = 5        # Interleaved timing runs of each representation
+
+MODES = ['dictionary', 'compact', 'columnar']
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def load_elements(file_in):
+    """Returns a list of Records of the <node> and <way> elements of the file.
+
+    Arguments:
+    file_in -- the Open Street Map file to read
+    """
+    fix_it.initialize()
+    return [Record(e.tag, dict(e.attrib), [Record(c.tag, dict(c.attrib)) for c in e])
+            for e in main_process.get_element_tree(file_in, tags=('node', 'way'))]
+
+def make_writers(mode):
+    """Returns a dictionary of csv writers into memory, keyed as the writers of process_xml_elements.
+
+    Arguments:
+    mode -- 'dictionary' for csv.DictWriter objects, else csv.writer objects
+    """
+    writers = {}
+    for key, path, fields in main_process.CSV_TABLES:
+        if mode != 'dictionary':
+            writers[key] = csv.writer(io.StringIO())
+        else:
+            writers[key] = csv.DictWriter(io.StringIO(), fieldnames = fields)
+    return writers
+
+def time_write(elements, mode):
+    """Returns the CPU seconds to build and write the rows of all the elements.
+
+    Arguments:
+    elements -- list of element Records
+    mode -- 'dictionary', 'compact' or 'columnar'
+    """
+    writers = make_writers(mode)
+    fix_it.initialize()
+    with contextlib.redirect_stdout(io.StringIO()):      # The corrections printed by the fixers
+        start = time.process_time()
+        if mode == 'columnar':
+            columns = element_to_dictionary.WayNodeColumns()
+            for element in elements:
+                main_process.write_element_columnar(element, writers, None, False, columns)
+            element_to_dictionary.write_way_node_columns(columns, writers['way_nodes'])
+        else:
+            write = main_process.write_element_compact if mode == 'compact' else main_process.write_element
+            for element in elements:
+                write(element, writers, None, False)
+        return time.process_time() - start
+
+def measure_rows(elements, mode):
+    """Returns the bytes and the number of memory blocks taken by the rows of all the elements.
+
+    Arguments:
+    elements -- list of element Records
+    mode -- 'dictionary', 'compact' or 'columnar'
+    """
+    if mode == 'columnar':
+        columns = element_to_dictionary.WayNodeColumns()
+        build = lambda element: element_to_dictionary.build_rows_element_tree(element, way_node_columns=columns)
+    elif mode == 'compact':
+        build = element_to_dictionary.build_rows_element_tree
+    else:
+        build = element_to_dictionary.build_dictionary_element_tree
+    fix_it.initialize()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        rows = [build(element) for element in elements]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    size = 0
+    blocks = 0
+    for stat in after.compare_to(before, 'filename'):
+        if stat.traceback[0].filename == element_to_dictionary.__file__:   # Allocated by the builder
+            size += stat.size_diff
+            blocks += stat.count_diff
+    del rows
+    return size, blocks
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def benchmark(file_in, runs=RUNS):
+    """Prints the time and memory of the dictionary, compact and columnar rows of the file, returns None.
+
+    Arguments:
+    file_in -- the Open Street Map file to read
+    runs -- the number of interleaved timing runs
+    """
+    elements = load_elements(file_in)
+    times = {mode: [] for mode in MODES}
+    for run in range(runs):
+        for mode in MODES:
+            times[mode].append(time_write(elements, mode))
+
+    print ('\nCSV ROWS: {:,} nodes and ways\n'.format(len(elements)))
+    print ('    {:<12} {:>14} {:>18} {:>14} {:>16}'.format('Rows', 'Build+write s', 'Elements/second',
+                                                          'Rows MB', 'Memory blocks'))
+    for mode in MODES:
+        seconds = min(times[mode])
+        size, blocks = measure_rows(elements, mode)
+        print ('    {:<12} {:>14.3f} {:>18,.0f} {:>14.1f} {:>16,}'.format(mode, seconds, len(elements) / seconds,
+                                                                       size / 1e6, blocks))
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else main_process.OSM_PATH)
@@ -0,0 +1,152 @@
+# Filename: street_benchmark.py
+# Python 3.7
+# Purpose: Compare the compiled street normalizer of fix_streets with the rule by rule scan it replaced
+
+# "fix_streets" (in file "fix_it.py") looks the street kind up in rules.street_mapping with one get,
+#   finds every direction abbreviation of the name with rules.direction_keys (one scan of rules.direction_re), and
+#   checks the street against the sets rules.ok_street_set and rules.abbreviation_set.
+# "fix_streets_scan" below is the former version, kept as the reference: a membership test on
+#   street_mapping.keys(), one substring test per key of direction_mapping and list searches.
+# This benchmark reads every addr:street value of an OSM file, checks that both versions return the
+#   same values and leave the same Stats, then times each over all the values (best of several
+#   interleaved runs). The fixers are called directly, without the fixer memo.
+#
+# 'python street_benchmark.py [file]' prints the comparison
+
+import contextlib
+import io
+import sys
+import time
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import fix_it
+import main_process
+from fix_it import record_fix, report, street_problem, update_street_city
+
+RUNS = 5        # Interleaved timing runs of each version
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def fix_streets_scan(name, node_or_way, stats):
+    """The rule by rule version of fix_streets: returns the corrected value or None if data is eliminated.
+
+    Arguments:
+    name -- the value of the addr:street key
+    node_or_way -- Indicates XML element tag is a <node> or <way>
+    stats -- the Stats of the run
+    """
+    if not name or name.isspace():
+        report (stats, 'warning', 'street', node_or_way, ': Street problem removed from dataset -- street is null or whitespace  ', name)
+        fix_it.tally(stats, 'streets_issue', name)
+        fix_it.tally(stats, 'counts', 'value eliminated')
+        return None
+
+    name = name.strip()
+    flag = True
+    name = name.rsplit(' ', 1)
+    if len(name) == 1:
+        street = name[0]
+        name = name[0]
+        flag = False
+    else:
+        street = name[1]
+        name = name[0]
+
+    street_mapping = fix_it.rules.street_mapping
+    direction_mapping = fix_it.rules.direction_mapping
+    if street in street_mapping.keys():
+        better_street = update_street_city(street, street_mapping, stats)
+        if better_street:
+            record_fix(stats, 'streets_fix', 'streets_dict', street, better_street)
+            street = better_street
+        else:
+            return street_problem(name, street, node_or_way, stats)
+
+    for k in direction_mapping.keys():
+        if k in name:
+            better_name = name.replace(k, update_street_city(k, direction_mapping, stats))
+            record_fix(stats, 'streets_fix', 'streets_dict', name, better_name)
+            name = better_name
+
+    if street.isalnum():
+        if street not in fix_it.rules.ok_streets:
+            if street[-2:] in fix_it.rules.abbreviations:
+                report (stats, 'info', 'street', 'Street with issue allowed ... name: ', name, '  street: ', street)
+            else:
+                return street_problem(name, street, node_or_way, stats)
+    else:
+        return street_problem(name, street, node_or_way, stats)
+
+    if flag:
+        name = name + ' ' + street
+    return name
+
+def load_streets(file_in):
+    """Returns a list of (value, node_or_way) of every addr:street tag of the file.
+
+    Arguments:
+    file_in -- the Open Street Map file to read
+    """
+    streets = []
+    for element in main_process.get_element_tree(file_in, tags=('node', 'way')):
+        for child in element.iter('tag'):
+            if child.attrib['k'] == 'addr:street':
+                streets.append((child.attrib['v'], element.tag))
+    return streets
+
+def run(function, streets):
+    """Returns the CPU seconds, the results and the Stats snapshot of the fixer over all the values.
+
+    Arguments:
+    function -- fix_it.fix_streets or fix_streets_scan
+    streets -- list of (value, node_or_way)
+    """
+    stats = fix_it.Stats()
+    with contextlib.redirect_stdout(io.StringIO()) as output:      # The messages of the fixer
+        start = time.process_time()
+        results = [function(value, node_or_way, stats) for value, node_or_way in streets]
+        seconds = time.process_time() - start
+    return seconds, (results, stats.snapshot(), output.getvalue())
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def benchmark(file_in, runs=RUNS):
+    """Prints the time of the compiled and the rule by rule street normalizer over the file, returns None.
+
+    Arguments:
+    file_in -- the Open Street Map file to read
+    runs -- the number of interleaved timing runs
+    """
+    streets = load_streets(file_in)
+    versions = [('compiled', fix_it.fix_streets), ('rule scan', fix_streets_scan)]
+    times = {label: [] for label, function in versions}
+    outcomes = {}
+    for i in range(runs):
+        for label, function in versions:
+            seconds, outcomes[label] = run(function, streets)
+            times[label].append(seconds)
+
+    same = outcomes['compiled'] == outcomes['rule scan']
+    print ('\nSTREET NORMALIZER: {:,} addr:street values, {:,} distinct\n'.format(len(streets),
+                                                                             len(set(streets))))
+    print ('    {:<12} {:>12} {:>18} {:>14}'.format('Version', 'Seconds', 'Values/second', 'us/value'))
+    for label, function in versions:
+        seconds = max(min(times[label]), 1e-9)
+        print ('    {:<12} {:>12.3f} {:>18,.0f} {:>14.2f}'.format(label, seconds, len(streets) / seconds,
+                                                               seconds * 1e6 / max(len(streets), 1)))
+    print ('\nSame values, Stats and messages:', same)
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else main_process.OSM_PATH)
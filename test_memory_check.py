@@ -0,0 +1,45 @@
+# Filename: test_memory_check.py
+# Python 3.7
+# Notes:
+#    Run with 'python -m pytest -m slow test_memory_check.py'
+# Purpose: Fail the test run when an XML reader no longer keeps memory flat on relation heavy files
+
+# Each reader of READERS (in file "memory_check.py") reads a small file and a relation heavy file in a
+#   new Python process; the peak resident memory (RSS) may grow by at most RSS_LIMIT_MB between them.
+
+import pytest
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import memory_check
+
+# ==================================================== #
+#               Fixtures                               #
+# ==================================================== #
+
+@pytest.fixture(scope='module')
+def osm_files(tmp_path_factory):
+    """Returns the names of the small and the relation heavy synthetic OSM files, written once."""
+    temp_dir = tmp_path_factory.mktemp('memory_check')
+    small_file = str(temp_dir / 'small.osm')
+    large_file = str(temp_dir / 'relations.osm')
+    memory_check.write_osm_file(small_file, memory_check.SMALL_RELATIONS)
+    memory_check.write_osm_file(large_file, memory_check.RELATIONS)
+    return small_file, large_file
+
+# ================================================== #
+#               Checks                               #
+# ================================================== #
+
+@pytest.mark.slow
+@pytest.mark.parametrize('name, code', memory_check.READERS, ids=[name for name, code in memory_check.READERS])
+def test_peak_rss_flat(osm_files, name, code):
+    """The peak memory of the reader grows by at most RSS_LIMIT_MB on the relation heavy file."""
+    small_file, large_file = osm_files
+    small = memory_check.peak_rss_mb(code, small_file)
+    large = memory_check.peak_rss_mb(code, large_file)
+    assert large - small <= memory_check.RSS_LIMIT_MB, \
+        '{} peaks at {:.1f} MB on {:,} relations, {:.1f} MB on {:,}'.format(
+            name, large, memory_check.RELATIONS, small, memory_check.SMALL_RELATIONS)
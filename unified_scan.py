@@ -0,0 +1,137 @@
+# Filename: unified_scan.py
+# Python 3.7
+# Purpose: Profile, clean and count the XML file in a single pass
+
+# The initial scan (in file "initial_scan.py"), the main process (in file "main_process.py") and the
+#   XML tag counts of the reconciliation (in file "xml_csv_validation_routines.py") each parse the
+#   whole OSM file.
+# This routine parses the file once and sends every element to all three:
+#   "count_element" (in file "initial_scan.py") profiles the problem data
+#   "write_element" (in file "main_process.py") cleans <node> and <way> elements into the csv files
+#   "count_element" (in file "xml_csv_validation_routines.py") counts the raw XML tags
+# The CSV record counts come from the rows written, so the reconciliation table needs no extra I/O.
+
+import csv
+import cerberus
+
+#==========================#
+#     Import .py files     #
+#==========================#
+
+import event_log
+import fix_it
+import initial_scan
+import main_process
+import quarantine
+import xml_csv_validation_routines
+
+# ==================================================== #
+#               Helper Functions                       #
+# ==================================================== #
+
+def initialize_all(stats=None):
+    """Clears the dictionaries of the three routines and returns a boolean.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") to clear, fix_it.default_stats if None
+    """
+    return bool(fix_it.initialize(stats) and initial_scan.initialize_dicts() and
+                xml_csv_validation_routines.initialize())
+
+def save_csv_counts(stats=None):
+    """Saves the number of rows written to each csv file, plus the header row, and returns None.
+
+    Arguments:
+    stats -- the Stats (in file "fix_it.py") of the run, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    csv_counts = xml_csv_validation_routines.csv_counts
+    csv_counts['nodes_row_count'] = stats.counts['node count'] + 1
+    csv_counts['nodes_tags_row_count'] = stats.counts['node tag count'] + 1
+    csv_counts['ways_row_count'] = stats.counts['way count'] + 1
+    csv_counts['ways_tags_row_count'] = stats.counts['way tag count'] + 1
+    csv_counts['ways_nodes_row_count'] = stats.counts['way node tag count'] + 1
+    return
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+def unified_scan(file_in, validate, stats=None):
+    """Parses the XML file once to profile, clean and count the data, prints the reports, and returns None.
+
+    Aborts execution if a problem occurs
+
+    Each element is counted by the initial scan and the XML tag count before a <node> or <way>
+    is cleaned, because cleaning rewrites some tag keys
+
+    Arguments:
+    file_in -- the Open Street Map file to process (.osm, .osm.bz2, .osm.gz, .osm.xz or .osm.pbf)
+    validate -- boolean switch to turn on or off validation
+    stats -- the Stats (in file "fix_it.py") to count in, fix_it.default_stats if None
+    """
+    stats = fix_it.default_stats if stats is None else stats
+    response = initialize_all(stats)
+
+    if not response:
+        print ('Fatal Error initializing dictionaries')
+        print ('\nTerminating execution...')
+        return None
+
+    event_log.start()
+    quarantine.start()
+
+    with open(main_process.NODES_PATH, 'w') as nodes_file, \
+         open(main_process.NODE_TAGS_PATH, 'w') as nodes_tags_file, \
+         open(main_process.WAYS_PATH, 'w') as ways_file, \
+         open(main_process.WAY_NODES_PATH, 'w') as way_nodes_file, \
+         open(main_process.WAY_TAGS_PATH, 'w') as way_tags_file:
+
+        files = {'node': nodes_file, 'node_tags': nodes_tags_file, 'way': ways_file,
+                 'way_nodes': way_nodes_file, 'way_tags': way_tags_file}
+        writers = {}
+        for key, path, fields in main_process.CSV_TABLES:
+            writers[key] = csv.DictWriter(files[key], fieldnames = fields)
+            writers[key].writeheader()
+
+        validator = cerberus.Validator()
+
+        print ("\nDATA CORRECTIONS AND ELIMINATIONS\n")
+
+        for element in xml_csv_validation_routines.element_tree(file_in):     # XML or PBF file
+            initial_scan.count_element(element)
+            initial_scan.counts['record_count'] += 1
+            xml_csv_validation_routines.count_element(element)
+
+            stats.counts['element count'] += 1
+            if element.tag in ('node', 'way'):
+                main_process.write_element(element, writers, validator, validate, stats)
+            else:
+                stats.counts['not a node or way count'] += 1
+
+    print ('\n-----------------')
+    print ('INITIAL DATA SCAN\n')
+    initial_scan.print_initial_scan()
+
+    main_process.print_summary(stats)
+    fix_it.print_detailed_fixes(stats)
+
+    xml_csv_validation_routines.print_tag_counts()
+    save_csv_counts(stats)
+    xml_csv_validation_routines.print_csv_counts()
+    xml_csv_validation_routines.make_table()
+
+    print ()
+    if validate is True:
+        print ('Validation... Passed')
+    print ('\nCSV files created')
+    event_log.finish(stats)
+    quarantine.finish(stats)
+    return
+
+#========================#
+#         Runner         #
+#========================#
+
+if __name__ == '__main__':
+    unified_scan(main_process.OSM_PATH, validate = True)
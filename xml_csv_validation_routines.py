@@ -19,42 +19,37 @@ def csv_row_count():
         print ("Cannot find CSV files...")
         sys.exit()
 
-    print ('\nCSV FILE RECORD COUNTS\n')
-
     with open('nodes.csv', 'r') as csv_file:
         reader = csv.reader(csv_file)   # comma is default delimiter
         csv_counts['nodes_row_count'] = sum(1 for row in reader)
 
-    print ('Node number of rows: {:,}'.format(csv_counts['nodes_row_count'] - 1))  # Subtract header row
-    csv_file.close()
-
     with open('nodes_tags.csv', 'r') as csv_file:
         reader = csv.reader(csv_file)   # comma is default delimiter
         csv_counts['nodes_tags_row_count'] = sum(1 for row in reader)
 
-    print ('Node tags number of rows: {:,}'.format(csv_counts['nodes_tags_row_count'] - 1))  # Subtract header row
-    csv_file.close()
-
     with open('ways.csv', 'r') as csv_file:
         reader = csv.reader(csv_file)   # comma is default delimiter
         csv_counts['ways_row_count'] = sum(1 for row in reader)
 
-    print ('\nWay number of rows: {:,}'.format(csv_counts['ways_row_count'] - 1))  # Subtract header row
-    csv_file.close()
-
     with open('ways_tags.csv', 'r') as csv_file:
         reader = csv.reader(csv_file)   # comma is default delimiter
         csv_counts['ways_tags_row_count'] = sum(1 for row in reader)
 
-    print ('Way tags number of rows: {:,}'.format(csv_counts['ways_tags_row_count'] - 1))  # Subtract header row
-    csv_file.close()
-
     with open('ways_nodes.csv', 'r') as csv_file:
         reader = csv.reader(csv_file)   # comma is default delimiter
         csv_counts['ways_nodes_row_count'] = sum(1 for row in reader)
 
+    print_csv_counts()
+    return
+
+def print_csv_counts():
+    """Prints the number of rows in the CSV files counted in csv_counts and returns None."""
+    print ('\nCSV FILE RECORD COUNTS\n')
+    print ('Node number of rows: {:,}'.format(csv_counts['nodes_row_count'] - 1))  # Subtract header row
+    print ('Node tags number of rows: {:,}'.format(csv_counts['nodes_tags_row_count'] - 1))  # Subtract header row
+    print ('\nWay number of rows: {:,}'.format(csv_counts['ways_row_count'] - 1))  # Subtract header row
+    print ('Way tags number of rows: {:,}'.format(csv_counts['ways_tags_row_count'] - 1))  # Subtract header row
     print ('Way Node number of rows: {:,}'.format(csv_counts['ways_nodes_row_count'] - 1))  # Subtract header row
-    csv_file.close()
     return
 
 
@@ -126,6 +121,10 @@ def separator(dict):
 
 import xml.etree.cElementTree as ET
 
+import compressed_input
+import element_to_dictionary
+import pbf_reader
+
 def element_tree(osm_file):
     """Parse XML file data and yield an element tree.
        
@@ -133,8 +132,13 @@ def element_tree(osm_file):
     as a tree of the element
     
     Arguments:
-    osm_file -- the Open Street Map XML file to process
+    osm_file -- the Open Street Map file to process (.osm, .osm.bz2, .osm.gz, .osm.xz or .osm.pbf)
     """
+    if pbf_reader.is_pbf(osm_file):                  # Same elements, in the same order as the XML end events
+        yield from pbf_reader.iter_elements(osm_file)
+        return
+    
+    osm_file = compressed_input.open_osm(osm_file)   # Plain or compressed file
     context = ET.iterparse(osm_file, events=('start', 'end'))
     _, root = next(context)      # root saves a reference to the iterator (block of XML) currently in process
  
@@ -144,6 +148,7 @@ def element_tree(osm_file):
             root.clear()
     
     del context
+    osm_file.close()
     return
 
 def count_xml_tags(filename):
@@ -155,65 +160,74 @@ def count_xml_tags(filename):
     filename -- the Open Street Map XML file to process
     """
     for element in element_tree(filename):
-        bad_id = False
-        tags[element.tag] += 1
-        
-        if element.tag == 'node':
-            check = check_id(element.attrib['id'])
-            if not check:
-                print ('Node ID is Null or not a number: ', element.attrib['id'])
-                problem_counts['node id bad'] += 1
-                bad_id = True     # No continue here because counting ALL tags
-                
-        if element.tag == 'way':
-            check = check_id(element.attrib['id'])
-            if not check:
-                print ('Way ID is Null or not a number: ', element.attrib['id'])
-                problem_counts['way id bad'] += 1
-                bad_id = True     # No continue here because counting ALL tags
-        
-        for child in element:
-            if child.tag == 'nd':     # Check the 'nd' way node element for ID
-                if bad_id:
-                    problem_counts['nd bad'] += 1
-                    print ('Way node ID is bad: ', element.attrib['id'])
-                else:
-                    check = check_id(child.attrib['ref'])    # Check the 'nd' way node element for reference ID
-                    if not check:
-                        problem_counts['nd bad'] += 1
-                        print ('Way node reference is bad: ', child.attrib['ref'])
-                
-            if child.tag == 'tag' and (child.attrib['k'] in valid_keys) and bad_id:    # Valid keys with bad ID
-                if element.tag == 'node':
-                    print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  id = ', element.attrib['id'], '   Problem: Corrupt ID')
-                    problem_counts['node tag bad'] += 1
-                if element.tag == 'way':
-                    print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  v = ', child.attrib['v'],'  id = ', element.attrib['id'], '   Problem: Corrupt ID')
-                    problem_counts['way tag bad'] += 1
-                        
-            if child.tag == 'tag' and (element.tag in ['node', 'way']) and not bad_id:  #Note: Bad keys with good ID
-                m = not correct_chars_re.search(child.attrib['k'])         # Check for corrupt keys
-                if m and not ('cityracks' in child.attrib['k']):
-                    if element.tag == 'node':
-                        print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  id = ', element.attrib['id'], '   Problem: Corrupt key')
-                        problem_counts['node key bad'] += 1
-                    if element.tag == 'way':
-                        print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  id = ', element.attrib['id'], '   Problem: Corrupt key')
-                        problem_counts['way key bad'] += 1
+        count_element(element)
+    
+    return
+
+def count_element(element):
+    """Counts the tag and the valid child tags of one element, records any problem, and returns None.
+    
+    Arguments:
+    element -- the current element tree in the XML file iteration
+    """
+    bad_id = False
+    tags[element.tag] += 1
+    
+    if element.tag == 'node':
+        check = check_id(element.attrib['id'])
+        if not check:
+            print ('Node ID is Null or not a number: ', element.attrib['id'])
+            problem_counts['node id bad'] += 1
+            bad_id = True     # No continue here because counting ALL tags
             
-            try:
-                child_key = child.attrib['k']
-            except:
-                child_key = None
-                continue
+    if element.tag == 'way':
+        check = check_id(element.attrib['id'])
+        if not check:
+            print ('Way ID is Null or not a number: ', element.attrib['id'])
+            problem_counts['way id bad'] += 1
+            bad_id = True     # No continue here because counting ALL tags
+    
+    for child in element:
+        if child.tag == 'nd':     # Check the 'nd' way node element for ID
+            if bad_id:
+                problem_counts['nd bad'] += 1
+                print ('Way node ID is bad: ', element.attrib['id'])
+            else:
+                check = check_id(child.attrib['ref'])    # Check the 'nd' way node element for reference ID
+                if not check:
+                    problem_counts['nd bad'] += 1
+                    print ('Way node reference is bad: ', child.attrib['ref'])
             
-            if (element.tag in ['node', 'way']) and (child_key in valid_keys):
-                children[element.tag + ' ' + child_key] += 1
-                children['Total child tags'] += 1
+        if child.tag == 'tag' and (child.attrib['k'] in valid_keys) and bad_id:    # Valid keys with bad ID
+            if element.tag == 'node':
+                print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  id = ', element.attrib['id'], '   Problem: Corrupt ID')
+                problem_counts['node tag bad'] += 1
+            if element.tag == 'way':
+                print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  v = ', child.attrib['v'],'  id = ', element.attrib['id'], '   Problem: Corrupt ID')
+                problem_counts['way tag bad'] += 1
+                    
+        if child.tag == 'tag' and (element.tag in ['node', 'way']) and not bad_id:  #Note: Bad keys with good ID
+            if element_to_dictionary.key_is_corrupt(child.attrib['k']):     # Check for corrupt keys (cached)
                 if element.tag == 'node':
-                    children['Total node tags'] += 1
-                else:
-                    children['Total way tags'] += 1
+                    print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  id = ', element.attrib['id'], '   Problem: Corrupt key')
+                    problem_counts['node key bad'] += 1
+                if element.tag == 'way':
+                    print ('   ', element.tag.capitalize(), ':  k = ', child.attrib['k'], '  id = ', element.attrib['id'], '   Problem: Corrupt key')
+                    problem_counts['way key bad'] += 1
+        
+        try:
+            child_key = child.attrib['k']
+        except:
+            child_key = None
+            continue
+        
+        if (element.tag in ['node', 'way']) and (child_key in valid_keys):
+            children[element.tag + ' ' + child_key] += 1
+            children['Total child tags'] += 1
+            if element.tag == 'node':
+                children['Total node tags'] += 1
+            else:
+                children['Total way tags'] += 1
     
     return
 
@@ -228,7 +242,11 @@ def count_all_tags():
     print ('\n---------------------')
     print ('XML FILE TAG PROBLEMS\n')
     count_xml_tags(map_file)
-    
+    print_tag_counts()
+    return
+
+def print_tag_counts():
+    """Formats the tag counts with the thousands separator, prints a report, and returns None."""
     total = sum(tags.values())
     
     separator(tags)